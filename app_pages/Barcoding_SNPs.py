@@ -1,8 +1,8 @@
 import warnings
-import pandas as pd
 import streamlit as st
 
 from st_aggrid import AgGrid, GridUpdateMode, ColumnsAutoSizeMode, GridOptionsBuilder
+from tbgen.panel import get_panel
 from utils import (
     set_page_config,
     sidebar_image,
@@ -10,6 +10,7 @@ from utils import (
     home_page,
     get_cell_style,
     author_link,
+    download_table,
     # back_button,
 )
 
@@ -20,72 +21,32 @@ def page_info():
         unsafe_allow_html=True,
     )
     st.caption("Curated list of barcoding SNPs")
-    dataset = load_dataset()
-    long_df = load_long_levels()
-
-    tsv = convert_df_to_tsv(dataset)
-    csv = convert_df_to_csv(dataset)
-
-    long_df_tsv = convert_df_to_tsv(long_df)
-    long_df_csv = convert_df_to_csv(long_df)
 
+    # The tables are only serialized when a download is requested
     with st.expander("Download"):
-        dwn1, dwn2, dwn3, dwn4, mock = st.columns([3, 3, 5, 5, 7])
-
-        with dwn1:
-            st.download_button(
-                label="💾 Download TSV",
-                data=tsv,
-                file_name="snp_barcode.tsv",
-                mime="text/csv",
-            )
-        with dwn2:
-            st.download_button(
-                label="💾 Download CSV",
-                data=csv,
-                file_name="snp_barcode.csv",
-                mime="text/csv",
-            )
-        with dwn3:
-            st.download_button(
-                label="💾 Download TSV (long format)",
-                data=long_df_tsv,
-                file_name="snp_barcode_long.tsv",
-                mime="text/csv",
-            )
-        with dwn4:
-            st.download_button(
-                label="💾 Download CSV (long format)",
-                data=long_df_csv,
-                file_name="snp_barcode_long.tsv",
-                mime="text/csv",
-            )
-        with mock:
-            pass
+        download_table(load_dataset, "snp_barcode", "barcode", "barcoding SNPs")
+        download_table(
+            load_long_levels,
+            "snp_barcode_long",
+            "barcode-long",
+            "barcoding SNPs (long format)",
+        )
 
 
+# The tables are read from the compiled barcode panel, the same one the lineages are
+# called with on the Genotype page
 @st.cache_data
 def load_dataset():
-    df = pd.read_csv("./data/snp_barcode.tsv", sep="\t")
+    df = get_panel().barcode_table()
     return df
 
 
 @st.cache_data
 def load_long_levels():
-    df = pd.read_csv("./data/levels.tsv", sep="\t")
+    df = get_panel().levels_table()
     return df
 
 
-@st.cache_data()
-def convert_df_to_tsv(df):
-    return df.to_csv(sep="\t", index=False).encode("utf-8")
-
-
-@st.cache_data(show_spinner=False)
-def convert_df_to_csv(df):
-    return df.to_csv(index=False).encode("utf-8")
-
-
 def show_dataset():
     with warnings.catch_warnings():
         warnings.simplefilter(action="ignore", category=FutureWarning)
@@ -4,10 +4,15 @@ import numpy as np
 import pandas as pd
 import streamlit as st
 
-from typing import TextIO
 from gzip import BadGzipFile
-from gzip import open as gzopen
-from tempfile import NamedTemporaryFile
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from streamlit.logger import get_logger
+from tbgen.batch import format_elapsed
+from tbgen.cache import ResultCache
+from tbgen.jobs import JobManager
+from tbgen.profiling import summarize_stats
+from tbgen.sniff import VcfFormatError
 from utils import (
     set_page_config,
     sidebar_image,
@@ -18,6 +23,7 @@ from utils import (
     lottie_warning,
     lottie_arrow,
     lottie_spinner,
+    download_table,
 )
 
 
@@ -45,9 +51,10 @@ def info_box():
     with box.container():
         st.markdown(
             """
-            Use your own **:blue[.VCF]** or **:blue[.VCF.GZ]** files as input to call lineage  \n
+            Use your own **:blue[.VCF]**, **:blue[.VCF.GZ]** or **:blue[.BCF]** files as input to call lineage  \n
             - You can use both **:green[single-]** or **:green[multi-sample]** **:blue[.VCF]** files
             - Accepts **:green[multiple]** **:blue[.VCF]** files at a time
+            - Upload the **:blue[.TBI]** or **:blue[.CSI]** index along with a bgzipped **:blue[.VCF.GZ]** file, or the **:blue[.CSI]** index along with a **:blue[.BCF]** file, to read only the barcoding positions
             - Variants should be called by mapping to the [NC_000962.3](https://www.ncbi.nlm.nih.gov/nuccore/NC_000962.3/) _M. tuberculosis_ H37Rv genome
             - It is preferable for variants to be filtered and contain only high quality calls
             """
@@ -98,260 +105,280 @@ def lottie_container(message_string, message_type, icon, lottie_function):
             pass
 
 
-@st.cache_data()
-def convert_df_to_file(df, file_format="csv", sep=","):
-    if file_format == "csv":
-        return df.to_csv(sep=sep, index=False).encode("utf-8")
-    elif file_format == "tsv":
-        return df.to_csv(sep="\t", index=False).encode("utf-8")
-    else:
-        raise ValueError(f"Unsupported file format: {file_format}")
-
-
-@st.cache_data()
-def get_levels_data():
-    temp_df = pd.read_csv("./data/levels.tsv", sep="\t")
-    uniqueLevels = temp_df["level"].unique()
-    levelsDict = {}
-
-    # For each unique level value, extract the relevant data and store it in the dictionary
-    for elem in uniqueLevels:
-        levelsDict[elem] = temp_df[temp_df["level"] == elem][
-            ["POS", "REF", "ALT", "lineage"]
-        ]
-
-    # Create a tuple of NumPy arrays, where each array contains the data for a different level
-    # Each array contains the positional data, the reference allele, the alternate allele,
-    # and the lineage (i.e., the level value) for each row in the data
-    # The tuple contains data for levels 1 through 5
-    levels_data = tuple(
-        levelsDict.get(i, pd.DataFrame())[["POS", "REF", "ALT", "lineage"]].to_numpy().T
-        for i in range(1, 6)
-    )
-
-    pos = temp_df["POS"].values
-
-    return levels_data, pos
-
-
-@st.cache_data(show_spinner=False)
-def vcf_to_dataframe(file: TextIO):
-    pos_all = get_levels_data()[1]
-
-    # Remove all header lines from the input file
-    lines = [line.strip() for line in file if not line.startswith("##")]
-
-    # Extract the sample names from the first header line
-    header = lines.pop(0).split("\t")[9:]
-
-    # Extract data from each line of the input file and convert it to a list
-    data = []
-    for line in lines:
-        fields = line.split("\t")
-        pos, ref, alt = fields[1], fields[3], fields[4]
-        alleles = [ref] + alt.split(",")
-        genotypes = [genotype.split(":") for genotype in fields[9:]]
-        for i, gt in enumerate(genotypes):
-            if gt[0] == "." or gt[0] == "./." or gt[0] == ".|.":
-                allele = np.nan
-            elif "/" in gt[0]:
-                alleles_list = [
-                    alleles[int(x)] if x != "." else np.nan for x in gt[0].split("/")
-                ]
-                allele = "/".join([x for x in alleles_list if str(x) != "nan"])
-            elif "|" in gt[0]:
-                alleles_list = [
-                    alleles[int(x)] if x != "." else np.nan for x in gt[0].split("|")
-                ]
-                allele = "|".join([x for x in alleles_list if str(x) != "nan"])
-            else:
-                allele = alleles[int(gt[0])]
-            data.append([header[i], pos, ref, allele])
-
-    # Convert the list of data to a Pandas DataFrame
-    df = pd.DataFrame(data, columns=["Sample", "POS", "REF", "ALT"])
+# Maximum number of files genotyped at the same time
+MAX_WORKERS = os.cpu_count() or 1
 
-    # Set the data types for each column in the DataFrame
-    df = df.astype(
-        {"Sample": "object", "REF": "object", "ALT": "object", "POS": "int64"}
-    )
-
-    # Strip "/" and "|"
-    df["ALT"] = df["ALT"].str.split(r"[/|]").str[-1]
+# Interval, in seconds, at which the progress of a running job is refreshed
+POLL_INTERVAL = 0.25
 
-    # Filter the DataFrame to only include rows with positions in the pos_all list
-    df = df.loc[df["POS"].isin(pos_all)]
+# Minimum interval, in seconds, between two updates of the partial results of a job
+PARTIAL_RESULTS_INTERVAL = 1.0
 
-    # Return the filtered DataFrame
-    return df
 
+# The process pool is shared between all sessions, so the number of files genotyped at
+# the same time is bounded for the whole server. Worker processes are spawned instead of
+# forked, as forking the multi-threaded Streamlit server is unsafe.
+@st.cache_resource(show_spinner=False)
+def get_process_pool():
+    return ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=get_context("spawn"))
 
-# This function takes a list of calls and a lineage as input and returns a new list
-# that either removes the lineage if it exists in the call or adds the lineage to the
-# call twice if it does not exist in the call.
-@st.cache_data(show_spinner=False)
-def lineage4_decision(call_list, lin):
-    altList = []
-    for item in call_list:
-        if any(i in item for i in lin):
-            item = [x for x in item if x not in lin]
-        else:
-            item.extend([lin[0] for i in range(2)])
-        altList.append(item)
-    return altList
-
-
-# This function takes a list of calls as input and returns a new list with each call
-# count and formatted as a string. If a prefix is provided, it only includes calls that
-# start with the prefix in the output.
-@st.cache_data(show_spinner=False)
-def count_variants(call_list, prefix=None):
-    d = {}
-    for item in call_list:
-        if item:
-            caseless = item.casefold()
-            if caseless in d:
-                d[caseless][1] += 1
-            else:
-                d[caseless] = [item, 1]
-
-    call_list = []
-    for item, count in d.values():
-        if not item.startswith(prefix) if prefix else True:
-            item = (
-                f"{item}" if count > 1 else f"{item} [warning! only 1/2 snp is present]"
-            )
-        call_list.append(item)
-
-    return call_list
-
-
-# This function takes a list of calls as input and returns a new list that either
-# removes the lineage "L2.2 (modern)" and "L2.2 (ancient)" if both exist in the call
-# or adds the lineage "L2.2 (modern)" if the call contains "L2.2 (ancient)".
-@st.cache_data(show_spinner=False)
-def lineage2_decision(call_list):
-    lin2 = ["L2.2 (modern)", "L2.2 (ancient)"]
-    altList = []
-    for item in call_list:
-        if all(i in item for i in lin2):
-            item = list(set(item) - set(lin2))
-            item.append(lin2[0])
-        altList.append(item)
-    return altList
-
-
-# This function takes a VCF file as input and returns a DataFrame with barcoding information.
-@st.cache_data(show_spinner=False)
-def barcoding(uploaded_vcf):
-    # Convert VCF to DataFrame
-    df = vcf_to_dataframe(uploaded_vcf)
-
-    # Get levels dictionary and create a list of level names
-    levels = get_levels_data()[0]
-    level_names = [f"level_{i+1}" for i in range(len(levels))]
-
-    # Define a function to compute the level of each sample
-    def compute_level(level):
-        exp = (
-            df["POS"].values[:, None],
-            df["REF"].values[:, None],
-            df["ALT"].values[:, None],
-        )
-        mask = np.logical_and.reduce(
-            [
-                np.equal(exp[0], level[0]),
-                np.equal(exp[1], level[1]),
-                np.equal(exp[2], level[2]),
-            ]
-        )
-        return np.dot(mask, level[3])
-
-    # Compute the level of each sample for each level
-    for i, level in enumerate(levels):
-        df[level_names[i]] = compute_level(level)
-
-    # Drop the columns REF, ALT, and POS and replace empty strings with NaN
-    df.drop(["REF", "ALT", "POS"], axis=1, inplace=True)
-    df.replace("", np.nan, inplace=True)
-
-    # Group the data by sample and concatenate the level columns into comma-separated strings
-    df = df.groupby(["Sample"]).agg(lambda x: ",".join(x.dropna())).reset_index()
-
-    # Split the first two level columns into lists and apply lineage decision and count variants functions
-    df[level_names[:2]] = df[level_names[:2]].applymap(lambda x: x.split(","))
-    df[level_names[0]] = lineage4_decision(df[level_names[0]], ["L4"])
-    df[level_names[1]] = lineage4_decision(df[level_names[1]], ["L4.9"])
-    df[level_names[0]] = df[level_names[0]].apply(count_variants, prefix="L8")
-    df[level_names[1]] = df[level_names[1]].apply(
-        count_variants, prefix=("L2.2 (modern)", "L2.2 (ancient)")
-    )
-    df[level_names[1]] = lineage2_decision(df[level_names[1]])
 
-    # Convert the first two level columns back to comma-separated strings
-    df[level_names[:2]] = df[level_names[:2]].applymap(lambda x: ", ".join(map(str, x)))
+# The result cache is kept on disk, so the lineages of files that were already
+# genotyped survive restarts of the app and are shared between all sessions.
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    return ResultCache()
 
-    # Sort the dataframe by level and reset the index
-    df.sort_values(level_names, inplace=True)
-    df.reset_index(drop=True, inplace=True)
 
-    # Return the final dataframe
-    return df
+# Genotyping runs as background jobs shared between all sessions, so that a run is not
+# interrupted by a rerun of the script, its results are kept after the page is closed,
+# and the same files uploaded twice are genotyped once.
+@st.cache_resource(show_spinner=False)
+def get_job_manager():
+    return JobManager(get_process_pool(), get_result_cache(), MAX_WORKERS)
 
 
-def temporary_vcf_gz(uploaded_file):
-    with NamedTemporaryFile(
-        dir=".",
-        suffix=".vcf.gz",
-        delete=False,
-    ) as temp_vcf:
-        temp_vcf.write(uploaded_file.getbuffer())
+# The stats of every file are logged through the handler of Streamlit
+get_logger("tbgen")
 
-    return temp_vcf.name
 
+def get_error_message(error):
+    # Files rejected before they are parsed come with their own message
+    if isinstance(error, VcfFormatError):
+        return str(error)
+    error_messages = {
+        ValueError: "Wrong file type!",
+        BadGzipFile: "File is not gzipped!",
+        EOFError: "VCF file is malformed!",
+        StopIteration: "VCF file is malformed!",
+        IndexError: "VCF file is malformed!",
+    }
+    return error_messages.get(type(error), "An unknown error occurred")
 
-def temporary_vcf(uploaded_file):
-    with NamedTemporaryFile(
-        dir=".",
-        suffix=".vcf",
-        delete=False,
-    ) as temp_vcf:
-        temp_vcf.write(uploaded_file.getbuffer())
 
-    return temp_vcf.name
+# This function returns a read-only view of the content of an uploaded file, which is
+# decoded straight from it. The view is taken on the bytes returned by getvalue, which
+# are those the upload was made from, as getbuffer would copy them to unshare the
+# buffer of the upload. The view keeps them alive while the job outlives the session.
+def get_upload_buffer(uploaded_file):
+    return memoryview(uploaded_file.getvalue())
 
 
-@st.cache_data(show_spinner=False)
-def genotype_lineages(uploaded_file):
-    uploaded_extension = uploaded_file.name.split(".")[-1]
+# This function submits a job genotyping the uploaded files, with their index files and
+# the evidence of the barcoding SNPs if requested, and remembers its ID in the session
+# and in the URL, so that the page reconnects to the job after a rerun or a reload.
+def submit_job(uploaded_files, index_files, evidence=False):
+    files = [
+        (
+            uploaded_file.name,
+            get_upload_buffer(uploaded_file),
+            (
+                get_upload_buffer(index_files[uploaded_file.name])
+                if uploaded_file.name in index_files
+                else None
+            ),
+        )
+        for uploaded_file in uploaded_files
+    ]
+    job = get_job_manager().submit(files, evidence)
+    st.session_state["job_id"] = job.id
+    st.query_params["job"] = job.id
+    return job
+
+
+# This function returns the job last submitted from the session or the URL, or None if
+# there is none or it has expired.
+def get_current_job():
+    job_id = st.session_state.get("job_id") or st.query_params.get("job")
+    if job_id is None:
+        return None
+
+    job = get_job_manager().get(job_id)
+    if job is None:
+        st.session_state.pop("job_id", None)
+        st.query_params.pop("job", None)
+    return job
+
+
+# This function shows the results of the files of a running job that are done so far,
+# in the order of upload, with downloads of these partial results, and returns their
+# number. The placeholder is only refilled when results were added since the given
+# number of results was shown, e.g. not when the files done since then all failed.
+def show_partial_results(placeholder, job, n_shown=0):
+    results = job.get_results()
+    if len(results) == n_shown:
+        return n_shown
+
+    partial = pd.concat(results).reset_index(drop=True)
+    with placeholder.container():
+        st.dataframe(partial, width=900)
+        # Keys change with every update, as the placeholder is refilled in the same run
+        download_table(
+            partial, "lineage.partial", f"partial-{len(results)}", "partial results"
+        )
+    return len(results)
+
+
+# This function returns the note shown for an uploaded file with the same content as
+# another file of its job, which was genotyped instead.
+def get_duplicate_message(file_name, original):
+    if file_name == original:
+        return "uploaded more than once, genotyped once"
+    return f"same content as **{original}**, genotyped once"
+
+
+# This function shows the progress of a job until it finishes, with the running counts
+# of files and samples and the results of the files done so far, and returns the list
+# of results, in the order of upload, a dictionary of error messages for the files that
+# could not be genotyped and a dictionary of the stats of the other files.
+def wait_for_job(job):
+    progress = st.progress(0.0, text="Genotyping...")
+    status = st.status(f"Genotyping {job.total} file(s)...", expanded=True)
+    counts = st.empty()
+    partial = st.empty()
+
+    shown = 0
+    partial_shown = 0
+    partial_results = 0
+    partial_time = 0.0
+    while shown < job.total:
+        job.wait(POLL_INTERVAL)
+        for file_name, error, original in job.completed[shown:]:
+            if error is not None:
+                status.write(f"❗️ **{file_name}**: {get_error_message(error)}")
+            elif original is not None:
+                status.write(
+                    f"♻️ **{file_name}**: {get_duplicate_message(file_name, original)}"
+                )
+            else:
+                cached = " (cached)" if job.stats[file_name]["cached"] else ""
+                status.write(f"✅ **{file_name}**{cached}")
+                for warning in job.stats[file_name].get("warnings", ()):
+                    status.write(f"⚠️ **{file_name}**: {warning}")
+            shown += 1
+        progress.progress(
+            shown / job.total, text=f"Genotyped {shown} of {job.total} file(s)"
+        )
+        counts.caption(
+            f"Processed {shown} of {job.total} file(s), {job.samples} sample(s)"
+            f" in {format_elapsed(job.elapsed())}"
+        )
+        # The full results are shown once the job is done
+        if (
+            partial_shown < shown < job.total
+            and time.perf_counter() - partial_time >= PARTIAL_RESULTS_INTERVAL
+        ):
+            partial_results = show_partial_results(partial, job, partial_results)
+            partial_shown = shown
+            partial_time = time.perf_counter()
+
+    errors = {
+        file_name: get_error_message(error) for file_name, error in job.errors.items()
+    }
+    results = job.get_results()
+
+    progress.empty()
+    partial.empty()
+    status.caption(f"Result cache: {get_result_cache().summary()}")
+    status.update(
+        label=f"Genotyped {len(results)} of {job.total} file(s)",
+        state="error" if errors else "complete",
+        expanded=bool(errors),
+    )
+    return results, errors, job.stats
+
+
+# This function shows the time spent in each stage of the genotyping of every file,
+# in milliseconds, together with the numbers of samples and records read.
+def show_timings(stats):
+    timings = pd.DataFrame.from_dict(
+        {
+            file_name: summarize_stats(file_stats)
+            for file_name, file_stats in stats.items()
+        },
+        orient="index",
+    )
+    stages = [column for column in timings.columns if column.endswith("_ms")]
+    timings[stages] = timings[stages].fillna(0.0)
+    timings = timings[
+        [column for column in timings.columns if column != "total_ms"] + ["total_ms"]
+    ]
+    timings.columns = [column.removesuffix("_ms") for column in timings.columns]
+
+    with st.expander("⏱️ Time spent per file and stage (ms)"):
+        st.dataframe(timings, width=900)
+
+
+# This function shows the evidence of the barcoding SNPs in the samples of every file,
+# as matched together with the lineages, so that a call can be traced back to the SNPs
+# it was made from without reading the file again.
+def show_evidence(stats, key):
+    matrices = {
+        file_name: file_stats["evidence"]
+        for file_name, file_stats in stats.items()
+        if "evidence" in file_stats
+    }
+    if not matrices:
+        return
+
+    with st.expander("🔬 Evidence of the barcoding SNPs per sample"):
+        st.caption(
+            "**hit**: ALT allele of the SNP called, **ref**: REF allele called, "
+            "**other**: another allele called, **missing**: no call at the position "
+            "of the SNP, e.g. in VCF files holding variant sites only"
+        )
+        col1, col2 = st.columns(2)
+        with col1:
+            file_name = st.selectbox("File", list(matrices), key=f"{key}-file")
+        matrix = matrices[file_name]
+        with col2:
+            sample = st.selectbox("Sample", matrix.samples, key=f"{key}-sample")
 
-    if uploaded_extension == "gz":
-        try:
-            temp_vcf = temporary_vcf_gz(uploaded_file)
-            uploaded_vcf = gzopen(temp_vcf, "rt")
-            result = barcoding(uploaded_vcf)
-        finally:
-            os.remove(temp_vcf)
-    else:
-        try:
-            temp_vcf = temporary_vcf(uploaded_file)
-            uploaded_vcf = open(temp_vcf)
-            result = barcoding(uploaded_vcf)
-        finally:
-            os.remove(temp_vcf)
-    return result
+        st.dataframe(matrix.summary(), hide_index=True, width=900)
+        if sample is not None:
+            table = matrix.sample_table(sample)
+            if st.toggle("Show missing SNPs", key=f"{key}-missing"):
+                st.dataframe(table, hide_index=True, width=900)
+            else:
+                st.dataframe(
+                    table[table["evidence"] != "missing"], hide_index=True, width=900
+                )
+
+        # Only the SNPs with evidence are exported, one row per sample and SNP
+        download_table(
+            lambda: pd.concat(
+                [matrix.to_dataframe() for matrix in matrices.values()],
+                ignore_index=True,
+            ),
+            "barcode_evidence",
+            key,
+            "evidence",
+        )
 
 
 def get_uploaded_files():
     with st.sidebar.container():
         uploaded_files = st.file_uploader(
             "**Upload** **:blue[.VCF]** **file(s)**",
-            type=["vcf", "vcf.gz"],
+            type=["vcf", "vcf.gz", "bcf", "tbi", "csi"],
             accept_multiple_files=True,
         )
     return uploaded_files
 
 
+# This function separates the uploaded VCF files from their index files, which are
+# returned in a dictionary keyed on the name of the VCF file they belong to.
+def split_index_files(uploaded_files):
+    vcf_files = []
+    index_files = {}
+    for uploaded_file in uploaded_files:
+        if uploaded_file.name.endswith((".tbi", ".csi")):
+            index_files[uploaded_file.name[:-4]] = uploaded_file
+        else:
+            vcf_files.append(uploaded_file)
+    return vcf_files, index_files
+
+
 def main():
     set_page_config()
     sidebar_image()
@@ -360,99 +387,99 @@ def main():
     page_info()
 
     info_ct = info_box()
-    uploaded_files = get_uploaded_files()
-
-    if st.sidebar.button("Genotype lineage", type="primary"):
-        if len(uploaded_files) == 0:
-            message = "No data was uploaded!"
-            icon = "warning"
-            symbol = "⚠️"
-            animation = lottie_warning
+    uploaded_files, index_files = split_index_files(get_uploaded_files())
+
+    evidence = st.sidebar.checkbox(
+        "Report the evidence of the barcoding SNPs",
+        key="evidence",
+        help="Whether each sample carries the ALT allele, the REF allele or another"
+        " allele at every barcoding SNP",
+    )
+    pressed = st.sidebar.button("Genotype lineage", type="primary")
+    if pressed and len(uploaded_files) != 0:
+        job = submit_job(uploaded_files, index_files, evidence)
+    else:
+        # The last job is shown again after a rerun or a reload of the page
+        job = get_current_job()
+
+    if pressed and len(uploaded_files) == 0:
+        message = "No data was uploaded!"
+        icon = "warning"
+        symbol = "⚠️"
+        animation = lottie_warning
+        lottie_container(message, icon, symbol, animation)
+
+    elif job is not None:
+        with lottie_spinner():
+            info_ct.empty()
+            results_list, errors, stats = wait_for_job(job)
+        # Only the genotyping is timed, not the animations around it
+        elapsed = format_elapsed(job.elapsed())
+
+        if len(results_list) == 0:
+            if len(errors) == 1:
+                message = next(iter(errors.values()))
+            else:
+                message = "None of the uploaded files could be genotyped!"
+            icon = "error"
+            symbol = "❗️"
+            animation = lottie_error
+            info_box()
             lottie_container(message, icon, symbol, animation)
 
         else:
-            try:
-                t_start = time.perf_counter()
-                results_list = []
-
-                for uploaded_file in uploaded_files:
-                    with lottie_spinner():
-                        info_ct.empty()
-                        out = genotype_lineages(uploaded_file)
-                        results_list.append(out)
-
-                results = pd.concat(results_list).reset_index(drop=True)
-
-            except (ValueError, BadGzipFile, StopIteration, IndexError) as e:
-                error_messages = {
-                    ValueError: "Wrong file type!",
-                    BadGzipFile: "File is not gzipped!",
-                    StopIteration: "VCF file is malformed!",
-                    IndexError: "VCF file is malformed!",
-                }
-                message = error_messages.get(type(e), "An unknown error occurred")
-                icon = "error"
-                symbol = "❗️"
-                animation = lottie_error
+            results = pd.concat(results_list).reset_index(drop=True)
+
+            if errors:
+                st.warning(
+                    f"{len(errors)} file(s) could not be genotyped: "
+                    + ", ".join(errors),
+                    icon="⚠️",
+                )
+            if job.duplicates:
+                st.info(
+                    f"{len(job.duplicates)} file(s) have the same content as another"
+                    " uploaded file, their samples are listed once: "
+                    + ", ".join(
+                        f"**{file_name}** ({get_duplicate_message(file_name, original)})"
+                        for file_name, original in job.duplicates.items()
+                    ),
+                    icon="♻️",
+                )
+
+            if (
+                results.empty
+                or all(
+                    results.loc[:, results.columns != "Sample"]
+                    .replace("", np.nan)
+                    .isna()
+                    .all()
+                )
+                is True
+            ):
+                message = "No genotypes were called"
+                icon = "warning"
+                symbol = "⚠️"
+                animation = lottie_warning
                 info_box()
                 lottie_container(message, icon, symbol, animation)
 
             else:
-                if (
-                    results.empty
-                    or all(
-                        results.loc[:, results.columns != "Sample"]
-                        .replace("", np.nan)
-                        .isna()
-                        .all()
-                    )
-                    is True
-                ):
-                    message = "No genotypes were called"
-                    icon = "warning"
-                    symbol = "⚠️"
-                    animation = lottie_warning
-                    info_box()
-                    lottie_container(message, icon, symbol, animation)
-
-                else:
-                    t_end = time.perf_counter()
-                    hours, rem = divmod(t_end - t_start, 3600)
-                    minutes, seconds = divmod(rem, 60)
-                    elapsed = f"{int(hours):0>2}:{int(minutes):0>2}:{seconds:05.2f}"
-
+                # The animation is only played the first time the results are shown
+                if st.session_state.get("shown_job") != job.id:
+                    st.session_state["shown_job"] = job.id
                     placeholder = st.empty()
                     with placeholder.container():
                         lottie_success()
                         time.sleep(1.6)
                     placeholder.empty()
 
-                    st.dataframe(results, width=900)
-                    st.success(f"Done! ⏱️ {elapsed}")
-
-                    tsv = convert_df_to_file(results, file_format="tsv")
-                    csv = convert_df_to_file(results)
-
-                    dwn1, dwn2, mock = st.columns([1, 1, 4])
-
-                    with dwn1:
-                        st.download_button(
-                            label="💾 Download data as TSV",
-                            data=tsv,
-                            file_name="lineage.tsv",
-                            mime="text/csv",
-                        )
-
-                    with dwn2:
-                        st.download_button(
-                            label="💾 Download data as CSV",
-                            data=csv,
-                            file_name="lineage.csv",
-                            mime="text/csv",
-                        )
+                st.dataframe(results, width=900)
+                st.success(f"Done! ⏱️ {elapsed}")
+                show_timings(stats)
+                show_evidence(stats, f"evidence-{job.id}")
 
-                    with mock:
-                        pass
+                download_table(results, "lineage", f"results-{job.id}", "results")
 
     elif len(uploaded_files) != 0:
         message = "Press the <Genotype lineage> button!"
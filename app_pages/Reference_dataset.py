@@ -1,4 +1,5 @@
-import logging
+import math
+import time
 import geopandas
 import numpy as np
 import pandas as pd
@@ -6,16 +7,19 @@ import altair as alt
 import streamlit as st
 import leafmap.foliumap as leafmap
 
-from pdbio.vcfdataframe import VcfDataFrame
 from streamlit_extras.colored_header import colored_header
 from st_aggrid import AgGrid, GridUpdateMode, GridOptionsBuilder
 from streamlit_extras.add_vertical_space import add_vertical_space
+from tbgen.reference import MATRIX_PATH, build_matrix, get_reference_matrix
+from tbgen.reference import parse_variant
+from tbgen.variants import VARIANT_COLUMNS, VARIANT_TYPES, query_variants
 from utils import (
     set_page_config,
     sidebar_image,
     set_css,
     home_page,
     author_link,
+    download_table,
     # back_button,
 )
 
@@ -73,16 +77,6 @@ def page_info():
     # )
 
 
-@st.cache_data()
-def convert_df_to_tsv(df):
-    return df.to_csv(sep="\t", index=False).encode("utf-8")
-
-
-@st.cache_data(show_spinner=False)
-def convert_df_to_csv(df):
-    return df.to_csv(index=False).encode("utf-8")
-
-
 @st.cache_data
 def load_dataset():
     df = pd.read_csv("./data/samples_data.tsv", sep="\t")
@@ -109,14 +103,6 @@ def load_country_coords():
     return df
 
 
-@st.cache_data(show_spinner=False)
-def vcf_to_df(vcf_path):
-    logging.getLogger("pdbio").setLevel(logging.WARNING)
-    vcfdf = VcfDataFrame(path=vcf_path)
-    vcfdf.df.index = vcfdf.df.index + 1
-    return vcfdf.df
-
-
 @st.cache_data
 def sample_count():
     dataset = load_dataset()
@@ -289,27 +275,7 @@ def show_dataset():
                 }
             },
         )
-        tsv = convert_df_to_tsv(dataset)
-        csv = convert_df_to_csv(dataset)
-
-        dwn1, dwn2, mock = st.columns([1, 1, 4])
-
-        with dwn1:
-            st.download_button(
-                label="💾 Download dataset as TSV",
-                data=tsv,
-                file_name="dataset.tsv",
-                mime="text/csv",
-            )
-        with dwn2:
-            st.download_button(
-                label="💾 Download dataset as CSV",
-                data=csv,
-                file_name="dataset.csv",
-                mime="text/csv",
-            )
-        with mock:
-            pass
+        download_table(dataset, "dataset", "dataset", "dataset")
 
         sel_row = grid1["selected_rows"]
         dataset_sel = pd.DataFrame(sel_row)
@@ -334,34 +300,206 @@ def show_dataset():
             dataset_sel = dataset_sel.drop(columns=["_selectedRowNodeInfo"])
         except KeyError:
             st.info("Select samples from the main dataframe", icon="ℹ️")
-        tsv_sel = convert_df_to_tsv(dataset_sel)
-        csv_sel = convert_df_to_csv(dataset_sel)
-
-        dwn_sel1, dwn_sel2, mock_sel = st.columns([1, 1, 4])
-
         if dataset_sel.empty:
             st.warning("Subset dataframe is empty", icon="⚠️")
         else:
-            with dwn_sel1:
-                st.download_button(
-                    label="💾 Download subset as TSV",
-                    data=tsv_sel,
-                    file_name="subsetted_dataset.tsv",
-                    mime="text/csv",
-                )
-            with dwn_sel2:
-                st.download_button(
-                    label="💾 Download subset as CSV",
-                    data=csv_sel,
-                    file_name="subsetted_dataset.csv",
-                    mime="text/csv",
-                )
-            with mock:
-                pass
+            download_table(dataset_sel, "subsetted_dataset", "subset", "subset")
 
         return grid1
 
 
+# Length of the H37Rv reference genome (NC_000962.3)
+GENOME_LENGTH = 4_411_532
+
+PAGE_SIZES = [50, 100, 500, 1000]
+
+
+# This function shows the variants of a sample one page at a time, read from the
+# columnar variant store, which is filled from the VCF file of the sample the first
+# time it is viewed. Only the variants of the page, within the position window and of
+# the selected types, and the selected columns are read.
+def show_variants(sample):
+    col1, col2, col3, col4 = st.columns([2, 2, 3, 1])
+    with col1:
+        start = st.number_input(
+            "From position", 1, GENOME_LENGTH, 1, key="variants_start"
+        )
+    with col2:
+        end = st.number_input(
+            "To position", 1, GENOME_LENGTH, GENOME_LENGTH, key="variants_end"
+        )
+    with col3:
+        types = st.multiselect(
+            "Variant types", VARIANT_TYPES, placeholder="All", key="variants_types"
+        )
+    with col4:
+        page_size = st.selectbox("Rows", PAGE_SIZES, index=1, key="variants_rows")
+    columns = st.multiselect(
+        "Columns",
+        VARIANT_COLUMNS,
+        default=[column for column in VARIANT_COLUMNS if column != "INFO"],
+        key="variants_columns",
+    )
+    page = st.session_state.get("variants_page", 1)
+
+    with st.spinner("Loading variants..."):
+        variants, total = query_variants(
+            sample, start, end, types, columns, (page - 1) * page_size, page_size
+        )
+        n_pages = max(1, math.ceil(total / page_size))
+        if page > n_pages:
+            # The filters left fewer pages than the page shown
+            page = st.session_state["variants_page"] = n_pages
+            variants, total = query_variants(
+                sample, start, end, types, columns, (page - 1) * page_size, page_size
+            )
+
+    offset = (page - 1) * page_size
+    variants.index = range(offset + 1, offset + len(variants) + 1)
+    st.dataframe(variants, width=900)
+
+    page_col, count_col = st.columns([1, 5])
+    with page_col:
+        st.number_input(f"Page (of {n_pages})", 1, n_pages, key="variants_page")
+    with count_col:
+        add_vertical_space(2)
+        st.caption(
+            f"Variants {offset + 1}–{offset + len(variants)} of {total}"
+            if total
+            else "No variants match the filters"
+        )
+
+
+# Missing or outdated matrices are not cached, so that a matrix built later, from the
+# command line or by another visitor, is picked up on the next run of the page.
+@st.cache_resource
+def load_reference_matrix():
+    matrix = get_reference_matrix()
+    if matrix is None:
+        raise FileNotFoundError(MATRIX_PATH)
+    return matrix
+
+
+LEVELS = ["level 1", "level 2", "level 3", "level 4", "level 5"]
+
+
+# This function shows the reference samples carrying a variant, with their lineages
+# and the fraction of carriers in each lineage of the selected level.
+def show_variant_samples(matrix):
+    query = st.text_input(
+        "Variant",
+        placeholder="e.g. 761155 or 761155 C>T",
+        key="matrix_variant",
+    )
+    if not query:
+        return
+    variant = parse_variant(query)
+    if variant is None:
+        st.warning("Enter a position, optionally followed by REF>ALT", icon="⚠️")
+        return
+
+    started = time.perf_counter()
+    rows = matrix.find_variants(*variant)
+    carriers = [matrix.carrier_mask(row) for row in rows]
+    elapsed = time.perf_counter() - started
+    if len(rows) == 0:
+        st.info("No reference sample carries this variant", icon="ℹ️")
+        return
+
+    st.dataframe(matrix.variants_table(rows), hide_index=True, width=900)
+    st.caption(f"Answered in {elapsed * 1000:.1f} ms")
+
+    dataset = load_dataset()[["Sample"] + LEVELS]
+    if len(rows) > 1:
+        labels = [
+            f"{row.POS} {row.REF}>{row.ALT}"
+            for row in matrix.variants_table(rows).itertuples()
+        ]
+        index = st.selectbox(
+            "Show the carriers of",
+            range(len(rows)),
+            format_func=labels.__getitem__,
+            key="matrix_allele",
+        )
+    else:
+        index = 0
+    mask = carriers[index]
+
+    samples = pd.DataFrame({"Sample": matrix.samples, "Carrier": mask}).merge(
+        dataset, on="Sample", how="left"
+    )
+    st.dataframe(
+        samples[samples["Carrier"]].drop(columns="Carrier"),
+        hide_index=True,
+        width=900,
+    )
+
+    level = st.selectbox("Lineages of", LEVELS, key="matrix_level")
+    fractions = (
+        samples.dropna(subset=[level])
+        .groupby(level)["Carrier"]
+        .agg(Samples="size", Carriers="sum")
+        .reset_index()
+    )
+    fractions["Fraction"] = fractions["Carriers"] / fractions["Samples"]
+    st.dataframe(
+        fractions[fractions["Carriers"] > 0].sort_values("Fraction", ascending=False),
+        hide_index=True,
+        width=900,
+    )
+
+
+# This function shows the variants carried by a reference sample within a window of
+# positions.
+def show_sample_variants(matrix):
+    col1, col2, col3 = st.columns([3, 2, 2])
+    with col1:
+        sample = st.selectbox("Sample", matrix.samples, key="matrix_sample")
+    with col2:
+        start = st.number_input(
+            "From position", 1, GENOME_LENGTH, 1, key="matrix_start"
+        )
+    with col3:
+        end = st.number_input(
+            "To position", 1, GENOME_LENGTH, GENOME_LENGTH, key="matrix_end"
+        )
+
+    started = time.perf_counter()
+    rows = matrix.sample_variants(sample, start, end)
+    elapsed = time.perf_counter() - started
+    st.dataframe(matrix.variants_table(rows), hide_index=True, width=900)
+    st.caption(f"{len(rows)} variants, answered in {elapsed * 1000:.1f} ms")
+
+
+# This function queries the reference genotype matrix, which holds the variants of
+# every reference sample in memory, both ways: which samples carry a variant, and which
+# variants a sample carries. The matrix is compiled from the reference VCF files by
+# "python -m tbgen build-reference-matrix", or from the page.
+def show_reference_matrix():
+    try:
+        matrix = load_reference_matrix()
+    except FileNotFoundError:
+        st.info(
+            "The reference genotype matrix is missing or out of date with the"
+            " reference VCF files. Build it with"
+            " `python -m tbgen build-reference-matrix`, or here:",
+            icon="ℹ️",
+        )
+        if st.button("🧬 Build reference matrix", key="build_matrix"):
+            # Builds run one at a time, so a visitor clicking during the build of
+            # another one waits for it instead of building the matrix again
+            with st.spinner("Building the reference matrix..."):
+                build_matrix()
+            st.rerun()
+        return
+
+    variant_tab, sample_tab = st.tabs(["Variant → samples", "Sample → variants"])
+    with variant_tab:
+        show_variant_samples(matrix)
+    with sample_tab:
+        show_sample_variants(matrix)
+
+
 def sample_stats():
     get_toggle_switch_variants()
     dataset = load_dataset()
@@ -378,9 +516,7 @@ def sample_stats():
             )
 
         if st.session_state["toggle_variants"] is True:
-            with st.spinner("Loading VCF..."):
-                vcf_df = vcf_to_df(f"./data/VCF/{sample_filter}.vcf.gz")
-                st.dataframe(vcf_df)
+            show_variants(sample_filter)
 
     except FileNotFoundError:
         st.warning("VCF file is not available", icon="⚠️")
@@ -543,6 +679,14 @@ def main():
     get_chart()
     add_vertical_space(5)
 
+    colored_header(
+        label="Variant Lookup",
+        description="Reference samples carrying a variant, and variants of a sample",
+        color_name="blue-green-70",
+    )
+    show_reference_matrix()
+    add_vertical_space(5)
+
     colored_header(
         label="Map Showing the Distribution of Samples",
         description="Samples without information about the country of isolation are not shown",
@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import argparse
+
+from benchmarks.synthetic import generate_vcf
+from benchmarks.suite import (
+    FORMATS,
+    RESULTS_DIR,
+    SAMPLE_SIZES,
+    compare_results,
+    get_bundled_vcfs,
+    get_synthetic_vcfs,
+    run_benchmarks,
+    save_results,
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark the genotyping pipeline",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="run the benchmarks and save the results")
+    run.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=list(SAMPLE_SIZES),
+        help="numbers of samples of the synthetic VCF files (default: %(default)s)",
+    )
+    run.add_argument(
+        "--formats",
+        nargs="+",
+        choices=FORMATS,
+        default=list(FORMATS),
+        help="formats of the synthetic VCF files (default: %(default)s)",
+    )
+    run.add_argument(
+        "--seed", type=int, default=0, help="seed of the synthetic VCF files"
+    )
+    run.add_argument(
+        "--no-bundled",
+        dest="bundled",
+        action="store_false",
+        help="do not benchmark the VCF files bundled in data/VCF",
+    )
+    run.add_argument(
+        "--only",
+        nargs="+",
+        help="names of the benchmarks to run, all of them by default",
+    )
+    run.add_argument("-r", "--repeat", type=int, default=3, help="number of timed runs")
+    run.add_argument(
+        "--memory",
+        action="store_true",
+        help="also measure the peak memory allocated, in an extra run",
+    )
+    run.add_argument(
+        "-o",
+        "--output",
+        help="JSON file of the results, benchmarks/results/<commit>.json by default",
+    )
+
+    generate = subparsers.add_parser("generate", help="write a synthetic VCF file")
+    generate.add_argument("output", help="output VCF file, gzipped if ending with .gz")
+    generate.add_argument("-n", "--samples", type=int, default=1)
+    generate.add_argument("--seed", type=int, default=0)
+
+    compare = subparsers.add_parser(
+        "compare", help="compare the results of two benchmark runs"
+    )
+    compare.add_argument("old", help="JSON results of the reference run")
+    compare.add_argument("new", help="JSON results of the run to compare")
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="slowdown, in percent, reported as a regression (default: %(default)s)",
+    )
+    return parser.parse_args(argv)
+
+
+def run(args):
+    datasets = get_synthetic_vcfs(args.sizes, args.formats, args.seed)
+    if args.bundled:
+        datasets.update(get_bundled_vcfs())
+
+    results = run_benchmarks(datasets, args.repeat, args.memory, args.only)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{results['commit'] or 'results'}.json"
+    )
+    save_results(results, output)
+    print(f"Results saved to {output}", file=sys.stderr)
+    return 0
+
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    lines, regression = compare_results(old, new, args.threshold / 100)
+    print("\n".join(lines))
+    return 1 if regression else 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "run":
+        return run(args)
+    if args.command == "generate":
+        generate_vcf(args.output, args.samples, args.seed)
+        return 0
+    if args.command == "compare":
+        return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+import os
+import sys
+import glob
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import statistics
+
+from tbgen.barcoding import barcoding
+from tbgen.batch import genotype_upload
+from tbgen.cache import ResultCache
+from tbgen.panel import DATA_DIR, PANEL_PATH, get_levels_data, get_panel
+from tbgen.panel import get_barcode_index, get_barcode_positions, get_merged_positions
+from tbgen.vcf import open_vcf, vcf_to_dataframe
+from benchmarks.synthetic import generate_vcf
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SYNTHETIC_DIR = os.path.join(BENCHMARKS_DIR, "data")
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+BUNDLED_VCFS = os.path.join(DATA_DIR, "VCF", "*.vcf.gz")
+
+SAMPLE_SIZES = (1, 100, 1000, 10000)
+FORMATS = ("vcf", "vcf.gz")
+
+
+# This function returns the synthetic VCF files of the given sizes and formats,
+# generating the ones that do not exist yet. The seed is part of the file name, so that
+# the same files are benchmarked on every commit.
+def get_synthetic_vcfs(sizes=SAMPLE_SIZES, formats=FORMATS, seed=0):
+    datasets = {}
+    for n_samples in sizes:
+        for file_format in formats:
+            name = f"synthetic-{n_samples}-seed{seed}.{file_format}"
+            path = os.path.join(SYNTHETIC_DIR, name)
+            if not os.path.exists(path):
+                print(f"Generating {name}...", file=sys.stderr)
+                generate_vcf(path, n_samples, seed)
+            datasets[name] = [path]
+    return datasets
+
+
+def clear_panel_caches():
+    for function in (
+        get_levels_data,
+        get_barcode_positions,
+        get_barcode_index,
+        get_merged_positions,
+        get_panel,
+    ):
+        function.cache_clear()
+
+
+# The benchmarks take the files of a dataset and return the function to time, so that
+# reading the uploads in memory is not timed. genotype_upload is what genotype_lineages
+# runs on the files uploaded to the Genotype page, with or without the result cache.
+def bench_vcf_to_dataframe(paths):
+    def run():
+        for path in paths:
+            with open_vcf(path) as vcf:
+                vcf_to_dataframe(vcf)
+
+    return run
+
+
+def bench_barcoding(paths):
+    def run():
+        for path in paths:
+            with open_vcf(path) as vcf:
+                barcoding(vcf)
+
+    return run
+
+
+def bench_genotype_lineages(paths, cache=None):
+    uploads = []
+    for path in paths:
+        with open(path, "rb") as f:
+            uploads.append((os.path.basename(path), f.read()))
+
+    def run():
+        for name, data in uploads:
+            genotype_upload(name, data, cache=cache)
+
+    return run
+
+
+BENCHMARKS = {
+    "vcf_to_dataframe": bench_vcf_to_dataframe,
+    "barcoding": bench_barcoding,
+    "genotype_lineages": bench_genotype_lineages,
+}
+
+
+# This function times a function over several runs and returns the timings, and the
+# peak of memory allocated by an extra traced run if memory is True.
+def measure(function, repeat=3, memory=False):
+    function()  # warm-up run, e.g. to load the barcode panel
+    timings = []
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - t_start)
+
+    result = {
+        "repeat": repeat,
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "max_s": max(timings),
+    }
+    if memory:
+        tracemalloc.start()
+        function()
+        result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCHMARKS_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# This function runs every benchmark on every dataset and returns the results together
+# with the commit and the machine they were measured on.
+def run_benchmarks(datasets, repeat=3, memory=False, only=None):
+    results = []
+
+    def record(name, dataset, paths, timing):
+        results.append(
+            {
+                "benchmark": name,
+                "dataset": dataset,
+                "files": len(paths),
+                "size_bytes": sum(os.path.getsize(path) for path in paths),
+                **timing,
+            }
+        )
+        print(
+            f"{name:<26} {dataset:<36} {timing['median_s']:>9.4f} s",
+            file=sys.stderr,
+        )
+
+    if only is None or "get_levels_data" in only:
+        timing = measure(
+            lambda: (clear_panel_caches(), get_levels_data()), repeat, memory
+        )
+        record("get_levels_data", "barcode_panel.bin", [PANEL_PATH], timing)
+        clear_panel_caches()
+
+    for dataset, paths in datasets.items():
+        for name, setup in BENCHMARKS.items():
+            if only is not None and name not in only:
+                continue
+            record(name, dataset, paths, measure(setup(paths), repeat, memory))
+
+        if only is None or "genotype_lineages_cached" in only:
+            # The warm-up run fills the cache, so that every timed run is a hit
+            with tempfile.TemporaryDirectory() as cache_dir:
+                timing = measure(
+                    bench_genotype_lineages(paths, ResultCache(cache_dir)),
+                    repeat,
+                    memory,
+                )
+            record("genotype_lineages_cached", dataset, paths, timing)
+
+    return {
+        "commit": get_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+# This function compares two benchmark results and returns the lines of a report and
+# whether any benchmark got slower than threshold (as a fraction of the old time). The
+# fastest runs are compared, as they are the least disturbed by the load of the machine.
+def compare_results(old, new, threshold=0.1):
+    old_timings = {(r["benchmark"], r["dataset"]): r for r in old["results"]}
+    lines = [
+        f"{'benchmark':<26} {'dataset':<36} {old['commit'] or 'old':>10}"
+        f" {new['commit'] or 'new':>10} {'change':>8}"
+    ]
+    regression = False
+    for r in new["results"]:
+        key = (r["benchmark"], r["dataset"])
+        if key not in old_timings:
+            continue
+        before, after = old_timings[key]["min_s"], r["min_s"]
+        change = after / before - 1 if before > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            regression = True
+            flag = "  slower"
+        lines.append(
+            f"{r['benchmark']:<26} {r['dataset']:<36} {before:>9.4f}s {after:>9.4f}s"
+            f" {change:>+8.1%}{flag}"
+        )
+    return lines, regression
+
+
+def get_bundled_vcfs():
+    paths = sorted(glob.glob(BUNDLED_VCFS))
+    return {"data/VCF": paths} if paths else {}
+
+
+def save_results(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,126 @@
+import os
+import gzip
+import numpy as np
+
+from tbgen.panel import ABSENCE_MARKERS, get_panel
+
+CONTIG = "NC_000962.3"
+GENOME_LENGTH = 4411532
+
+# Number of sites of the background variants shared by the samples, of which each
+# sample carries about BACKGROUND_RATE, as in the ~1,500 SNPs of the bundled VCF files
+BACKGROUND_SITES = 3000
+BACKGROUND_RATE = 0.4
+MISSING_RATE = 0.01
+
+HEADER = [
+    "##fileformat=VCFv4.2",
+    '##FILTER=<ID=PASS,Description="All filters passed">',
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+    '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Approximate read depth">',
+    '##INFO=<ID=DP,Number=1,Type=Integer,Description="Approximate read depth">',
+    f"##contig=<ID={CONTIG},length={GENOME_LENGTH}>",
+    "##source=tbgen-benchmarks",
+]
+
+# Genotype fields, rendered once for missing, reference and alternate calls with a few
+# read depths each
+DEPTHS = (12, 27, 35, 48, 61, 74, 103)
+GENOTYPE_FIELDS = np.array(
+    [[".:0"] * len(DEPTHS)] + [[f"{gt}:{dp}" for dp in DEPTHS] for gt in "01"],
+    dtype=object,
+)
+
+
+# This function returns the name of a lineage without its modern or ancient suffix, so
+# that its sublineages can be found by prefix.
+def lineage_stem(lineage):
+    return lineage.split(" ")[0]
+
+
+# This function returns, for every lineage of the barcode panel, the boolean mask of the
+# barcoding SNPs carried by a strain of this lineage: the SNPs of the lineage and of its
+# ancestors, and the SNPs of the absence markers of the lineages it does not belong to.
+def get_lineage_snps(levels):
+    stems = levels["lineage"].map(lineage_stem).to_numpy()
+    markers = set(ABSENCE_MARKERS.values())
+
+    lineage_snps = {}
+    for lineage in levels["lineage"].unique():
+        stem = lineage_stem(lineage)
+        ancestor = np.array(
+            [stem == s or stem.startswith(s + ".") for s in stems], dtype=bool
+        )
+        marker = levels["lineage"].isin(markers).to_numpy()
+        lineage_snps[lineage] = np.where(marker, ~ancestor, ancestor)
+    return lineage_snps
+
+
+# This function writes a synthetic multi-sample VCF file of variants called against the
+# H37Rv genome. Each sample belongs to a random lineage of the barcode panel and carries
+# its barcoding SNPs, on top of background SNPs at random positions. Only the sites
+# where at least one sample carries an alternate allele are written, as variant callers
+# do. Files ending with .gz are gzipped. The file is written under a temporary name
+# first, so that an interrupted run never leaves a truncated file behind.
+def generate_vcf(
+    path,
+    n_samples,
+    seed=0,
+    background_sites=BACKGROUND_SITES,
+    background_rate=BACKGROUND_RATE,
+    missing_rate=MISSING_RATE,
+):
+    rng = np.random.default_rng(seed)
+    levels = get_panel().levels_table()
+    lineage_snps = get_lineage_snps(levels)
+
+    # Barcoding SNPs of the lineage of each sample
+    lineages = rng.choice(sorted(lineage_snps), size=n_samples)
+    barcode_gt = np.array([lineage_snps[lineage] for lineage in lineages]).T
+
+    # Background SNPs, away from the barcoding positions
+    barcode_positions = set(levels["POS"])
+    positions = rng.choice(GENOME_LENGTH, size=background_sites * 2, replace=False) + 1
+    positions = [p for p in positions.tolist() if p not in barcode_positions]
+    positions = np.array(positions[:background_sites])
+    refs = rng.choice(list("ACGT"), size=len(positions))
+    alts = np.array([rng.choice([b for b in "ACGT" if b != ref]) for ref in refs])
+    background_gt = rng.random((len(positions), n_samples)) < background_rate
+
+    pos = np.concatenate([levels["POS"].to_numpy(), positions])
+    ref = np.concatenate([levels["REF"].to_numpy(), refs]).tolist()
+    alt = np.concatenate([levels["ALT"].to_numpy(), alts]).tolist()
+    gt = np.concatenate([barcode_gt, background_gt]).astype(np.int8) + 1
+    gt[rng.random(gt.shape) < missing_rate] = 0
+
+    # Sites carried by at least one sample, in order of position
+    order = np.argsort(pos, kind="stable")
+    order = order[(gt[order] == 2).any(axis=1)]
+    depths = rng.integers(len(DEPTHS), size=gt.shape)
+
+    samples = [f"SYN{i:05d}" for i in range(n_samples)]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    # Gzipped files are compressed at the default level of gzip and bgzip
+    if path.endswith(".gz"):
+        f = gzip.open(tmp_path, "wt", compresslevel=6)
+    else:
+        f = open(tmp_path, "w")
+    with f:
+        f.write("\n".join(HEADER) + "\n")
+        f.write(
+            "\t".join(
+                ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]
+                + ["FORMAT"]
+                + samples
+            )
+            + "\n"
+        )
+        for i in order:
+            fields = GENOTYPE_FIELDS[gt[i], depths[i]]
+            f.write(
+                f"{CONTIG}\t{pos[i]}\t.\t{ref[i]}\t{alt[i]}\t1000\tPASS"
+                f"\tDP={n_samples * 40}\tGT:DP\t" + "\t".join(fields.tolist()) + "\n"
+            )
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,293 @@
+import sys
+import logging
+import argparse
+
+from tbgen.barcoding import DEFAULT_MEMORY_BUDGET, get_result_schema
+from tbgen.batch import genotype_files, Throughput
+from tbgen.cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE, ResultCache
+from tbgen.evidence import EVIDENCE_SCHEMA
+from tbgen.export import EXPORT_FORMATS, TableWriter, guess_format
+from tbgen.panel import PANEL_PATH, build_panel, get_active_panels, panel_from_tsv
+from tbgen.profiling import log_stats
+from tbgen.reference import MATRIX_PATH, build_matrix
+from tbgen.server import serve
+from tbgen.variants import VARIANT_STORE_DIR, VCF_DIR, build_store
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m tbgen",
+        description="Genotype Mycobacterium tuberculosis complex lineages from VCF files",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    genotype = subparsers.add_parser(
+        "genotype", help="call lineages from VCF, VCF.GZ or BCF files"
+    )
+    genotype.add_argument("vcf", nargs="+", help="input VCF, VCF.GZ or BCF file(s)")
+    genotype.add_argument(
+        "-o",
+        "--output",
+        default="-",
+        help="output file, results are written to stdout by default",
+    )
+    genotype.add_argument(
+        "-f",
+        "--format",
+        choices=list(EXPORT_FORMATS),
+        help="output format, guessed from the output file extension by default",
+    )
+    genotype.add_argument(
+        "-e",
+        "--evidence",
+        metavar="FILE",
+        help="also write the evidence of every barcoding SNP in every sample (hit, ref"
+        " or other, missing evidence being left out) to FILE, in the format of its"
+        " extension",
+    )
+    genotype.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of worker processes, defaults to the number of CPUs",
+    )
+    genotype.add_argument(
+        "--no-index",
+        dest="use_index",
+        action="store_false",
+        help="scan whole files even if a tabix or CSI index is found next to them",
+    )
+    genotype.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help="directory of the result cache (default: %(default)s)",
+    )
+    genotype.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+        help="maximum size of the result cache in MB (default: %(default)s)",
+    )
+    genotype.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        action="store_false",
+        help="genotype every file again instead of reusing cached results",
+    )
+    genotype.add_argument(
+        "--memory-budget",
+        type=int,
+        default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+        help="memory used to match the genotypes of a file in MB, per worker process;"
+        " samples are processed in batches that fit in it (default: %(default)s)",
+    )
+    genotype.add_argument(
+        "--panel",
+        dest="panels",
+        action="append",
+        default=[],
+        metavar="[NAME=]TSV",
+        help="additional barcode panel, in the format of data/levels.tsv, whose"
+        " lineages are reported side by side with those of the bundled panel;"
+        " can be repeated",
+    )
+    genotype.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="log the time spent in each stage for every file to stderr",
+    )
+
+    server = subparsers.add_parser(
+        "serve", help="run an HTTP server calling lineages from posted VCF files"
+    )
+    server.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="address to listen on (default: %(default)s)",
+    )
+    server.add_argument(
+        "-p", "--port", type=int, default=8000, help="port (default: %(default)s)"
+    )
+    server.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of files genotyped at the same time, defaults to the number of"
+        " CPUs plus four",
+    )
+    server.add_argument(
+        "--memory-budget",
+        type=int,
+        default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+        help="memory used to match the genotypes of a file in MB (default: %(default)s)",
+    )
+    server.add_argument(
+        "--panel",
+        dest="panels",
+        action="append",
+        default=[],
+        metavar="[NAME=]TSV",
+        help="additional barcode panel, see genotype --panel",
+    )
+
+    panel = subparsers.add_parser(
+        "build-panel",
+        help="compile data/levels.tsv and data/snp_barcode.tsv into the binary panel",
+    )
+    panel.add_argument(
+        "-o",
+        "--output",
+        default=PANEL_PATH,
+        help="compiled panel file (default: %(default)s)",
+    )
+
+    store = subparsers.add_parser(
+        "build-variant-store",
+        help="convert the reference VCF files into the Parquet variant store read by"
+        " the Reference dataset page",
+    )
+    store.add_argument(
+        "--vcf-dir",
+        default=VCF_DIR,
+        help="directory of the reference VCF files (default: %(default)s)",
+    )
+    store.add_argument(
+        "-o",
+        "--output",
+        default=VARIANT_STORE_DIR,
+        help="directory of the variant store (default: %(default)s)",
+    )
+    store.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of worker processes, defaults to the number of CPUs",
+    )
+
+    matrix = subparsers.add_parser(
+        "build-reference-matrix",
+        help="compile the reference VCF files into the genotype matrix queried by the"
+        " Reference dataset page, building the variant store first",
+    )
+    matrix.add_argument(
+        "--vcf-dir",
+        default=VCF_DIR,
+        help="directory of the reference VCF files (default: %(default)s)",
+    )
+    matrix.add_argument(
+        "-o",
+        "--output",
+        default=MATRIX_PATH,
+        help="compiled matrix file (default: %(default)s)",
+    )
+    matrix.add_argument(
+        "--store",
+        default=VARIANT_STORE_DIR,
+        help="directory of the variant store (default: %(default)s)",
+    )
+    matrix.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of worker processes, defaults to the number of CPUs",
+    )
+    return parser.parse_args(argv)
+
+
+def genotype(args):
+    file_format = args.format or guess_format(args.output) or "tsv"
+
+    if args.verbose:
+        logging.basicConfig(
+            format="%(asctime)s %(levelname)s %(name)s %(message)s",
+            level=logging.INFO,
+        )
+
+    panels = get_active_panels() + tuple(panel_from_tsv(spec) for spec in args.panels)
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    cache = (
+        ResultCache(args.cache_dir, args.cache_size * 1024 * 1024, panels)
+        if args.use_cache
+        else None
+    )
+    throughput = Throughput(cache is not None)
+    # The schema is set from the panels, as the first file done may have no calls
+    writer = TableWriter(out, file_format, get_result_schema(panels))
+    evidence_out = open(args.evidence, "wb") if args.evidence else None
+    evidence_writer = (
+        TableWriter(evidence_out, guess_format(args.evidence) or "tsv", EVIDENCE_SCHEMA)
+        if evidence_out is not None
+        else None
+    )
+
+    try:
+        for path, result, stats, error in genotype_files(
+            args.vcf,
+            args.jobs,
+            args.use_index,
+            cache,
+            args.memory_budget * 1024 * 1024,
+            panels,
+            evidence_writer is not None,
+        ):
+            throughput.add(result, stats, error)
+            if error is not None:
+                print(f"{path}: {type(error).__name__}: {error}", file=sys.stderr)
+                continue
+            log_stats(path, stats)
+            for warning in stats.get("warnings", ()):
+                print(f"{path}: warning: {warning}", file=sys.stderr)
+
+            # Results are streamed to the output as soon as each file is done
+            writer.write(result)
+            writer.flush()
+            if evidence_writer is not None:
+                evidence_writer.write(stats["evidence"].to_dataframe())
+    finally:
+        writer.close()
+        if evidence_writer is not None:
+            evidence_writer.close()
+            evidence_out.close()
+        if out is not sys.stdout.buffer:
+            out.close()
+
+    print(throughput.summary(), file=sys.stderr)
+    return 1 if throughput.failed else 0
+
+
+def run_server(args):
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+        level=logging.INFO,
+    )
+    panels = get_active_panels() + tuple(panel_from_tsv(spec) for spec in args.panels)
+    serve(args.host, args.port, args.jobs, args.memory_budget * 1024 * 1024, panels)
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "genotype":
+        return genotype(args)
+    if args.command == "serve":
+        return run_server(args)
+    if args.command == "build-panel":
+        print(f"Panel compiled to {build_panel(args.output)}", file=sys.stderr)
+        return 0
+    if args.command == "build-variant-store":
+        n = build_store(args.vcf_dir, args.output, args.jobs)
+        print(f"Converted {n} sample(s) into {args.output}", file=sys.stderr)
+        return 0
+    if args.command == "build-reference-matrix":
+        path = build_matrix(args.output, args.vcf_dir, args.store, args.jobs)
+        print(f"Reference matrix compiled to {path}", file=sys.stderr)
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import io
+import json
+import mmap
+import struct
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Binary layout of the compiled artifacts, e.g. a compiled barcode panel:
+#   magic (8 bytes) | format version (uint32) | header size (uint32) | JSON header |
+#   arrays, each aligned on 8 bytes
+# The JSON header holds the string tables (e.g. alleles, lineages), the content hash of
+# the source files and, for each array, its dtype, shape and offset from the start of
+# the arrays.
+PANEL_MAGIC = b"TBGPANEL"
+PANEL_FORMAT_VERSION = 1
+PANEL_PREFIX = struct.Struct("<8sII")
+ALIGNMENT = 8
+
+BARCODE_COLUMNS = ["Position", "Reference allele", "Alternative allele"]
+BARCODE_LEVELS = [f"Level {i}" for i in range(1, 6)]
+
+# Id of the lineage of a level without any lineage in the wide barcode table
+NO_LINEAGE = -1
+
+
+# This function returns the content hash of the source files of a panel, which is
+# stored in the compiled panel to tell whether it is up to date.
+def hash_sources(paths):
+    sha256 = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            content = f.read()
+        sha256.update(f"{len(content)}\n".encode())
+        sha256.update(content)
+    return sha256.hexdigest()
+
+
+def align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+# This function compiles the barcoding SNPs of levels.tsv and the wide barcode table of
+# snp_barcode.tsv into the bytes of a binary panel. The SNPs are sorted by position,
+# with the row of each SNP in levels.tsv, so that the order of the file, on which the
+# order of the calls depends, is kept. Panels without a wide barcode table get an
+# empty one.
+def compile_panel(levels_path, barcode_path=None):
+    levels = pd.read_csv(levels_path, sep="\t")
+    if barcode_path is None:
+        barcode = pd.DataFrame(columns=BARCODE_COLUMNS + BARCODE_LEVELS)
+    else:
+        barcode = pd.read_csv(barcode_path, sep="\t")
+
+    alleles = sorted(
+        set(levels["REF"])
+        | set(levels["ALT"])
+        | set(barcode["Reference allele"])
+        | set(barcode["Alternative allele"])
+    )
+    lineages = sorted(
+        set(levels["lineage"]) | set(barcode[BARCODE_LEVELS].stack().tolist())
+    )
+    allele_ids = {allele: i for i, allele in enumerate(alleles)}
+    lineage_ids = {lineage: i for i, lineage in enumerate(lineages)}
+
+    order = np.argsort(levels["POS"].to_numpy(), kind="stable")
+    sorted_levels = levels.iloc[order]
+    arrays = {
+        "pos": sorted_levels["POS"].to_numpy(dtype=np.int64),
+        "ref": sorted_levels["REF"].map(allele_ids).to_numpy(dtype=np.uint16),
+        "alt": sorted_levels["ALT"].map(allele_ids).to_numpy(dtype=np.uint16),
+        "lineage": sorted_levels["lineage"].map(lineage_ids).to_numpy(np.uint16),
+        "level": sorted_levels["level"].to_numpy(dtype=np.uint8),
+        "row": order.astype(np.uint32),
+        "barcode_pos": barcode["Position"].to_numpy(dtype=np.int64),
+        "barcode_ref": barcode["Reference allele"]
+        .map(allele_ids)
+        .to_numpy(dtype=np.uint16),
+        "barcode_alt": barcode["Alternative allele"]
+        .map(allele_ids)
+        .to_numpy(dtype=np.uint16),
+        "barcode_lineages": barcode[BARCODE_LEVELS]
+        .apply(lambda column: column.map(lineage_ids))
+        .fillna(NO_LINEAGE)
+        .to_numpy(dtype=np.int16),
+    }
+
+    header = {
+        "format_version": PANEL_FORMAT_VERSION,
+        "hash": hash_sources(filter(None, [levels_path, barcode_path])),
+        "alleles": alleles,
+        "lineages": lineages,
+    }
+    return pack_artifact(PANEL_MAGIC, PANEL_FORMAT_VERSION, header, arrays)
+
+
+# This function packs a JSON header and a dictionary of arrays into the bytes of a
+# binary artifact. The dtype, shape and offset of each array are added to the header.
+def pack_artifact(magic, version, header, arrays):
+    header = dict(header, arrays={})
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = align(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode()
+    data_start = align(PANEL_PREFIX.size + len(header_bytes))
+
+    out = io.BytesIO()
+    out.write(PANEL_PREFIX.pack(magic, version, len(header_bytes)))
+    out.write(header_bytes)
+    for name, array in arrays.items():
+        out.seek(data_start + header["arrays"][name]["offset"])
+        out.write(array.tobytes())
+    # Pad to the end of the last array, as the offsets of trailing empty arrays point
+    # there
+    out.seek(0, io.SEEK_END)
+    out.write(bytes(data_start + offset - out.tell()))
+    return out.getvalue()
+
+
+# This function returns the JSON header and the arrays of a binary artifact, read from
+# a memory-mapped file or from bytes without copying them. The kind of artifact names
+# it in the errors raised when the buffer is not one of the expected version.
+def unpack_artifact(buffer, magic, version, kind):
+    file_magic, file_version, header_size = PANEL_PREFIX.unpack_from(buffer)
+    if file_magic != magic:
+        raise ValueError(f"Not a {kind}")
+    if file_version != version:
+        raise ValueError(f"Unsupported {kind} version: {file_version}")
+
+    header = json.loads(
+        bytes(buffer[PANEL_PREFIX.size : PANEL_PREFIX.size + header_size])
+    )
+    data_start = align(PANEL_PREFIX.size + header_size)
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        arrays[name] = np.frombuffer(
+            buffer,
+            dtype=np.dtype(spec["dtype"]),
+            count=int(np.prod(spec["shape"])),
+            offset=data_start + spec["offset"],
+        ).reshape(spec["shape"])
+    return header, arrays
+
+
+# This class gives access to the arrays of a compiled panel, read from a memory-mapped
+# file or from bytes, without copying them.
+class CompiledPanel:
+    def __init__(self, buffer):
+        header, self.arrays = unpack_artifact(
+            buffer, PANEL_MAGIC, PANEL_FORMAT_VERSION, "compiled barcode panel"
+        )
+        self.buffer = buffer
+        self.hash = header["hash"]
+        self.alleles = np.array(header["alleles"], dtype=object)
+        self.lineages = np.array(header["lineages"], dtype=object)
+
+    # This function returns the barcoding SNPs as read from levels.tsv, in the same
+    # order and with the same columns.
+    def levels_table(self):
+        rows = np.argsort(self.arrays["row"])
+        return pd.DataFrame(
+            {
+                "lineage": self.lineages[self.arrays["lineage"][rows]],
+                "POS": self.arrays["pos"][rows].astype(np.int64),
+                "REF": self.alleles[self.arrays["ref"][rows]],
+                "ALT": self.alleles[self.arrays["alt"][rows]],
+                "level": self.arrays["level"][rows].astype(np.int64),
+            }
+        )
+
+    # This function returns the wide barcode table as read from snp_barcode.tsv, with
+    # the lineage of every SNP at each level, NaN where there is none.
+    def barcode_table(self):
+        lineages = np.append(self.lineages, np.nan)
+        df = pd.DataFrame(
+            {
+                "Position": self.arrays["barcode_pos"].astype(np.int64),
+                "Reference allele": self.alleles[self.arrays["barcode_ref"]],
+                "Alternative allele": self.alleles[self.arrays["barcode_alt"]],
+            }
+        )
+        for i, level in enumerate(BARCODE_LEVELS):
+            # NO_LINEAGE points at the NaN appended to the lineages
+            df[level] = lineages[self.arrays["barcode_lineages"][:, i]]
+        return df
+
+
+# This function memory-maps a compiled panel file.
+def load_panel(path):
+    with open(path, "rb") as f:
+        return CompiledPanel(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
@@ -0,0 +1,297 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from typing import TextIO
+from tbgen.evidence import HIT, MISSING, OTHER, REF, EvidenceMatrix, get_barcode_snps
+from tbgen.panel import DEFAULT_PANEL, get_active_panels
+from tbgen.panel import get_barcode_index, get_barcode_positions, get_merged_positions
+from tbgen.profiling import span
+from tbgen.vcf import read_genotype_matrix
+
+
+SINGLE_SNP_WARNING = " [warning! only 1/2 snp is present]"
+
+# Memory budget of the matching of genotypes against the barcoding SNPs, in bytes. The
+# samples are matched in batches small enough for the arrays of a batch to fit in it.
+DEFAULT_MEMORY_BUDGET = int(os.environ.get("TBGEN_MEMORY_BUDGET", 256 * 1024 * 1024))
+
+# Peak number of bytes allocated per genotype while matching a batch of samples
+BYTES_PER_GENOTYPE = 48
+
+
+# This function takes a variants × samples array of the lineages called at a level and
+# returns the lineages in order of first hit, a samples × lineages table of the number
+# of SNPs of each lineage carried by each sample and the index of the first record
+# carrying each of them. Lineages that are not carried get the number of records.
+def count_hits(calls):
+    codes, lineages = pd.factorize(calls.ravel())
+    codes = codes.reshape(calls.shape)
+    n_variants, n_samples = calls.shape
+
+    counts = np.zeros((n_samples, len(lineages)), dtype=np.int64)
+    first = np.full((n_samples, len(lineages)), n_variants, dtype=np.int64)
+    variants, samples = np.nonzero(codes >= 0)
+    hits = (samples, codes[variants, samples])
+    np.add.at(counts, hits, 1)
+    np.minimum.at(first, hits, variants)
+
+    return list(lineages), counts, first
+
+
+# This function resolves the lineages called at a level into the comma-separated calls
+# of each sample, ordered by first hit:
+# - the absence marker is called, last, when none of its SNPs is present, and is not
+#   called otherwise
+# - lineages with a single SNP present get a warning, unless they start with one of the
+#   single_snp prefixes
+# - when both lineages of modern_ancient are carried, only the first one is called,
+#   after all the others
+def resolve_lineages(calls, absent=None, single_snp=(), modern_ancient=None):
+    lineages, counts, first = count_hits(calls)
+    n_variants = calls.shape[0]
+
+    if absent is not None:
+        if absent not in lineages:
+            lineages.append(absent)
+            counts = np.column_stack([counts, np.zeros(len(counts), dtype=np.int64)])
+            first = np.column_stack([first, np.full(len(first), n_variants)])
+        k = lineages.index(absent)
+        carried = counts[:, k] > 0
+        counts[:, k] = np.where(carried, 0, 2)
+        first[:, k] = n_variants
+
+    names = np.array(lineages, dtype=object)
+    warn = (counts == 1) & ~np.array(
+        [lineage.startswith(single_snp) for lineage in lineages], dtype=bool
+    )
+    labels = np.where(warn, names + SINGLE_SNP_WARNING, names)
+    present = counts > 0
+
+    if modern_ancient is not None and all(
+        lineage in lineages for lineage in modern_ancient
+    ):
+        modern, ancient = (lineages.index(lineage) for lineage in modern_ancient)
+        both = present[:, modern] & present[:, ancient]
+        present[both, ancient] = False
+        first[both, modern] = n_variants + 1
+
+    order = np.argsort(first, axis=1, kind="stable")
+    labels = np.take_along_axis(labels, order, axis=1)
+    present = np.take_along_axis(present, order, axis=1)
+    return [", ".join(row[keep]) for row, keep in zip(labels, present)]
+
+
+# This function takes a GenotypeMatrix as input and returns a DataFrame with, for each
+# sample and level, the comma-separated lineages of the barcoding SNPs of the panel
+# carried by the sample, in the order of the records. The levels with rules in the
+# panel definition are resolved further with resolve_lineages, which is timed as its
+# own stage in the optional stats dictionary. The lineages of a sample only depend on
+# its own genotypes, so the samples are matched in batches bounded by memory_budget,
+# and peak memory does not grow with the number of samples beyond the genotype matrix
+# itself (one byte per genotype).
+def match_barcodes(
+    genotypes, stats=None, memory_budget=DEFAULT_MEMORY_BUDGET, panel=DEFAULT_PANEL
+):
+    barcode_index = get_barcode_index(panel)
+    level_names = list(barcode_index.columns)
+
+    # Samples are reported only if at least one record is located at a barcode position
+    if genotypes.gt.shape[0] == 0:
+        return pd.DataFrame(columns=["Sample"] + level_names)
+
+    # Look up the lineages of every allele of every record, each allele of each record
+    # getting one row of the table
+    allele_lineages = barcode_index.reindex(
+        pd.MultiIndex.from_tuples(
+            [
+                (pos, alleles[0], allele)
+                for pos, alleles in zip(genotypes.pos.tolist(), genotypes.alleles)
+                for allele in alleles
+            ]
+        )
+    )
+    allele_lineages = allele_lineages.astype(object).where(
+        allele_lineages.notna(), None
+    )
+    level_lineages = {
+        level_name: allele_lineages[level_name].to_numpy() for level_name in level_names
+    }
+
+    # Index of the row of the first allele of each record
+    offsets = np.cumsum([0] + [len(alleles) for alleles in genotypes.alleles])[:-1]
+
+    n_variants, n_samples = genotypes.gt.shape
+    batch_size = max(1, memory_budget // (BYTES_PER_GENOTYPE * n_variants))
+
+    batches = []
+    for start in range(0, n_samples, batch_size):
+        gt = genotypes.gt[:, start : start + batch_size]
+        allele_rows = offsets[:, None] + gt
+        missing = gt < 0
+
+        df = pd.DataFrame({"Sample": genotypes.samples[start : start + batch_size]})
+        for level_name in level_names:
+            calls = level_lineages[level_name][allele_rows]
+            calls[missing] = None
+            if level_name in panel.absence_markers:
+                with span(stats, "resolve"):
+                    df[level_name] = resolve_lineages(
+                        calls,
+                        panel.absence_markers[level_name],
+                        panel.single_snp_lineages.get(level_name, ()),
+                        panel.modern_ancient.get(level_name),
+                    )
+            elif panel == DEFAULT_PANEL:
+                df[level_name] = [",".join(filter(None, sample)) for sample in calls.T]
+            else:
+                # Lineages of other panels may be defined by several SNPs, and are
+                # reported once, at their first hit
+                df[level_name] = [
+                    ",".join(dict.fromkeys(filter(None, sample))) for sample in calls.T
+                ]
+            del calls
+        batches.append(df)
+
+    return pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+
+
+# This function takes a GenotypeMatrix as input and returns the EvidenceMatrix of the
+# barcoding SNPs of the panel in its samples. Each record is paired with the SNPs at its
+# position, and each pair gets a lookup table of the evidence of each of its alleles,
+# the last entry (indexed by missing genotypes) being missing. As for the lineages, the
+# samples are matched in batches bounded by memory_budget.
+def match_evidence(genotypes, memory_budget=DEFAULT_MEMORY_BUDGET, panel=DEFAULT_PANEL):
+    snps = get_barcode_snps(panel)
+    snp_rows = {}
+    for i, pos in enumerate(snps["POS"].tolist()):
+        snp_rows.setdefault(pos, []).append(i)
+    snp_ref = snps["REF"].tolist()
+    snp_alt = snps["ALT"].tolist()
+
+    records, pair_snps, tables = [], [], []
+    for record, (pos, alleles) in enumerate(
+        zip(genotypes.pos.tolist(), genotypes.alleles)
+    ):
+        for i in snp_rows.get(pos, ()):
+            table = [
+                (
+                    HIT
+                    if allele == snp_alt[i] and alleles[0] == snp_ref[i]
+                    else REF if allele == snp_ref[i] else OTHER
+                )
+                for allele in alleles
+            ]
+            records.append(record)
+            pair_snps.append(i)
+            tables.append(np.array(table + [MISSING], dtype=np.int8))
+
+    # Evidence is stored for the SNPs with records only, which are listed once each
+    snp_idx, pair_rows = np.unique(
+        np.array(pair_snps, dtype=np.int32), return_inverse=True
+    )
+    n_samples = len(genotypes.samples)
+    batch_size = max(1, memory_budget // (BYTES_PER_GENOTYPE * max(len(records), 1)))
+
+    sample_parts, snp_parts, evidence_parts = [], [], []
+    for start in range(0, n_samples, batch_size):
+        evidence = np.zeros((len(snp_idx), min(batch_size, n_samples - start)), np.int8)
+        for record, row, table in zip(records, pair_rows, tables):
+            gt = genotypes.gt[record, start : start + batch_size]
+            np.maximum(evidence[row], table[gt], out=evidence[row])
+        rows, samples = np.nonzero(evidence)
+        sample_parts.append((samples + start).astype(np.int32))
+        snp_parts.append(snp_idx[rows])
+        evidence_parts.append(evidence[rows, samples])
+
+    return EvidenceMatrix(
+        list(genotypes.samples),
+        snps,
+        np.concatenate(sample_parts or [np.empty(0, np.int32)]),
+        np.concatenate(snp_parts or [np.empty(0, np.int32)]),
+        np.concatenate(evidence_parts or [np.empty(0, np.int8)]),
+    )
+
+
+# This function returns the level columns of the calls of a panel: the level names of
+# the bundled panel, and those of the other panels prefixed with the name of the panel.
+def get_level_columns(panel=DEFAULT_PANEL):
+    level_names = list(get_barcode_index(panel).columns)
+    if panel == DEFAULT_PANEL:
+        return level_names
+    return [f"{panel.name} {level_name}" for level_name in level_names]
+
+
+# This function returns the schema of the lineage calls of the given panels, the active
+# ones by default, with string columns only, so that the columnar exports of the calls
+# of every file get the same types, whatever the calls of the first file.
+def get_result_schema(panels=None):
+    columns = ["Sample"]
+    for panel in panels or get_active_panels():
+        columns += get_level_columns(panel)
+    return pa.schema([(column, pa.string()) for column in columns])
+
+
+# This function takes a VCF file as input and returns a DataFrame with barcoding information.
+# The file is read once at the merged barcode positions of the given panels, the active
+# ones by default, and the lineages of each panel are reported side by side: those of
+# the bundled panel in the level columns, those of the other panels in level columns
+# prefixed with the name of the panel.
+# The time spent in each stage is stored in the optional stats dictionary, and the
+# memory used to match the genotypes is bounded by memory_budget (in bytes).
+# With evidence, the EvidenceMatrix of the barcoding SNPs of all the panels is matched
+# from the same genotypes and stored in the stats dictionary, under "evidence".
+def barcoding(
+    uploaded_vcf: TextIO,
+    stats=None,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    panels=None,
+    evidence=False,
+):
+    panels = panels or get_active_panels()
+
+    # Read the genotypes at barcode positions and match them against the barcoding SNPs
+    genotypes = read_genotype_matrix(uploaded_vcf, get_merged_positions(panels), stats)
+    with span(stats, "match"):
+        df = None
+        for panel in panels:
+            panel_df = match_barcodes(
+                genotypes.select(get_barcode_positions(panel)),
+                stats,
+                memory_budget,
+                panel,
+            )
+            panel_df.columns = ["Sample"] + get_level_columns(panel)
+            if df is None:
+                df = panel_df
+            else:
+                # Samples without records at the positions of a panel get no lineages
+                df = df.merge(panel_df, on="Sample", how="outer").fillna("")
+    level_names = list(df.columns[1:])
+
+    if evidence:
+        with span(stats, "evidence"):
+            matrix = EvidenceMatrix.concat(
+                [
+                    match_evidence(
+                        genotypes.select(get_barcode_positions(panel)),
+                        memory_budget,
+                        panel,
+                    )
+                    for panel in panels
+                ]
+            )
+        if stats is not None:
+            stats["evidence"] = matrix
+
+    with span(stats, "sort"):
+        # Order the samples by name
+        df = df.sort_values("Sample", kind="stable").reset_index(drop=True)
+
+        # Sort the dataframe by level and reset the index
+        df.sort_values(level_names, inplace=True)
+        df.reset_index(drop=True, inplace=True)
+
+    # Return the final dataframe
+    return df
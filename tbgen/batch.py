@@ -0,0 +1,272 @@
+import os
+import time
+
+from gzip import BadGzipFile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tbgen.barcoding import DEFAULT_MEMORY_BUDGET, barcoding
+from tbgen.cache import hash_vcf
+from tbgen.panel import get_merged_positions
+from tbgen.profiling import span
+from tbgen.sniff import check_vcf, check_vcf_stream
+from tbgen.vcf import find_vcf_index, open_vcf, open_vcf_buffer, open_vcf_stream
+
+# Exceptions raised when an input file is not a VCF or is malformed
+GENOTYPING_ERRORS = (
+    ValueError,
+    BadGzipFile,
+    EOFError,
+    StopIteration,
+    IndexError,
+    OSError,
+)
+
+
+# This function genotypes a VCF file, given as a path or as a bytes-like object opened
+# with open_function, and returns the lineage calls together with the statistics of the
+# run, i.e. the numbers of records and samples, the time spent in each stage and the
+# warnings about the file raised by check_vcf. When a result cache is given, the
+# lineages of a file that was already genotyped are taken from the cache. The memory
+# used to match the genotypes is bounded by memory_budget. The file is genotyped
+# against the given barcode panels, the active ones by default. With evidence, the
+# evidence matrix of the barcoding SNPs is stored in the stats, and cached as well.
+# The content hash of the file is registered with the optional claim function, see
+# Job.claim: a file with the same content as another one being genotyped waits for it,
+# and gets no result but the name of that file in its stats. The file is parsed with
+# the optional parse function, called with the source, the index and the stats, e.g.
+# to parse it on a worker process, or in this process by default.
+def genotype(
+    open_function,
+    source,
+    index=None,
+    cache=None,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    panels=None,
+    evidence=False,
+    claim=None,
+    parse=None,
+):
+    stats = {"records": 0, "cached": False}
+
+    # Files that are not VCF files are rejected before they are hashed or parsed
+    with span(stats, "sniff"):
+        stats["warnings"] = check_vcf(source)
+
+    if cache is not None or claim is not None:
+        with span(stats, "hash"):
+            key = hash_vcf(source, index)
+
+    original = claim(key) if claim is not None else None
+    if original is not None:
+        with span(stats, "duplicate"):
+            stats["duplicate_of"] = original.result()
+        return None, stats
+
+    if cache is not None:
+        with span(stats, "cache"):
+            result = get_cached(cache, key, stats, evidence)
+        if result is not None:
+            stats["cached"] = True
+            return result, stats
+
+    if parse is None:
+        result = parse_vcf(
+            open_function, source, index, stats, memory_budget, panels, evidence
+        )
+    else:
+        result = parse(source, index, stats)
+
+    if cache is not None:
+        with span(stats, "cache"):
+            put_cached(cache, key, result, stats)
+    return result, stats
+
+
+# This function parses a VCF file, given as a path or as a bytes-like object opened
+# with open_function, and returns its lineage calls, see genotype. The file is not
+# checked, and its stats are stored in the given dictionary.
+def parse_vcf(
+    open_function,
+    source,
+    index,
+    stats,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    panels=None,
+    evidence=False,
+):
+    with open_function(source, index, stats, get_merged_positions(panels)) as vcf:
+        return barcoding(vcf, stats, memory_budget, panels, evidence)
+
+
+# This function parses the content of an uploaded VCF file that was checked already,
+# e.g. on a worker process, and returns the lineage calls together with the statistics
+# of the run.
+def parse_upload(
+    data, index=None, memory_budget=DEFAULT_MEMORY_BUDGET, panels=None, evidence=False
+):
+    stats = {"records": 0}
+    result = parse_vcf(
+        open_vcf_buffer, data, index, stats, memory_budget, panels, evidence
+    )
+    return result, stats
+
+
+# This function returns the cached lineage calls of a file, or None if they are not
+# cached, and stores its cached evidence matrix in the stats when evidence is requested.
+# The evidence matrix is cached apart from the calls, under the key of the file with
+# an -evidence suffix, and calls cached without it are genotyped again. Either way, the
+# lookup counts as a single hit or miss.
+def get_cached(cache, key, stats, evidence=False):
+    if not evidence:
+        return cache.get(key)
+
+    result = cache.get(key, count=False)
+    matrix = None
+    if result is not None:
+        matrix = cache.get(f"{key}-evidence", count=False)
+    cache.record(matrix is not None)
+    if matrix is None:
+        return None
+    stats["evidence"] = matrix
+    return result
+
+
+# This function caches the lineage calls of a file, and its evidence matrix if any.
+def put_cached(cache, key, result, stats):
+    cache.put(key, result)
+    if "evidence" in stats:
+        cache.put(f"{key}-evidence", stats["evidence"])
+
+
+# This function genotypes a single VCF file and returns its path, the lineage calls and
+# the statistics of the run. The tabix or CSI index next to the file is used, if any,
+# unless use_index is False.
+def genotype_file(
+    path,
+    use_index=True,
+    cache=None,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    panels=None,
+    evidence=False,
+):
+    index = find_vcf_index(path) if use_index else None
+    return path, *genotype(
+        open_vcf, path, index, cache, memory_budget, panels, evidence
+    )
+
+
+# This function genotypes the content of an uploaded VCF file, given as a bytes-like
+# object together with the optional content of its index file, and returns its name,
+# the lineage calls and the statistics of the run, see genotype.
+def genotype_upload(
+    name,
+    data,
+    index=None,
+    cache=None,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    panels=None,
+    evidence=False,
+    claim=None,
+    parse=None,
+):
+    return name, *genotype(
+        open_vcf_buffer,
+        data,
+        index,
+        cache,
+        memory_budget,
+        panels,
+        evidence,
+        claim,
+        parse,
+    )
+
+
+# This function genotypes a VCF file read from a binary stream, e.g. the body of an HTTP
+# request, while it is received, and returns its name, the lineage calls and the
+# statistics of the run. A stream cannot be hashed before it is read, so the result
+# cache is not used.
+def genotype_stream(name, stream, memory_budget=DEFAULT_MEMORY_BUDGET, panels=None):
+    stats = {"records": 0, "cached": False}
+    with span(stats, "sniff"):
+        stats["warnings"], stream = check_vcf_stream(stream)
+    with open_vcf_stream(stream, stats) as vcf:
+        result = barcoding(vcf, stats, memory_budget, panels)
+    return name, result, stats
+
+
+# This function genotypes a list of VCF files on a pool of worker processes and yields
+# (path, result, stats, error) tuples as soon as each file is done. Files that could
+# not be genotyped are yielded with an empty result and the raised exception. The
+# memory budget applies to each worker process.
+def genotype_files(
+    paths,
+    jobs=None,
+    use_index=True,
+    cache=None,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    panels=None,
+    evidence=False,
+):
+    jobs = jobs or os.cpu_count() or 1
+    args = (use_index, cache, memory_budget, panels, evidence)
+
+    if jobs == 1:
+        for path in paths:
+            try:
+                yield (*genotype_file(path, *args), None)
+            except GENOTYPING_ERRORS as e:
+                yield path, None, {}, e
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, max(len(paths), 1))) as executor:
+        futures = {executor.submit(genotype_file, path, *args): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield (*future.result(), None)
+            except GENOTYPING_ERRORS as e:
+                yield futures[future], None, {}, e
+
+
+# This function formats a duration in seconds as HH:MM:SS.ss
+def format_elapsed(seconds):
+    hours, rem = divmod(seconds, 3600)
+    minutes, seconds = divmod(rem, 60)
+    return f"{int(hours):0>2}:{int(minutes):0>2}:{seconds:05.2f}"
+
+
+# This class accumulates the throughput of a batch genotyping run. The hits and misses
+# of the result cache are counted from the stats of the files, as files genotyped on
+# worker processes look them up in copies of the cache.
+class Throughput:
+    def __init__(self, use_cache=False):
+        self.t_start = time.perf_counter()
+        self.use_cache = use_cache
+        self.files = 0
+        self.failed = 0
+        self.samples = 0
+        self.records = 0
+        self.cached = 0
+
+    def add(self, result, stats, error=None):
+        if error is not None:
+            self.failed += 1
+            return
+        self.files += 1
+        self.samples += len(result)
+        self.records += stats.get("records", 0)
+        self.cached += stats.get("cached", False)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.t_start
+        rate = elapsed if elapsed > 0 else float("inf")
+        cache = (
+            f", cache: {self.cached} hit(s), {self.files - self.cached} miss(es)"
+            if self.use_cache
+            else ""
+        )
+        return (
+            f"Genotyped {self.files} file(s), {self.samples} sample(s){cache}"
+            f"{f', {self.failed} failed' if self.failed else ''}"
+            f" in {format_elapsed(elapsed)}"
+            f" ({self.files / rate:.2f} files/s, {self.records / rate:,.0f} variants/s)"
+        )
@@ -0,0 +1,279 @@
+import io
+import re
+import struct
+import numpy as np
+
+from tbgen.bgzf import read_range
+from tbgen.profiling import span
+
+# BCF files start with the magic "BCF", the major and minor version, and the length of
+# the VCF header text that follows. Only version 2 (BCF2.1 and BCF2.2) is supported.
+BCF_MAGIC = b"BCF\x02"
+BCF_PREFIX = struct.Struct("<5sI")
+
+# Each record starts with the lengths of its shared and per-sample parts, followed by
+# CHROM, POS (0-based), rlen, QUAL, n_allele << 16 | n_info and n_fmt << 24 | n_sample
+RECORD_SIZES = struct.Struct("<II")
+RECORD_SHARED = struct.Struct("<iiifII")
+RECORD_POS = struct.Struct("<12xi")
+
+# Size of the reads of records from a BCF stream
+READ_SIZE = 1024 * 1024
+
+# Types of the typed values of a record, given by the lower 4 bits of their descriptor
+TYPE_INT8 = 1
+TYPE_INT16 = 2
+TYPE_INT32 = 3
+TYPE_FLOAT = 5
+TYPE_CHAR = 7
+TYPE_DTYPES = {
+    0: np.dtype("u1"),
+    TYPE_INT8: np.dtype("<i1"),
+    TYPE_INT16: np.dtype("<i2"),
+    TYPE_INT32: np.dtype("<i4"),
+    TYPE_FLOAT: np.dtype("<f4"),
+    TYPE_CHAR: np.dtype("u1"),
+}
+
+DICTIONARY_PATTERN = re.compile(r"##(FILTER|INFO|FORMAT|contig)=<(.*)>")
+ID_PATTERN = re.compile(r"(?:^|,)ID=([^,>]+)")
+IDX_PATTERN = re.compile(r",IDX=(\d+)")
+
+
+# This function reads the typed value descriptor at the given offset of a record and
+# returns the type and number of its values and the offset of the values.
+def read_descriptor(buffer, offset):
+    descriptor = buffer[offset]
+    value_type, count = descriptor & 0x0F, descriptor >> 4
+    offset += 1
+    if count == 15:
+        # The actual number of values follows, as a typed integer
+        count_type = buffer[offset] & 0x0F
+        count = int(np.frombuffer(buffer, TYPE_DTYPES[count_type], 1, offset + 1)[0])
+        offset += 1 + TYPE_DTYPES[count_type].itemsize
+    return value_type, count, offset
+
+
+# This function reads the typed string at the given offset of a record and returns it
+# together with the offset of the next value.
+def read_string(buffer, offset):
+    _, count, offset = read_descriptor(buffer, offset)
+    value = bytes(buffer[offset : offset + count]).rstrip(b"\0").decode()
+    return value, offset + count
+
+
+# This class holds the dictionaries of the VCF header text of a BCF file, which records
+# refer to by index: the strings (FILTER, INFO and FORMAT IDs, PASS being always the
+# first one) and the contigs, either in the order of the header or as set by their IDX
+# field.
+class BcfHeader:
+    def __init__(self, text):
+        self.text = text
+        self.strings = {"PASS": 0}
+        self.contigs = {}
+        self.samples = []
+        for line in text.split("\n"):
+            match = DICTIONARY_PATTERN.match(line)
+            if match is not None:
+                key = ID_PATTERN.search(match.group(2))
+                if key is None:
+                    continue
+                dictionary = (
+                    self.contigs if match.group(1) == "contig" else self.strings
+                )
+                idx = IDX_PATTERN.search(match.group(2))
+                if idx is not None:
+                    dictionary[key.group(1)] = int(idx.group(1))
+                elif key.group(1) not in dictionary:
+                    dictionary[key.group(1)] = len(dictionary)
+            elif line.startswith("#CHROM"):
+                self.samples = line.rstrip("\r").split("\t")[9:]
+        self.gt_key = self.strings.get("GT")
+        self.contig_names = {idx: name for name, idx in self.contigs.items()}
+
+    # This function returns the header of the BCF file starting with the given bytes,
+    # or None if they do not hold the whole header.
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < BCF_PREFIX.size:
+            return None
+        _, l_text = BCF_PREFIX.unpack_from(data)
+        if len(data) < BCF_PREFIX.size + l_text:
+            return None
+        text = data[BCF_PREFIX.size : BCF_PREFIX.size + l_text]
+        return cls(bytes(text).rstrip(b"\0").decode("utf-8", errors="replace"))
+
+
+# This function yields the buffer and offset of every record of a BCF stream positioned
+# after the header. Records are read in large chunks rather than one by one.
+def iter_record_offsets(stream):
+    buffer = b""
+    offset = 0
+    while True:
+        end = offset + RECORD_SIZES.size
+        if end <= len(buffer):
+            l_shared, l_indiv = RECORD_SIZES.unpack_from(buffer, offset)
+            end += l_shared + l_indiv
+        if end <= len(buffer):
+            yield buffer, offset
+            offset = end
+            continue
+
+        data = stream.read(max(READ_SIZE, end - len(buffer)))
+        if not data:
+            if offset < len(buffer):
+                raise EOFError("BCF record is truncated")
+            return
+        buffer = buffer[offset:] + data
+        offset = 0
+
+
+# This function yields the key and the values (samples x values per sample) of every
+# FORMAT field of the record at the given offset.
+def iter_format_fields(buffer, offset):
+    l_shared, _ = RECORD_SIZES.unpack_from(buffer, offset)
+    n_fmt_sample = RECORD_SHARED.unpack_from(buffer, offset + RECORD_SIZES.size)[5]
+    n_sample, n_fmt = n_fmt_sample & 0xFFFFFF, n_fmt_sample >> 24
+    offset += RECORD_SIZES.size + l_shared
+    for _ in range(n_fmt):
+        key_type, _, offset = read_descriptor(buffer, offset)
+        key = int(np.frombuffer(buffer, TYPE_DTYPES[key_type], 1, offset)[0])
+        offset += TYPE_DTYPES[key_type].itemsize
+        value_type, count, offset = read_descriptor(buffer, offset)
+        dtype = TYPE_DTYPES[value_type]
+        values = np.frombuffer(buffer, dtype, n_sample * count, offset)
+        yield key, values.reshape(n_sample, count)
+        offset += n_sample * count * dtype.itemsize
+
+
+# This function returns the CHROM index, the 1-based position and the alleles (REF
+# first, then ALT) of the record at the given offset.
+def read_site(buffer, offset):
+    chrom, pos, _, _, n_allele_info, _ = RECORD_SHARED.unpack_from(
+        buffer, offset + RECORD_SIZES.size
+    )
+    offset += RECORD_SIZES.size + RECORD_SHARED.size
+    _, offset = read_string(buffer, offset)  # ID
+    alleles = []
+    for _ in range(n_allele_info >> 16):
+        allele, offset = read_string(buffer, offset)
+        alleles.append(allele)
+    return chrom, pos + 1, tuple(alleles)
+
+
+# This function returns the index of the called allele of every sample from the GT
+# values of a record (samples x ploidy), i.e. the last non-missing allele of each
+# genotype, or -1 if the genotype is missing, like the text VCF parser does. Alleles
+# are encoded as (index + 1) << 1 | phased, so missing alleles (0) and the padding of
+# genotypes of lower ploidy (negative) give negative indexes.
+def called_alleles(values):
+    alleles = (values >> 1) - 1
+    called = alleles[:, 0]
+    for column in range(1, alleles.shape[1]):
+        called = np.where(alleles[:, column] >= 0, alleles[:, column], called)
+    return np.maximum(called, -1).astype(np.int8)
+
+
+# This class reads the records of a BCF file, given as a binary stream of its
+# uncompressed content, and decodes their genotypes directly from the binary records,
+# without formatting them as text. With the compressed file and its CSI index, only the
+# blocks holding the records at the positions of interest are inflated.
+class BcfReader:
+    def __init__(self, stream, raw=None, index=None):
+        self.stream = stream
+        self.raw = raw
+        self.index = index
+        self.header = None
+
+    # This function reads the header of the file and returns the sample names.
+    def read_samples(self):
+        prefix = self.stream.read(BCF_PREFIX.size)
+        if len(prefix) < BCF_PREFIX.size or prefix[:4] != BCF_MAGIC:
+            raise ValueError("File is not a BCF2 file")
+        _, l_text = BCF_PREFIX.unpack(prefix)
+        text = self.stream.read(l_text)
+        if len(text) < l_text:
+            raise EOFError("BCF header is truncated")
+        self.header = BcfHeader.from_bytes(prefix + text)
+        return self.header.samples
+
+    # This function yields the buffer and offset of the records to read: those of the
+    # whole file, or those of the chunks of the index holding the given positions.
+    def iter_records(self, positions, stats=None):
+        if self.index is None:
+            yield from iter_record_offsets(self.stream)
+            return
+        cache = {}
+        for start, end in self.index.query(positions):
+            with span(stats, "inflate"):
+                data = read_range(self.raw, start, end, cache)
+            yield from iter_record_offsets(io.BytesIO(data))
+
+    # This function yields the position, alleles and called allele index of every sample
+    # (int8, -1 if missing) of the records located at the given positions. The position
+    # is checked before anything else of a record is decoded, and the reading stops as
+    # soon as a sorted file has passed the last position of interest, as for text VCF
+    # files. The number of records read is stored in the optional stats dictionary.
+    def iter_genotypes(self, positions, stats=None):
+        last_pos = max(positions, default=0)
+        prev_pos = 0
+        is_sorted = True
+        n_records = 0
+
+        for n_records, (buffer, offset) in enumerate(
+            self.iter_records(positions, stats), 1
+        ):
+            pos = RECORD_POS.unpack_from(buffer, offset)[0] + 1
+
+            if pos < prev_pos:
+                is_sorted = False
+            elif pos > last_pos and is_sorted:
+                break
+            prev_pos = pos
+
+            if pos not in positions:
+                continue
+
+            try:
+                record = self.read_genotypes(buffer, offset)
+            except (struct.error, KeyError) as e:
+                raise ValueError(f"BCF record at position {pos} is malformed ({e})")
+            yield record
+
+        if stats is not None:
+            stats["records"] = n_records
+
+    # This function decodes the position, alleles and called allele index of every
+    # sample of the record at the given offset. Samples without GT are missing.
+    def read_genotypes(self, buffer, offset):
+        n_samples = len(self.header.samples)
+        _, pos, alleles = read_site(buffer, offset)
+        gt = next(
+            (
+                values
+                for key, values in iter_format_fields(buffer, offset)
+                if key == self.header.gt_key
+            ),
+            None,
+        )
+
+        row = np.full(n_samples, -1, dtype=np.int8)
+        if gt is not None:
+            if len(gt) > n_samples:
+                raise IndexError(
+                    f"Record at position {pos} has more samples than header"
+                )
+            if gt.shape[1] > 0:
+                row[: len(gt)] = called_alleles(gt)
+        return pos, alleles, row
+
+    def close(self):
+        self.stream.close()
+        if self.raw is not None:
+            self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,195 @@
+import io
+import os
+import zlib
+import struct
+
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+# BGZF files are series of gzip blocks whose header carries the compressed size of the
+# block in a "BC" extra subfield, which allows jumping to any block of the file.
+BGZF_HEADER = b"\x1f\x8b\x08\x04"
+BGZF_HEADER_SIZE = 18
+BLOCK_TRAILER = struct.Struct("<II")
+
+# Number of threads inflating the blocks of a BGZF file, and of blocks inflated ahead of
+# the parser per thread. Beyond a few threads, parsing the records is the bottleneck.
+INFLATE_THREADS = int(
+    os.environ.get("TBGEN_INFLATE_THREADS", min(4, os.cpu_count() or 1))
+)
+INFLATE_AHEAD = 4
+
+
+# This function checks whether the first bytes of a file are the header of a BGZF block.
+def is_bgzf(magic):
+    return (
+        len(magic) >= BGZF_HEADER_SIZE
+        and magic[:4] == BGZF_HEADER
+        and magic[12:14] == b"BC"
+    )
+
+
+# This function reads the BGZF block starting at the given compressed offset and returns
+# its compressed size together with the raw deflate data of the block.
+def read_block_data(raw, offset):
+    raw.seek(offset)
+    block_size, cdata = read_next_block_data(raw, offset)
+    return block_size, cdata[:-8]
+
+
+# This function reads the BGZF block at the current position of a binary stream, which
+# need not be seekable, and returns its compressed size together with its raw deflate
+# data followed by its CRC32 and uncompressed size. The offset is only used in error
+# messages.
+def read_next_block_data(raw, offset):
+    header = raw.read(12)
+    if len(header) == 0:
+        return 0, b""
+    if len(header) < 12 or header[:4] != BGZF_HEADER:
+        raise ValueError(f"Invalid BGZF block at offset {offset}")
+
+    # Look for the BSIZE value in the extra subfields
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = raw.read(xlen)
+    block_size = None
+    i = 0
+    while i + 4 <= len(extra):
+        slen = struct.unpack("<H", extra[i + 2 : i + 4])[0]
+        if extra[i : i + 2] == b"BC":
+            block_size = struct.unpack("<H", extra[i + 4 : i + 6])[0] + 1
+        i += 4 + slen
+    if block_size is None:
+        raise ValueError(f"Invalid BGZF block at offset {offset}")
+
+    # The block ends with the CRC32 and the uncompressed size
+    cdata = raw.read(block_size - 12 - xlen)
+    if len(cdata) != block_size - 12 - xlen:
+        raise EOFError("BGZF block is truncated")
+    return block_size, cdata
+
+
+# This function inflates the raw deflate data of a BGZF block.
+def inflate_block(cdata):
+    return zlib.decompress(cdata, -15)
+
+
+# This function inflates the raw deflate data of a BGZF block followed by its CRC32 and
+# uncompressed size, and checks them like gzip does.
+def inflate_checked_block(cdata):
+    block = inflate_block(cdata[:-8])
+    crc, size = BLOCK_TRAILER.unpack_from(cdata, len(cdata) - 8)
+    if zlib.crc32(block) != crc or len(block) != size:
+        raise ValueError("CRC check failed")
+    return block
+
+
+# This function reads and inflates the BGZF block starting at the given compressed
+# offset and returns its compressed size together with the uncompressed data.
+def read_block(raw, offset):
+    block_size, cdata = read_block_data(raw, offset)
+    return block_size, inflate_block(cdata)
+
+
+# This function returns the uncompressed data between two virtual offsets. A virtual
+# offset holds the compressed offset of a block in its upper 48 bits and the offset
+# within the uncompressed block in its lower 16 bits.
+def read_range(raw, start, end, cache=None):
+    coffset, uoffset = start >> 16, start & 0xFFFF
+    end_coffset, end_uoffset = end >> 16, end & 0xFFFF
+    cache = {} if cache is None else cache
+
+    data = bytearray()
+    while coffset < end_coffset or (coffset == end_coffset and end_uoffset > 0):
+        if coffset not in cache:
+            # Only the last block is kept, as consecutive ranges may share it
+            cache.clear()
+            cache[coffset] = read_block(raw, coffset)
+        block_size, block = cache[coffset]
+        if block_size == 0:
+            break
+        data += block[:end_uoffset] if coffset == end_coffset else block
+        coffset += block_size
+    return bytes(data[uoffset:])
+
+
+# This function returns a pool of threads inflating BGZF blocks, shared by all the
+# files read by a process. It is keyed on the process id, as worker processes forked
+# from a process with a pool do not inherit its threads.
+@lru_cache(maxsize=None)
+def get_inflate_executor(threads, pid):
+    return ThreadPoolExecutor(max_workers=threads, thread_name_prefix="tbgen-inflate")
+
+
+# This class reads the uncompressed content of a BGZF file from a binary stream, which
+# need not be seekable. The blocks are read in order, inflated on a pool of threads,
+# zlib releasing the GIL while it inflates, and returned in the order of the file. Up to
+# INFLATE_AHEAD blocks per thread are inflated ahead of the reader, which bounds the
+# memory used. With a single thread, blocks are inflated when they are read. The CRC32
+# and size of every block are checked, as gzip does.
+class BgzfReader(io.RawIOBase):
+    def __init__(self, raw, threads=INFLATE_THREADS):
+        self.raw = raw
+        self.executor = (
+            get_inflate_executor(threads, os.getpid()) if threads > 1 else None
+        )
+        self.ahead = INFLATE_AHEAD * threads
+        self.offset = 0
+        self.pending = deque()
+        self.data = memoryview(b"")
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    # This function reads the next blocks and submits them to be inflated, until
+    # enough are pending or the end of the file is reached.
+    def submit_blocks(self):
+        while not self.eof and len(self.pending) < self.ahead:
+            block_size, cdata = read_next_block_data(self.raw, self.offset)
+            if block_size == 0:
+                self.eof = True
+                break
+            self.pending.append(
+                (self.offset, self.executor.submit(inflate_checked_block, cdata))
+            )
+            self.offset += block_size
+
+    # This function returns the uncompressed data of the next block, or None at the end
+    # of the file.
+    def next_block(self):
+        offset = self.offset
+        try:
+            if self.executor is None:
+                block_size, cdata = read_next_block_data(self.raw, offset)
+                if block_size == 0:
+                    return None
+                self.offset += block_size
+                return inflate_checked_block(cdata)
+
+            self.submit_blocks()
+            if not self.pending:
+                return None
+            offset, future = self.pending.popleft()
+            return future.result()
+        except (zlib.error, ValueError) as e:
+            raise ValueError(f"Invalid BGZF block at offset {offset} ({e})")
+
+    def readinto(self, b):
+        # Blocks may be empty, e.g. the end-of-file marker
+        while not self.data:
+            block = self.next_block()
+            if block is None:
+                return 0
+            self.data = memoryview(block)
+        n = min(len(b), len(self.data))
+        b[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+    def close(self):
+        for _, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.raw.close()
+        super().close()
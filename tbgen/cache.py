@@ -0,0 +1,157 @@
+import os
+import re
+import gzip
+import pickle
+import shutil
+import hashlib
+import tempfile
+
+from tbgen.bgzf import BGZF_HEADER_SIZE, BgzfReader, is_bgzf
+from tbgen.panel import get_panels_hash
+from tbgen.vcf import GZIP_MAGIC, BufferReader
+
+# Version of the cached results, to be increased whenever a change to the code alters
+# the lineages called from the same file with the same barcode panel
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "TBGEN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tbgen")
+)
+DEFAULT_CACHE_SIZE = int(os.environ.get("TBGEN_CACHE_SIZE", 256 * 1024 * 1024))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+VERSION_DIR_PATTERN = re.compile(r"v(\d+)-[0-9a-f]{16}")
+
+
+# This function returns the SHA-256 of the content of a VCF file, given as a path or as
+# a bytes-like object, so that the same VCF gets the same key whether it is gzipped or
+# not. A BGZF-compressed file read with an index is hashed as it is, since inflating
+# the whole file would defeat reading only the barcoding blocks.
+def hash_vcf(source, index=None):
+    raw = open(source, "rb") if isinstance(source, str) else BufferReader(source)
+    with raw:
+        magic = raw.read(BGZF_HEADER_SIZE)
+        raw.seek(0)
+        if index is not None and is_bgzf(magic):
+            stream = raw
+        elif is_bgzf(magic):
+            stream = BgzfReader(raw)
+        elif magic[: len(GZIP_MAGIC)] == GZIP_MAGIC:
+            stream = gzip.GzipFile(fileobj=raw)
+        else:
+            stream = raw
+
+        sha256 = hashlib.sha256()
+        while chunk := stream.read(HASH_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+# This class stores the lineage calls of VCF files on disk, keyed on the hash of their
+# content. The entries live in a directory named after the barcode panels, the active
+# ones by default, and the cache version, so that the entries of other panels are never
+# returned. The directories of older cache versions are removed when the cache is
+# opened, while those of other panels are kept, as the web-app and command line runs
+# with other panels may share the cache. The least recently used entries are evicted
+# once the total size of the cache exceeds max_bytes.
+class ResultCache:
+    def __init__(
+        self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE, panels=None
+    ):
+        self.root = directory
+        self.version = f"v{CACHE_VERSION}-{get_panels_hash(panels)[:16]}"
+        self.directory = os.path.join(directory, self.version)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.remove_outdated()
+
+    def remove_outdated(self):
+        for entry in os.scandir(self.root):
+            match = VERSION_DIR_PATTERN.fullmatch(entry.name)
+            if entry.is_dir() and match and int(match.group(1)) < CACHE_VERSION:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    # This function returns the entry of a key, or None if there is none. Lookups made
+    # of several entries are counted by the caller, with count=False and record.
+    def get(self, key, count=True):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+            # The modification time of the entries orders them for the eviction
+            os.utime(path)
+        except FileNotFoundError:
+            result = None
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # Entries are written atomically, but a damaged entry is dropped all the same
+            self.discard(path)
+            result = None
+        if count:
+            self.record(result is not None)
+        return result
+
+    def record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def put(self, key, result):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            self.discard(tmp_path)
+            raise
+        self.evict()
+
+    def discard(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self.discard(path)
+            self.evictions += 1
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            self.discard(path)
+
+    def summary(self):
+        entries = self.entries()
+        return (
+            f"{self.hits} hit(s), {self.misses} miss(es), {len(entries)} entries"
+            f" ({sum(size for _, size, _ in entries) / 1024 ** 2:.1f} MB)"
+        )
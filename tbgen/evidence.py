@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from functools import lru_cache
+from tbgen.panel import DEFAULT_PANEL, get_barcode_index
+
+# Evidence of a barcoding SNP in a sample, ordered by precedence: when several records
+# are located at the position of a SNP, e.g. the records of a split multiallelic site,
+# the sample gets the highest evidence of these records
+MISSING = 0
+REF = 1
+OTHER = 2
+HIT = 3
+EVIDENCE_LABELS = np.array(["missing", "ref", "other", "hit"], dtype=object)
+
+# Columns of the evidence tables, with the types of their columnar exports
+EVIDENCE_SCHEMA = pa.schema(
+    [
+        ("Sample", pa.string()),
+        ("panel", pa.string()),
+        ("POS", pa.int64()),
+        ("REF", pa.string()),
+        ("ALT", pa.string()),
+        ("level", pa.string()),
+        ("lineage", pa.string()),
+        ("evidence", pa.string()),
+    ]
+)
+
+
+# This function returns the barcoding SNPs of a panel, one row per (POS, REF, ALT) of
+# the barcode index, with the levels and lineages they define.
+@lru_cache(maxsize=None)
+def get_barcode_snps(definition=DEFAULT_PANEL):
+    barcode_index = get_barcode_index(definition)
+    defined = barcode_index.notna().to_numpy()
+    levels = barcode_index.columns.to_numpy()
+    snps = barcode_index.index.to_frame(index=False)
+    snps.insert(0, "panel", definition.name)
+    snps["level"] = [", ".join(levels[row]) for row in defined]
+    snps["lineage"] = [
+        ", ".join(lineages[row])
+        for lineages, row in zip(barcode_index.to_numpy(), defined)
+    ]
+    return snps
+
+
+# This class holds the evidence of every barcoding SNP in every sample of a VCF file,
+# i.e. whether the sample carries its ALT allele (hit), its REF allele (ref) or another
+# allele (other), or was not called at its position (missing). Missing evidence is by
+# far the most common, as VCF files mostly hold variant records, so only the other
+# entries are stored, as (sample, SNP, evidence) triplets.
+class EvidenceMatrix:
+    def __init__(self, samples, snps, sample_idx, snp_idx, evidence):
+        self.samples = samples
+        self.snps = snps
+        self.sample_idx = sample_idx
+        self.snp_idx = snp_idx
+        self.evidence = evidence
+
+    # This function returns the evidence of the SNPs of several panels in the same
+    # samples as a single matrix.
+    @classmethod
+    def concat(cls, matrices):
+        offsets = np.cumsum([0] + [len(matrix.snps) for matrix in matrices])
+        return cls(
+            matrices[0].samples,
+            pd.concat([matrix.snps for matrix in matrices], ignore_index=True),
+            np.concatenate([matrix.sample_idx for matrix in matrices]),
+            np.concatenate(
+                [matrix.snp_idx + offset for matrix, offset in zip(matrices, offsets)]
+            ),
+            np.concatenate([matrix.evidence for matrix in matrices]),
+        )
+
+    def __len__(self):
+        return len(self.evidence)
+
+    # This function returns the stored entries in long format, one row per sample and
+    # SNP with evidence, in the order of the samples and of the SNPs.
+    def to_dataframe(self):
+        order = np.lexsort((self.snp_idx, self.sample_idx))
+        df = self.snps.iloc[self.snp_idx[order]].reset_index(drop=True)
+        df.insert(
+            0, "Sample", np.array(self.samples, dtype=object)[self.sample_idx[order]]
+        )
+        df["evidence"] = EVIDENCE_LABELS[self.evidence[order]]
+        return df
+
+    # This function returns the evidence of every SNP in a sample, missing included.
+    def sample_table(self, sample):
+        keep = self.sample_idx == self.samples.index(sample)
+        evidence = np.full(len(self.snps), MISSING, dtype=np.int8)
+        evidence[self.snp_idx[keep]] = self.evidence[keep]
+        df = self.snps.copy()
+        df["evidence"] = EVIDENCE_LABELS[evidence]
+        return df
+
+    # This function returns the number of SNPs of each evidence in each sample.
+    def summary(self):
+        counts = np.zeros((len(self.samples), len(EVIDENCE_LABELS)), dtype=np.int64)
+        np.add.at(counts, (self.sample_idx, self.evidence), 1)
+        counts[:, MISSING] = len(self.snps) - counts.sum(axis=1)
+        df = pd.DataFrame(counts[:, ::-1], columns=EVIDENCE_LABELS[::-1])
+        df.insert(0, "Sample", self.samples)
+        return df
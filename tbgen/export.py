@@ -0,0 +1,118 @@
+import io
+import gzip
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Formats tables can be exported to, keyed on their file extension, with their label
+# and MIME type
+EXPORT_FORMATS = {
+    "tsv": ("TSV", "text/tab-separated-values"),
+    "csv": ("CSV", "text/csv"),
+    "tsv.gz": ("TSV (gzip)", "application/gzip"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet"),
+    "arrow": ("Arrow IPC", "application/vnd.apache.arrow.file"),
+}
+TEXT_FORMATS = ("tsv", "csv", "tsv.gz")
+
+# Number of rows serialized at a time, so that large tables are never formatted whole
+# in memory
+CHUNK_ROWS = 50_000
+
+
+# This function returns the export format of a file from its extension, or None if it
+# is not one of EXPORT_FORMATS.
+def guess_format(path):
+    for file_format in sorted(EXPORT_FORMATS, key=len, reverse=True):
+        if path.endswith(f".{file_format}"):
+            return file_format
+    return None
+
+
+# This class writes tables to a binary file in one of EXPORT_FORMATS, as they come:
+# text formats get the header of the first table only, and columnar formats get one
+# row group (Parquet) or record batch (Arrow IPC) per table, with the given schema or
+# that of the first table. The file itself is not closed.
+class TableWriter:
+    def __init__(self, out, file_format="tsv", schema=None):
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported file format: {file_format}")
+        self.out = out
+        self.file_format = file_format
+        self.header = True
+        self.text = None
+        self.stream = None
+        self.schema = schema
+        self.writer = None
+
+        if file_format in TEXT_FORMATS:
+            self.sep = "," if file_format == "csv" else "\t"
+            self.stream = (
+                gzip.GzipFile(fileobj=out, mode="wb")
+                if file_format == "tsv.gz"
+                else out
+            )
+            self.text = io.TextIOWrapper(self.stream, encoding="utf-8", newline="")
+
+    def write(self, df):
+        if self.text is not None:
+            df.to_csv(self.text, sep=self.sep, index=False, header=self.header)
+            self.header = False
+            return
+
+        if self.writer is None:
+            self.schema = self.schema or pa.Schema.from_pandas(df, preserve_index=False)
+            if self.file_format == "parquet":
+                self.writer = pq.ParquetWriter(self.out, self.schema)
+            else:
+                self.writer = pa.ipc.new_file(self.out, self.schema)
+        self.writer.write_table(
+            pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        )
+
+    # This function pushes the rows written so far to the file. Gzipped files are only
+    # flushed when closed, which keeps their compression ratio.
+    def flush(self):
+        if self.text is not None:
+            self.text.flush()
+        if self.file_format != "tsv.gz":
+            self.out.flush()
+
+    def close(self):
+        if self.text is not None:
+            self.text.flush()
+            self.text.detach()
+            if self.stream is not self.out:
+                self.stream.close()
+        else:
+            if self.writer is None and self.schema is not None:
+                # Files without rows still get their schema
+                self.write(self.schema.empty_table().to_pandas())
+            if self.writer is not None:
+                self.writer.close()
+        self.out.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# This function writes a table to a binary file in one of EXPORT_FORMATS, CHUNK_ROWS
+# rows at a time. The schema of columnar formats is inferred from the whole table, as
+# a column may be empty in its first rows.
+def write_table(df, out, file_format="tsv"):
+    schema = None
+    if file_format not in TEXT_FORMATS:
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with TableWriter(out, file_format, schema) as writer:
+        # An empty table still gets its header or schema
+        for start in range(0, max(len(df), 1), CHUNK_ROWS):
+            writer.write(df.iloc[start : start + CHUNK_ROWS])
+
+
+# This function returns the bytes of a table exported to one of EXPORT_FORMATS.
+def export_table(df, file_format="tsv"):
+    out = io.BytesIO()
+    write_table(df, out, file_format)
+    return out.getvalue()
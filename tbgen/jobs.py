@@ -0,0 +1,223 @@
+import os
+import time
+import uuid
+import hashlib
+import threading
+
+from functools import partial
+from concurrent.futures import Future, ThreadPoolExecutor
+from tbgen.batch import genotype_upload, parse_upload
+from tbgen.profiling import log_stats, merge_stats, span
+
+# Time, in seconds, finished jobs and their results are kept for
+JOB_TTL = int(os.environ.get("TBGEN_JOB_TTL", 3600))
+
+
+# This function returns the key of a genotyping job, the hash of the names and contents
+# of its (name, data, index) files and of whether the evidence is requested, so that
+# the same files submitted again are given the same job.
+def job_key(files, evidence=False):
+    sha256 = hashlib.sha256()
+    sha256.update(b"evidence\n" if evidence else b"calls\n")
+    for name, data, index in files:
+        for part in (name.encode(), data, index or b""):
+            sha256.update(f"{len(part)}\n".encode())
+            sha256.update(part)
+    return sha256.hexdigest()
+
+
+# This function returns the content of a file as bytes, to be sent to a worker process.
+# Views of whole bytes objects, e.g. of uploads, are sent without copying them first.
+def to_bytes(data):
+    if isinstance(data, memoryview) and isinstance(data.obj, bytes):
+        if data.nbytes == len(data.obj):
+            return data.obj
+    return bytes(data)
+
+
+# This class holds the state of a genotyping job: the lineage calls of its files, in
+# the order of submission, the exceptions raised by the files that could not be
+# genotyped and the stats of the others. The files are listed in the order they were
+# done in, with the running number of samples, so that progress can be polled from
+# another thread. Files with the same content as another file of the job are only
+# genotyped once: they get no results of their own and are listed in duplicates, with
+# the name of the file genotyped instead. With evidence, the stats of every file hold
+# its evidence matrix.
+class Job:
+    def __init__(self, job_id, key, names, evidence=False):
+        self.id = job_id
+        self.key = key
+        self.names = names
+        self.evidence = evidence
+        self.results = {}
+        self.errors = {}
+        self.stats = {}
+        self.duplicates = {}
+        self.completed = []
+        self._originals = {}
+        self._pending = {}
+        self.samples = 0
+        self.created = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+        if not names:
+            self.finished = self.created
+            self._done.set()
+
+    @property
+    def total(self):
+        return len(self.names)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    # This function waits for the job to finish, at most timeout seconds, and returns
+    # whether it did.
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.created
+
+    def add(self, n, result=None, stats=None, error=None):
+        with self._lock:
+            name = self.names[n]
+            if error is None and "duplicate_of" in stats:
+                self.duplicates[name] = stats["duplicate_of"]
+                # The same file uploaded twice keeps the stats of its first upload
+                self.stats.setdefault(name, stats)
+            elif error is None:
+                self.results[n] = result
+                self.stats[name] = stats
+                self.samples += len(result)
+            else:
+                self.errors[name] = error
+            self.completed.append((name, error, self.duplicates.get(name)))
+            if len(self.completed) == self.total:
+                self.finished = time.time()
+                self._done.set()
+            pending = self._pending.pop(n, None)
+
+        # Duplicates waiting for this file get its outcome
+        if pending is not None:
+            if error is None:
+                pending.set_result(name)
+            else:
+                pending.set_exception(error)
+
+    # This function registers the content hash of the nth file of the job. It returns
+    # None if no other file of the job has the same content, or the future of the file
+    # that has it and is genotyped instead, which resolves to its name.
+    def claim(self, n, fingerprint):
+        with self._lock:
+            original = self._originals.get(fingerprint)
+            if original is None:
+                self._originals[fingerprint] = self._pending[n] = Future()
+            return original
+
+    def get_results(self):
+        with self._lock:
+            return [self.results[n] for n in sorted(self.results)]
+
+
+# This class runs genotyping jobs in the background, so that they outlive the request
+# that submitted them, and keeps their results for ttl seconds after they finish. The
+# files of a job are dispatched from a pool of threads, which look up the result cache,
+# while the genotyping itself runs on the optional process pool. A job with a single
+# file is genotyped in this process, straight from the buffer it was submitted with,
+# which saves sending its content to a worker.
+class JobManager:
+    def __init__(self, pool=None, cache=None, max_workers=None, ttl=JOB_TTL):
+        self.pool = pool
+        self.cache = cache
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or os.cpu_count() or 1,
+            thread_name_prefix="tbgen-job",
+        )
+        self.jobs = {}
+        self.keys = {}
+        self._lock = threading.Lock()
+
+    # This function submits a job genotyping a list of (name, data, index) files, with
+    # the evidence of the barcoding SNPs if requested, and returns it. Files identical
+    # to those of a job that is running or was kept are not genotyped again: that job
+    # is returned instead.
+    def submit(self, files, evidence=False):
+        key = job_key(files, evidence)
+        with self._lock:
+            self.remove_expired()
+            job = self.jobs.get(self.keys.get(key))
+            if job is not None:
+                return job
+            job = Job(uuid.uuid4().hex, key, [name for name, _, _ in files], evidence)
+            self.jobs[job.id] = job
+            self.keys[key] = job.id
+
+        pool = self.pool if len(files) > 1 else None
+        for n, (name, data, index) in enumerate(files):
+            future = self.executor.submit(
+                self.genotype,
+                name,
+                data,
+                index,
+                pool,
+                partial(job.claim, n),
+                job.evidence,
+            )
+            future.add_done_callback(partial(self.on_done, job, n))
+        return job
+
+    def on_done(self, job, n, future):
+        try:
+            result, stats = future.result()
+        except Exception as e:
+            job.add(n, error=e)
+        else:
+            job.add(n, result, stats)
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def remove_expired(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.done and now - job.finished > self.ttl:
+                del self.jobs[job_id]
+                del self.keys[job.key]
+
+    # This function genotypes a file of a job and returns the lineage calls and the
+    # stats of the run, with the time spent in each stage, see genotype_upload. The
+    # file is checked, hashed and looked up in the result cache in this process, and
+    # only parsed on the process pool, if any. The content hash of the file is
+    # registered with the optional claim function of its job: a file with the same
+    # content as another file of the job, e.g. the same file uploaded twice or both
+    # x.vcf and x.vcf.gz, waits for that file instead of being genotyped, and gets no
+    # result but the name of that file in its stats. With evidence, the stats hold the
+    # evidence matrix of the file.
+    def genotype(self, name, data, index=None, pool=None, claim=None, evidence=False):
+        parse = None if pool is None else partial(dispatch, pool, evidence)
+        _, result, stats = genotype_upload(
+            name, data, index, self.cache, evidence=evidence, claim=claim, parse=parse
+        )
+        log_stats(name, stats)
+        return result, stats
+
+
+# This function parses a file that was checked already on a worker process of the pool
+# and returns its lineage calls. The time spent by the worker is taken off the dispatch
+# stage.
+def dispatch(pool, evidence, data, index, stats):
+    with span(stats, "dispatch"):
+        result, file_stats = pool.submit(
+            parse_upload,
+            to_bytes(data),
+            None if index is None else to_bytes(index),
+            evidence=evidence,
+        ).result()
+    merge_stats(stats, file_stats, parent="dispatch")
+    return result
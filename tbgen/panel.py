@@ -0,0 +1,216 @@
+import os
+import hashlib
+import warnings
+import pandas as pd
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+from tbgen.artifact import CompiledPanel, compile_panel, hash_sources, load_panel
+
+DATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"
+)
+LEVELS_PATH = os.path.join(DATA_DIR, "levels.tsv")
+BARCODE_PATH = os.path.join(DATA_DIR, "snp_barcode.tsv")
+PANEL_PATH = os.path.join(DATA_DIR, "barcode_panel.bin")
+
+# Lineages of the bundled panel that are called when none of their SNPs is present, by
+# level
+ABSENCE_MARKERS = {"level_1": "L4", "level_2": "L4.9"}
+
+# Lineages of the bundled panel that are called without warning from a single SNP, by
+# level
+SINGLE_SNP_LINEAGES = {
+    "level_1": ("L8",),
+    "level_2": ("L2.2 (modern)", "L2.2 (ancient)"),
+}
+
+# Pairs of lineages of the bundled panel of which only the first one is called when a
+# sample carries both
+MODERN_ANCIENT = {"level_2": ("L2.2 (modern)", "L2.2 (ancient)")}
+
+# Additional panels genotyped side by side with the bundled one, as a list of TSV files
+# in the format of levels.tsv, optionally named with name=path, separated by os.pathsep
+PANELS_ENV = "TBGEN_PANELS"
+
+
+# This class defines a barcode panel: its barcoding SNPs, in the long format of
+# levels.tsv, and the rules resolving the lineages called at each level. Panels are
+# identified by their name and files only, so that they can be used as cache keys and
+# sent to worker processes.
+@dataclass(frozen=True)
+class PanelDefinition:
+    name: str
+    levels_path: str
+    barcode_path: str = None
+    compiled_path: str = None
+    absence_markers: dict = field(default_factory=dict, compare=False)
+    single_snp_lineages: dict = field(default_factory=dict, compare=False)
+    modern_ancient: dict = field(default_factory=dict, compare=False)
+
+    def sources(self):
+        return [path for path in (self.levels_path, self.barcode_path) if path]
+
+
+# The panel of Shitikov & Bespiatykh (2023), bundled with the app. Its lineages are
+# reported in the level_1 to level_5 columns, those of the other panels are prefixed
+# with the name of the panel.
+DEFAULT_PANEL = PanelDefinition(
+    "shitikov-bespiatykh",
+    LEVELS_PATH,
+    BARCODE_PATH,
+    PANEL_PATH,
+    ABSENCE_MARKERS,
+    SINGLE_SNP_LINEAGES,
+    MODERN_ANCIENT,
+)
+
+
+# This function returns the definition of a panel given as a TSV file in the format of
+# levels.tsv, named with name=path or after the file otherwise. Its lineages are
+# reported as they are called, without absence markers nor warnings.
+def panel_from_tsv(spec):
+    name, _, path = spec.rpartition("=")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Barcode panel not found: {path}")
+    if not name:
+        name = os.path.basename(path).split(".")[0]
+    return PanelDefinition(name, os.path.abspath(path))
+
+
+# This function returns the bundled panel followed by the panels of the TBGEN_PANELS
+# environment variable, which are inherited by worker processes.
+@lru_cache(maxsize=None)
+def get_active_panels():
+    specs = os.environ.get(PANELS_ENV, "").split(os.pathsep)
+    return (DEFAULT_PANEL,) + tuple(panel_from_tsv(spec) for spec in specs if spec)
+
+
+# This function compiles the barcode panel from levels.tsv and snp_barcode.tsv and
+# writes it to the given path.
+def build_panel(path=PANEL_PATH):
+    data = compile_panel(LEVELS_PATH, BARCODE_PATH)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+# This function returns a compiled barcode panel. The bundled panel is memory-mapped
+# from PANEL_PATH, so that every process and page uses the same panel without parsing
+# it. If the compiled panel is missing or out of date with its source files, or for
+# panels without a compiled file, the panel is compiled in memory instead.
+@lru_cache(maxsize=None)
+def get_panel(definition=DEFAULT_PANEL):
+    if definition.compiled_path is None:
+        return CompiledPanel(compile_panel(*definition.sources()))
+
+    try:
+        panel = load_panel(definition.compiled_path)
+    except (OSError, ValueError):
+        panel = None
+
+    if panel is not None and panel.hash == hash_sources(definition.sources()):
+        return panel
+
+    warnings.warn(
+        f"{definition.compiled_path} is missing or out of date, "
+        "run `python -m tbgen build-panel` to rebuild it"
+    )
+    return CompiledPanel(compile_panel(*definition.sources()))
+
+
+@lru_cache(maxsize=None)
+def get_levels_data(definition=DEFAULT_PANEL):
+    temp_df = get_panel(definition).levels_table()
+    uniqueLevels = temp_df["level"].unique()
+    levelsDict = {}
+
+    # For each unique level value, extract the relevant data and store it in the dictionary
+    for elem in uniqueLevels:
+        levelsDict[elem] = temp_df[temp_df["level"] == elem][
+            ["POS", "REF", "ALT", "lineage"]
+        ]
+
+    # Create a tuple of NumPy arrays, where each array contains the data for a different level
+    # Each array contains the positional data, the reference allele, the alternate allele,
+    # and the lineage (i.e., the level value) for each row in the data
+    # The tuple contains data for levels 1 through 5
+    # Levels without any SNP in the panel get empty arrays
+    empty = pd.DataFrame(columns=["POS", "REF", "ALT", "lineage"])
+    levels_data = tuple(levelsDict.get(i, empty).to_numpy().T for i in range(1, 6))
+
+    pos = temp_df["POS"].values
+
+    return levels_data, pos
+
+
+# This function returns the content hash of the barcode panel, which identifies the
+# version of the panel the lineages are called with.
+def get_panel_hash(definition=DEFAULT_PANEL):
+    return get_panel(definition).hash
+
+
+# This function returns the hash identifying a set of panels, which is the hash of the
+# bundled panel when it is the only one.
+def get_panels_hash(panels=None):
+    panels = panels or get_active_panels()
+    if panels == (DEFAULT_PANEL,):
+        return get_panel_hash()
+    sha256 = hashlib.sha256()
+    for definition in panels:
+        sha256.update(f"{definition.name}\n{get_panel_hash(definition)}\n".encode())
+    return sha256.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def get_barcode_positions(definition=DEFAULT_PANEL):
+    return frozenset(get_panel(definition).arrays["pos"].tolist())
+
+
+# This function returns the barcode positions of all the given panels, the active ones
+# by default, so that a VCF file is read once for all of them.
+@lru_cache(maxsize=None)
+def get_merged_positions(panels=None):
+    return frozenset().union(
+        *(
+            get_barcode_positions(definition)
+            for definition in panels or get_active_panels()
+        )
+    )
+
+
+# This function builds an index of the barcoding SNPs keyed on (POS, REF, ALT), with one
+# column per level holding the lineage defined by the SNP at that level (NaN otherwise).
+# Each called allele can then be resolved with a single lookup instead of comparing it
+# against every barcoding SNP.
+@lru_cache(maxsize=None)
+def get_barcode_index(definition=DEFAULT_PANEL):
+    levels = get_levels_data(definition)[0]
+    level_names = [f"level_{i+1}" for i in range(len(levels))]
+
+    barcodes = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "POS": level[0],
+                    "REF": level[1],
+                    "ALT": level[2],
+                    "level": level_names[i],
+                    "lineage": level[3],
+                }
+            )
+            for i, level in enumerate(levels)
+        ]
+    ).astype({"POS": "int64"})
+
+    # SNPs defining several lineages within the same level are concatenated
+    barcode_index = barcodes.pivot_table(
+        index=["POS", "REF", "ALT"],
+        columns="level",
+        values="lineage",
+        aggfunc="".join,
+    ).reindex(columns=level_names)
+
+    return barcode_index
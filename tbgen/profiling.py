@@ -0,0 +1,78 @@
+import time
+import logging
+
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger("tbgen")
+
+# Counts reported together with the durations of the stages
+COUNTS = ("samples", "records", "barcode_records")
+
+
+# This class holds the time spent in each named stage of a run, in seconds. Stages may
+# be nested and entered several times: only the time spent in a stage itself, outside
+# of its nested stages, is added to it, so that the durations add up to the total.
+class Spans(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stack = []
+
+    @contextmanager
+    def span(self, name):
+        # Stages are listed in the order they are first entered
+        self.setdefault(name, 0.0)
+        frame = [time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            self[name] += elapsed - frame[1]
+            if self._stack:
+                self._stack[-1][1] += elapsed
+
+
+# This function returns a context manager timing a stage into the spans of the stats
+# dictionary, or doing nothing if there is no stats dictionary.
+def span(stats, name):
+    if stats is None:
+        return nullcontext()
+    return stats.setdefault("spans", Spans()).span(name)
+
+
+# This function adds the spans and counts of another run, e.g. returned by a worker
+# process, to the stats dictionary. The time of these spans is taken off the parent
+# stage, which waited for the other run.
+def merge_stats(stats, other, parent=None):
+    spans = stats.setdefault("spans", Spans())
+    for name, seconds in other.get("spans", {}).items():
+        spans[name] = spans.get(name, 0.0) + seconds
+        if parent in spans:
+            spans[parent] -= seconds
+    for key, value in other.items():
+        if key != "spans":
+            stats[key] = value
+
+
+# This function flattens the stats dictionary of a run into the counts and the
+# duration, in milliseconds, of each stage and of the whole run.
+def summarize_stats(stats):
+    summary = {count: stats[count] for count in COUNTS if count in stats}
+    summary["cached"] = stats.get("cached", False)
+    spans = stats.get("spans", {})
+    for name, seconds in spans.items():
+        summary[f"{name}_ms"] = round(seconds * 1000, 2)
+    summary["total_ms"] = round(sum(spans.values()) * 1000, 2)
+    return summary
+
+
+# This function logs the stats of the run of a file as a single line of key=value
+# pairs, which can be parsed by log processors.
+def log_stats(name, stats):
+    if logger.isEnabledFor(logging.INFO):
+        fields = " ".join(
+            f"{key}={str(value).lower() if isinstance(value, bool) else value}"
+            for key, value in summarize_stats(stats).items()
+        )
+        logger.info(f'genotyped file="{name}" {fields}')
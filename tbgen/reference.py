@@ -0,0 +1,217 @@
+import os
+import re
+import mmap
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from tbgen.artifact import hash_sources, pack_artifact, unpack_artifact
+from tbgen.panel import DATA_DIR
+from tbgen.variants import VARIANT_STORE_DIR, VCF_DIR
+from tbgen.variants import build_store, get_sample_variants, get_vcf_path, list_samples
+from tbgen.vcf import gt_allele_index
+
+# The reference genotype matrix holds the variants carried by every reference sample,
+# one row per (POS, REF, ALT) sorted by position and one bit per sample, 1 if the
+# sample carries the ALT allele, packed 8 samples per byte
+MATRIX_MAGIC = b"TBGMATRX"
+MATRIX_FORMAT_VERSION = 1
+MATRIX_PATH = os.path.join(DATA_DIR, "reference_matrix.bin")
+
+# Number of bits set in each byte value, to count the carriers of the variants
+BIT_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+VARIANT_PATTERN = re.compile(
+    r"^\s*(\d+)\s*(?:([ACGTN]+)\s*>\s*([ACGTN*]+))?\s*$", re.IGNORECASE
+)
+
+
+# This function merges the variants of the reference VCF files, read from the variant
+# store, into the bytes of a reference genotype matrix. Each ALT allele of a record is
+# a variant of its own, carried by the samples whose called allele it is. Samples
+# without a record at a position do not carry its variants, as the reference VCF files
+# hold variant sites only.
+def compile_matrix(vcf_dir=VCF_DIR, root=VARIANT_STORE_DIR):
+    samples = list_samples(vcf_dir)
+    calls = []
+    for sample_id, sample in enumerate(samples):
+        variants = pq.read_table(
+            get_sample_variants(sample, vcf_dir, root),
+            columns=["POS", "REF", "ALT", "GT"],
+        ).to_pandas()
+        alleles = [
+            alt.split(",")[index - 1] if index > 0 else None
+            for alt, index in zip(
+                variants["ALT"], map(gt_allele_index, variants["GT"].fillna("."))
+            )
+        ]
+        variants["ALT"] = alleles
+        variants = variants.dropna(subset=["ALT"])
+        variants["sample"] = sample_id
+        calls.append(variants[["POS", "REF", "ALT", "sample"]])
+
+    calls = pd.concat(calls, ignore_index=True)
+    variant_ids = calls.groupby(["POS", "REF", "ALT"], sort=True).ngroup().to_numpy()
+    variants = (
+        calls.drop_duplicates(["POS", "REF", "ALT"])
+        .sort_values(["POS", "REF", "ALT"])
+        .reset_index(drop=True)
+    )
+
+    sample_ids = calls["sample"].to_numpy()
+    bits = np.zeros((len(variants), -(-len(samples) // 8)), dtype=np.uint8)
+    np.bitwise_or.at(
+        bits,
+        (variant_ids, sample_ids // 8),
+        (0x80 >> (sample_ids % 8)).astype(np.uint8),
+    )
+
+    alleles = sorted(set(variants["REF"]) | set(variants["ALT"]))
+    allele_ids = {allele: i for i, allele in enumerate(alleles)}
+    arrays = {
+        "pos": variants["POS"].to_numpy(dtype=np.int64),
+        "ref": variants["REF"].map(allele_ids).to_numpy(dtype=np.uint32),
+        "alt": variants["ALT"].map(allele_ids).to_numpy(dtype=np.uint32),
+        # Samples with duplicate records of a variant carry it once
+        "carriers": BIT_COUNTS[bits].sum(axis=1, dtype=np.uint32),
+        "bits": bits,
+    }
+    header = {
+        "format_version": MATRIX_FORMAT_VERSION,
+        "hash": hash_sources([get_vcf_path(sample, vcf_dir) for sample in samples]),
+        "samples": samples,
+        "alleles": alleles,
+    }
+    return pack_artifact(MATRIX_MAGIC, MATRIX_FORMAT_VERSION, header, arrays)
+
+
+# Builds of a process are run one at a time, e.g. when several visitors of the web-app
+# ask for the matrix
+BUILD_LOCK = threading.Lock()
+
+
+# This function builds the variant store, on the given number of worker processes,
+# then compiles the reference genotype matrix and writes it to the given path. The
+# file is written atomically, so that readers never see a partial matrix. A build
+# waiting for another one is skipped if that one left an up-to-date matrix.
+def build_matrix(path=MATRIX_PATH, vcf_dir=VCF_DIR, root=VARIANT_STORE_DIR, jobs=None):
+    waited = not BUILD_LOCK.acquire(blocking=False)
+    if waited:
+        BUILD_LOCK.acquire()
+    try:
+        if waited and get_reference_matrix(path, vcf_dir) is not None:
+            return path
+        build_store(vcf_dir, root, jobs)
+        data = compile_matrix(vcf_dir, root)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    finally:
+        BUILD_LOCK.release()
+    return path
+
+
+# This class answers queries on a reference genotype matrix, read from a memory-mapped
+# file or from bytes without copying it. Variants are looked up by position with a
+# binary search, the carriers of a variant are the bits of its row, and the variants
+# carried by a sample are the bits of its column.
+class ReferenceMatrix:
+    def __init__(self, buffer):
+        header, self.arrays = unpack_artifact(
+            buffer, MATRIX_MAGIC, MATRIX_FORMAT_VERSION, "reference genotype matrix"
+        )
+        self.buffer = buffer
+        self.hash = header["hash"]
+        self.samples = header["samples"]
+        self.alleles = np.array(header["alleles"], dtype=object)
+        self.sample_ids = {sample: i for i, sample in enumerate(self.samples)}
+
+    def __len__(self):
+        return len(self.arrays["pos"])
+
+    # This function returns the rows of the variants between two positions, both
+    # included.
+    def find_range(self, start=None, end=None):
+        pos = self.arrays["pos"]
+        first = 0 if start is None else np.searchsorted(pos, start, side="left")
+        last = len(pos) if end is None else np.searchsorted(pos, end, side="right")
+        return np.arange(first, last)
+
+    # This function returns the rows of the variants at a position, optionally with the
+    # given REF and ALT alleles.
+    def find_variants(self, pos, ref=None, alt=None):
+        rows = self.find_range(pos, pos)
+        if ref is not None:
+            rows = rows[self.alleles[self.arrays["ref"][rows]] == ref.upper()]
+        if alt is not None:
+            rows = rows[self.alleles[self.arrays["alt"][rows]] == alt.upper()]
+        return rows
+
+    # This function returns the position, alleles and number of carriers of the
+    # variants of the given rows.
+    def variants_table(self, rows):
+        return pd.DataFrame(
+            {
+                "POS": self.arrays["pos"][rows],
+                "REF": self.alleles[self.arrays["ref"][rows]],
+                "ALT": self.alleles[self.arrays["alt"][rows]],
+                "Carriers": self.arrays["carriers"][rows].astype(np.int64),
+                "Frequency": self.arrays["carriers"][rows] / len(self.samples),
+            }
+        )
+
+    # This function returns whether each sample carries the variant of the given row.
+    def carrier_mask(self, row):
+        return np.unpackbits(self.arrays["bits"][row], count=len(self.samples)).astype(
+            bool
+        )
+
+    # This function returns the samples carrying the variant of the given row.
+    def variant_samples(self, row):
+        return [self.samples[i] for i in np.flatnonzero(self.carrier_mask(row))]
+
+    # This function returns the rows of the variants carried by a sample, optionally
+    # between two positions.
+    def sample_variants(self, sample, start=None, end=None):
+        sample_id = self.sample_ids[sample]
+        rows = self.find_range(start, end)
+        column = self.arrays["bits"][rows, sample_id // 8]
+        return rows[(column & (0x80 >> (sample_id % 8))) != 0]
+
+
+# This function parses a variant query such as "761155", "761155 C>T" or "761155C>T"
+# into its position and optional REF and ALT alleles, or returns None if it is not one.
+def parse_variant(query):
+    match = VARIANT_PATTERN.match(query)
+    if match is None:
+        return None
+    pos, ref, alt = match.groups()
+    return int(pos), ref, alt
+
+
+# This function memory-maps a reference genotype matrix file.
+def load_matrix(path=MATRIX_PATH):
+    with open(path, "rb") as f:
+        return ReferenceMatrix(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+# This function returns the reference genotype matrix at the given path, or None if it
+# is missing or out of date with the reference VCF files.
+def get_reference_matrix(path=MATRIX_PATH, vcf_dir=VCF_DIR):
+    try:
+        matrix = load_matrix(path)
+    except (OSError, ValueError):
+        return None
+    paths = [get_vcf_path(sample, vcf_dir) for sample in list_samples(vcf_dir)]
+    if matrix.hash != hash_sources(paths):
+        return None
+    return matrix
@@ -0,0 +1,347 @@
+import io
+import re
+import json
+import logging
+
+from urllib.parse import parse_qs, urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tbgen.barcoding import DEFAULT_MEMORY_BUDGET
+from tbgen.batch import GENOTYPING_ERRORS, genotype_stream
+from tbgen.panel import get_active_panels, get_barcode_index, get_barcode_positions
+from tbgen.panel import get_merged_positions, get_panels_hash
+from tbgen.profiling import log_stats, summarize_stats
+
+logger = logging.getLogger("tbgen")
+
+# Size of the reads from the body of a request
+READ_SIZE = 64 * 1024
+
+FILENAME_PATTERN = re.compile(r'filename="([^"]*)"')
+
+
+# This class reads the body of a request with a Content-Length header from the socket,
+# without reading past its end.
+class LimitedReader(io.RawIOBase):
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.remaining <= 0:
+            return 0
+        n = self.stream.readinto(memoryview(b)[: min(len(b), self.remaining)])
+        if n == 0:
+            raise EOFError("Request body is shorter than its Content-Length")
+        self.remaining -= n
+        return n
+
+
+# This class reads the body of a request sent with chunked transfer encoding, which
+# clients use to stream files whose size is not known in advance.
+class ChunkedReader(io.RawIOBase):
+    def __init__(self, stream):
+        self.stream = stream
+        self.chunk_left = 0
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.eof:
+            return 0
+        if self.chunk_left == 0:
+            size = int(self.stream.readline().split(b";")[0], 16)
+            if size == 0:
+                # Skip the trailer, up to the empty line ending the body
+                while self.stream.readline().strip():
+                    pass
+                self.eof = True
+                return 0
+            self.chunk_left = size
+
+        n = self.stream.readinto(memoryview(b)[: min(len(b), self.chunk_left)])
+        if n == 0:
+            raise EOFError("Request body ended in the middle of a chunk")
+        self.chunk_left -= n
+        if self.chunk_left == 0:
+            self.stream.readline()
+        return n
+
+
+# This class splits a multipart/form-data body into its parts while it is received.
+# Each part is read as a stream up to the next boundary, so that the files of a batch
+# are genotyped one after the other without holding any of them in memory.
+class MultipartReader:
+    def __init__(self, stream, boundary):
+        self.stream = stream
+        self.delimiter = b"\r\n--" + boundary.encode("latin-1")
+        # The first boundary is not preceded by a line break
+        self.buffer = b"\r\n"
+        self.part_done = True
+
+    def fill(self):
+        chunk = self.stream.read(READ_SIZE)
+        if not chunk:
+            raise EOFError("Multipart body ended before its closing boundary")
+        self.buffer += chunk
+
+    # This function returns the data of the current part up to size bytes, or b"" once
+    # the boundary ending it is reached. The end of the buffer is kept until more data
+    # is received when it could be the start of the boundary.
+    def read_part(self, size):
+        while not self.part_done:
+            i = self.buffer.find(self.delimiter)
+            if i == 0:
+                self.buffer = self.buffer[len(self.delimiter) :]
+                self.part_done = True
+                break
+            end = i if i > 0 else len(self.buffer) - len(self.delimiter) + 1
+            if end > 0:
+                data = self.buffer[: min(end, size)]
+                self.buffer = self.buffer[len(data) :]
+                return data
+            self.fill()
+        return b""
+
+    # This function yields the headers, as a dictionary with lowercase names, and the
+    # stream of each part of the body. The unread data of a part is skipped when the
+    # next part is requested.
+    def __iter__(self):
+        # Skip the preamble, up to the first boundary
+        self.part_done = False
+        while self.read_part(READ_SIZE):
+            pass
+
+        while True:
+            while len(self.buffer) < 2:
+                self.fill()
+            if self.buffer.startswith(b"--"):
+                # Closing boundary, the epilogue is read and ignored
+                while self.stream.read(READ_SIZE):
+                    pass
+                return
+
+            while (end := self.buffer.find(b"\r\n\r\n")) < 0:
+                self.fill()
+            headers = {}
+            for line in self.buffer[2:end].decode("latin-1").split("\r\n"):
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            self.buffer = self.buffer[end + 4 :]
+
+            self.part_done = False
+            yield headers, io.BufferedReader(MultipartPart(self), READ_SIZE)
+            while self.read_part(READ_SIZE):
+                pass
+
+
+class MultipartPart(io.RawIOBase):
+    def __init__(self, reader):
+        self.reader = reader
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.reader.read_part(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+
+# This class is an HTTP server calling lineages from the VCF files posted to it. The
+# files are genotyped on a pool of threads shared by all the requests, which bounds the
+# number of files genotyped at the same time. Each file is parsed as it is received,
+# so a worker thread is only held for as long as the client takes to send it. The
+# barcode panels are loaded when the server starts and stay in memory between requests.
+class GenotypingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        jobs=None,
+        memory_budget=DEFAULT_MEMORY_BUDGET,
+        panels=None,
+    ):
+        super().__init__(address, GenotypingRequestHandler)
+        self.executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="tbgen")
+        self.memory_budget = memory_budget
+        self.panels = panels or get_active_panels()
+
+        for panel in self.panels:
+            get_barcode_index(panel)
+            get_barcode_positions(panel)
+        get_merged_positions(self.panels)
+        self.panel_hash = get_panels_hash(self.panels)
+
+    def genotype(self, name, stream):
+        return self.executor.submit(
+            genotype_stream, name, stream, self.memory_budget, self.panels
+        ).result()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+
+
+# This class handles the requests of the genotyping server:
+# - GET /health returns the status of the server and its barcode panels
+# - POST /genotype genotypes the VCF, VCF.GZ or BCF file sent as the body of the
+#   request (named with the name query parameter), or every file of a
+#   multipart/form-data body, and returns the lineage calls as JSON, or as TSV with
+#   format=tsv or an Accept header of text/tab-separated-values
+class GenotypingRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "tbgen"
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data).encode(), "application/json")
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/health":
+            self.send_json(404, {"error": f"Not found: {self.path}"})
+            return
+        self.send_json(
+            200,
+            {
+                "status": "ok",
+                "panels": [panel.name for panel in self.server.panels],
+                "panel_hash": self.server.panel_hash,
+            },
+        )
+
+    # This function returns the body of the request as a stream, or None if its length
+    # is unknown.
+    def get_body(self):
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            return ChunkedReader(self.rfile)
+        if self.headers.get("Content-Length") is not None:
+            return LimitedReader(self.rfile, int(self.headers["Content-Length"]))
+        return None
+
+    # This function yields the name and stream of each file of the request
+    def iter_files(self, body, params):
+        if self.headers.get_content_type() != "multipart/form-data":
+            yield params.get("name", ["upload"])[0], body
+            # The reading stops after the last barcode position of sorted files, the
+            # rest of the body is skipped so that the connection can be reused
+            while body.read(READ_SIZE):
+                pass
+            return
+
+        boundary = self.headers.get_param("boundary")
+        if not boundary:
+            raise ValueError("Multipart body without boundary")
+        for n, (headers, stream) in enumerate(MultipartReader(body, boundary)):
+            filename = FILENAME_PATTERN.search(headers.get("content-disposition", ""))
+            # Form fields other than files are ignored
+            if filename is not None:
+                yield filename.group(1) or f"file{n + 1}", stream
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        if url.path != "/genotype":
+            self.close_connection = True
+            self.send_json(404, {"error": f"Not found: {self.path}"})
+            return
+
+        body = self.get_body()
+        if body is None:
+            self.close_connection = True
+            self.send_json(411, {"error": "Content-Length or chunked body required"})
+            return
+
+        file_format = params.get("format", [None])[0] or (
+            "tsv"
+            if "text/tab-separated-values" in self.headers.get("Accept", "")
+            else "json"
+        )
+
+        files = []
+        try:
+            for name, stream in self.iter_files(body, params):
+                try:
+                    _, result, stats = self.server.genotype(name, stream)
+                except GENOTYPING_ERRORS as e:
+                    # The rest of the file is not genotyped but skipped, and the next
+                    # parts of a multipart body are genotyped
+                    files.append((name, None, {}, e))
+                else:
+                    log_stats(name, stats)
+                    files.append((name, result, stats, None))
+        except (ValueError, EOFError) as e:
+            self.close_connection = True
+            self.send_json(400, {"error": f"Malformed request body: {e}"})
+            return
+
+        errors = [(name, error) for name, _, _, error in files if error is not None]
+        if file_format == "tsv":
+            self.send_tsv(files, errors)
+        else:
+            self.send_json(
+                400 if errors and len(errors) == len(files) else 200,
+                {
+                    "panel_hash": self.server.panel_hash,
+                    "files": [
+                        {
+                            "name": name,
+                            "lineages": (
+                                result.to_dict("records") if result is not None else []
+                            ),
+                            "stats": summarize_stats(stats) if stats else None,
+                            "warnings": stats.get("warnings", []),
+                            "error": (
+                                f"{type(error).__name__}: {error}"
+                                if error is not None
+                                else None
+                            ),
+                        }
+                        for name, result, stats, error in files
+                    ],
+                },
+            )
+
+    # TSV responses hold the lineage calls only, in the format of the command line, so
+    # any file that could not be genotyped fails the whole request.
+    def send_tsv(self, files, errors):
+        if errors:
+            message = "".join(
+                f"{name}: {type(error).__name__}: {error}\n" for name, error in errors
+            )
+            self.send_body(400, message.encode(), "text/plain; charset=utf-8")
+            return
+
+        out = io.StringIO()
+        for i, (_, result, _, _) in enumerate(files):
+            result.to_csv(out, sep="\t", index=False, header=i == 0)
+        self.send_body(
+            200, out.getvalue().encode(), "text/tab-separated-values; charset=utf-8"
+        )
+
+
+# This function runs the genotyping server until it is interrupted.
+def serve(host, port, jobs=None, memory_budget=DEFAULT_MEMORY_BUDGET, panels=None):
+    with GenotypingServer((host, port), jobs, memory_budget, panels) as server:
+        logger.info(f"Serving on http://{host}:{server.server_address[1]}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,271 @@
+import io
+import re
+import zlib
+import struct
+
+from tbgen.bcf import BCF_MAGIC, BCF_PREFIX, BcfHeader, iter_format_fields
+from tbgen.bcf import iter_record_offsets, read_site
+from tbgen.vcf import GZIP_MAGIC, BufferReader
+
+# Genome the barcoding SNPs are located on, with the names it is known by in the
+# reference FASTA files of common pipelines
+REFERENCE_CONTIG = "NC_000962.3"
+REFERENCE_LENGTH = 4411532
+REFERENCE_NAMES = ("NC_000962.3", "NC_000962", "AL123456.3", "Chromosome", "H37Rv")
+
+VCF_COLUMNS = ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]
+
+# Number of bytes read from the start of a file, and of bytes of text inflated from
+# them, to check its header and first records. The #CHROM line of files with many
+# thousands of samples takes hundreds of KB.
+SNIFF_SIZE = 256 * 1024
+SNIFF_TEXT_SIZE = 4 * 1024 * 1024
+INFLATE_STEP = 64 * 1024
+
+# Number of records checked after the header, and of bytes of text they are read from
+# at most, which is less than SNIFF_RECORDS records of files with many samples
+SNIFF_RECORDS = 10
+SNIFF_RECORDS_SIZE = 64 * 1024
+
+CONTIG_PATTERN = re.compile(r"##contig=<(.*)>")
+
+
+# This exception is raised for files that are not VCF files or are malformed, with a
+# message that can be shown to the user as it is.
+class VcfFormatError(ValueError):
+    pass
+
+
+# This function returns the text inflated from the first bytes of a gzipped file, which
+# may hold several gzip members (e.g. BGZF blocks), and whether it is the whole text.
+# Inflating stops as soon as the text holds the header and the records to check.
+def inflate_head(head, complete):
+    text = bytearray()
+    records_start = -1
+    data = head
+    try:
+        while data:
+            inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            while data and not inflater.eof:
+                text += inflater.decompress(data, INFLATE_STEP)
+                data = inflater.unconsumed_tail
+                if records_start < 0 and (header := text.find(b"\n#CHROM")) >= 0:
+                    records_start = text.find(b"\n", header + 1)
+                if len(text) >= SNIFF_TEXT_SIZE or (
+                    records_start >= 0
+                    and (
+                        len(text) - records_start >= SNIFF_RECORDS_SIZE
+                        or text.count(b"\n", records_start + 1) > SNIFF_RECORDS
+                    )
+                ):
+                    return bytes(text), False
+            if not inflater.eof:
+                return bytes(text), False
+            data = inflater.unused_data
+    except zlib.error as e:
+        raise VcfFormatError(f"File is not a valid gzip file ({e})")
+    return bytes(text), complete
+
+
+# This function checks the header lines and the records of the text of a VCF file, or
+# of the header of a BCF file, and returns the contigs declared by the header, with
+# their length, the columns of its #CHROM line (None if it is missing), and the CHROM
+# of the records and whether they all have a GT field.
+def read_lines(text, complete):
+    if not text.startswith(b"##fileformat=VCF"):
+        raise VcfFormatError("File does not start with a ##fileformat=VCF line")
+
+    lines = text.decode("utf-8", errors="replace").split("\n")
+    if not complete:
+        # The last line may be cut
+        lines.pop()
+
+    contigs = {}
+    columns = None
+    chroms = []
+    has_gt = True
+    for line in lines:
+        line = line.rstrip("\r")
+        if not line:
+            continue
+
+        if line.startswith("##"):
+            contig = CONTIG_PATTERN.match(line)
+            if contig is not None:
+                fields = dict(
+                    field.partition("=")[::2] for field in contig.group(1).split(",")
+                )
+                contigs[fields.get("ID")] = fields.get("length")
+            continue
+
+        if line.startswith("#"):
+            columns = line.split("\t")
+            if columns[:8] != VCF_COLUMNS:
+                raise VcfFormatError(
+                    "The #CHROM header line does not have the columns of a VCF file"
+                )
+            if len(columns) < 10 or columns[8] != "FORMAT":
+                raise VcfFormatError("VCF file has no samples")
+            continue
+
+        if columns is None:
+            raise VcfFormatError("Records are not preceded by a #CHROM header line")
+        fields = line.split("\t")
+        if len(fields) < 8 or not fields[1].isdigit():
+            raise VcfFormatError(f"Record {len(chroms) + 1} is malformed")
+        if len(fields) > len(columns):
+            raise VcfFormatError(
+                f"Record {len(chroms) + 1} has more samples than the #CHROM header line"
+            )
+        if len(fields) > 8 and not fields[8].startswith("GT"):
+            has_gt = False
+        chroms.append(fields[0])
+
+        if len(chroms) == SNIFF_RECORDS:
+            break
+
+    if columns is None and complete:
+        raise VcfFormatError("VCF file has no #CHROM header line")
+    return contigs, columns, chroms, has_gt
+
+
+# This function returns the warnings about the contigs declared by the header of a file
+# and the CHROM of its first records.
+def check_contigs(contigs, chroms, has_gt):
+    warnings = []
+    if not has_gt:
+        warnings.append("Records have no GT field, their genotypes are missing")
+
+    reference = {
+        name
+        for name, length in contigs.items()
+        if name in REFERENCE_NAMES or length == str(REFERENCE_LENGTH)
+    }
+    if contigs and not reference:
+        warnings.append(
+            f"No contig of the header is the {REFERENCE_CONTIG} genome"
+            f" ({REFERENCE_LENGTH:,} bp), lineages can only be called from variants"
+            " called against it"
+        )
+    elif len(contigs) > 1:
+        warnings.append(
+            f"The header declares {len(contigs)} contigs, variants on contigs other"
+            f" than {REFERENCE_CONTIG} may be matched against the barcoding SNPs"
+        )
+
+    others = sorted(set(chroms) - reference - set(REFERENCE_NAMES))
+    if others:
+        warnings.append(
+            f"Records are located on {', '.join(others)}, not on {REFERENCE_CONTIG}"
+        )
+    return warnings
+
+
+# This function checks the header and the first records of an uncompressed BCF file,
+# decoded from their binary form, see sniff_vcf.
+def sniff_bcf(head, complete):
+    if head[: len(BCF_MAGIC)] != BCF_MAGIC:
+        raise VcfFormatError(f"BCF version {head[3:4].hex()} is not supported")
+    header = BcfHeader.from_bytes(head)
+    if header is None:
+        if complete:
+            raise VcfFormatError("BCF header is truncated")
+        # The header is too long to be checked from the first bytes
+        return []
+
+    _, l_text = BCF_PREFIX.unpack_from(head)
+    records_start = BCF_PREFIX.size + l_text
+    contigs, _, _, _ = read_lines(
+        head[BCF_PREFIX.size : records_start].rstrip(b"\0"), True
+    )
+
+    chroms = []
+    has_gt = True
+    records = io.BytesIO(head[records_start:])
+    try:
+        for buffer, offset in iter_record_offsets(records):
+            chrom, _, _ = read_site(buffer, offset)
+            keys = [key for key, _ in iter_format_fields(buffer, offset)]
+            if keys and header.gt_key not in keys:
+                has_gt = False
+            chroms.append(header.contig_names.get(chrom, str(chrom)))
+            if len(chroms) == SNIFF_RECORDS:
+                break
+    except EOFError:
+        # The last record may be cut, unless the file is complete
+        if complete:
+            raise VcfFormatError(f"Record {len(chroms) + 1} is truncated")
+    except (struct.error, ValueError, IndexError, KeyError):
+        raise VcfFormatError(f"Record {len(chroms) + 1} is malformed")
+    return check_contigs(contigs, chroms, has_gt)
+
+
+# This function checks the header and the first records of a VCF or BCF file from its
+# first bytes, given as head, compressed or not, with complete telling whether they are
+# the whole file. It raises VcfFormatError if the file cannot be genotyped and returns
+# a list of warnings about files that can be genotyped but whose lineages may be wrong
+# or missing, e.g. because their variants were not called against NC_000962.3.
+def sniff_vcf(head, complete=True):
+    if len(head) == 0:
+        raise VcfFormatError("File is empty")
+    if head[: len(GZIP_MAGIC)] == GZIP_MAGIC:
+        head, complete = inflate_head(head, complete)
+
+    if head[:3] == b"BCF":
+        return sniff_bcf(head, complete)
+    if b"\0" in head[:1024]:
+        raise VcfFormatError("File is not a text VCF file")
+
+    contigs, columns, chroms, has_gt = read_lines(head, complete)
+    if columns is None:
+        # The header is too long to be checked from the first bytes
+        return []
+    return check_contigs(contigs, chroms, has_gt)
+
+
+# This function returns the first SNIFF_SIZE bytes of a VCF file, given as a path or as
+# a bytes-like object, and whether they are the whole file.
+def read_head(source):
+    raw = open(source, "rb") if isinstance(source, str) else BufferReader(source)
+    with raw:
+        head = raw.read(SNIFF_SIZE + 1)
+    return head[:SNIFF_SIZE], len(head) <= SNIFF_SIZE
+
+
+# This function checks a VCF file, given as a path or as a bytes-like object, before it
+# is parsed, see sniff_vcf.
+def check_vcf(source):
+    return sniff_vcf(*read_head(source))
+
+
+# This class reads the first bytes of a stream, which were read already to check it,
+# before the rest of the stream.
+class PrefixedReader(io.RawIOBase):
+    def __init__(self, prefix, stream):
+        self.prefix = memoryview(prefix)
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.prefix:
+            n = min(len(b), len(self.prefix))
+            b[:n] = self.prefix[:n]
+            self.prefix = self.prefix[n:]
+            return n
+        return self.stream.readinto(b)
+
+
+# This function checks a VCF file read from a binary stream, e.g. the body of an HTTP
+# request, from its first bytes, and returns the warnings and a stream reading the file
+# from its start.
+def check_vcf_stream(stream):
+    head = bytearray()
+    while len(head) < SNIFF_SIZE:
+        chunk = stream.read(SNIFF_SIZE - len(head))
+        if not chunk:
+            break
+        head += chunk
+    warnings = sniff_vcf(bytes(head), len(head) < SNIFF_SIZE)
+    return warnings, PrefixedReader(bytes(head), stream)
@@ -0,0 +1,129 @@
+import gzip
+import struct
+
+# Binning scheme of tabix indexes, CSI indexes store their own parameters
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+
+
+# This class holds the bins of a tabix (.tbi) or CSI (.csi) index. For every reference
+# sequence it keeps a dictionary of bins, each with its list of chunks given as pairs
+# of virtual offsets, and the minimal offsets used to skip chunks located before a
+# region: the linear index for tabix, and the offset of each bin for CSI.
+class VcfIndex:
+    def __init__(self, min_shift, depth, refs, linear=None, loffsets=None):
+        self.min_shift = min_shift
+        self.depth = depth
+        self.refs = refs
+        self.linear = linear
+        self.loffsets = loffsets
+
+    # This function returns the bins overlapping the 0-based region [beg, end).
+    def reg2bins(self, beg, end):
+        bins = []
+        end -= 1
+        s = self.min_shift + self.depth * 3
+        t = 0
+        for level in range(self.depth + 1):
+            bins.extend(range(t + (beg >> s), t + (end >> s) + 1))
+            s -= 3
+            t += 1 << (level * 3)
+        return bins
+
+    # This function returns the smallest file offset at which a record overlapping the
+    # 0-based position beg of the given reference sequence can be found.
+    def min_offset(self, ref, beg):
+        if self.linear is not None:
+            linear = self.linear[ref]
+            if not linear:
+                return 0
+            return linear[min(beg >> self.min_shift, len(linear) - 1)]
+
+        # For CSI, use the offset of the deepest existing bin containing the position
+        loffsets = self.loffsets[ref]
+        bin_ = ((1 << (self.depth * 3)) - 1) // 7 + (beg >> self.min_shift)
+        while bin_ > 0 and bin_ not in loffsets:
+            bin_ = (bin_ - 1) >> 3
+        return loffsets.get(bin_, 0)
+
+    # This function returns the sorted and merged list of chunks holding all records
+    # located at the given 1-based positions, on any reference sequence of the index.
+    def query(self, positions):
+        chunks = set()
+        for ref, bins in enumerate(self.refs):
+            for pos in positions:
+                min_off = self.min_offset(ref, pos - 1)
+                for bin_ in self.reg2bins(pos - 1, pos):
+                    for start, end in bins.get(bin_, ()):
+                        if end > min_off:
+                            chunks.add((start, end))
+
+        merged = []
+        for start, end in sorted(chunks):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [tuple(chunk) for chunk in merged]
+
+
+# This class reads the little-endian values of an index one after another.
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def skip(self, n):
+        self.pos += n
+
+
+# This function parses a tabix or CSI index, given as a path or as the bytes of the
+# index file.
+def read_index(source):
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            source = f.read()
+    data = gzip.decompress(bytes(source))
+    reader = _Reader(data)
+    magic = data[:4]
+    reader.skip(4)
+
+    if magic == b"TBI\x01":
+        n_ref, _, _, _, _, _, _, l_nm = reader.unpack("<8i")
+        reader.skip(l_nm)
+        refs, linear = [], []
+        for _ in range(n_ref):
+            bins = {}
+            (n_bin,) = reader.unpack("<i")
+            for _ in range(n_bin):
+                bin_, n_chunk = reader.unpack("<Ii")
+                chunks = reader.unpack(f"<{2 * n_chunk}Q")
+                bins[bin_] = list(zip(chunks[::2], chunks[1::2]))
+            (n_intv,) = reader.unpack("<i")
+            refs.append(bins)
+            linear.append(reader.unpack(f"<{n_intv}Q"))
+        return VcfIndex(TBI_MIN_SHIFT, TBI_DEPTH, refs, linear=linear)
+
+    if magic == b"CSI\x01":
+        min_shift, depth, l_aux = reader.unpack("<3i")
+        reader.skip(l_aux)
+        (n_ref,) = reader.unpack("<i")
+        refs, loffsets = [], []
+        for _ in range(n_ref):
+            bins, offsets = {}, {}
+            (n_bin,) = reader.unpack("<i")
+            for _ in range(n_bin):
+                bin_, loffset, n_chunk = reader.unpack("<IQi")
+                chunks = reader.unpack(f"<{2 * n_chunk}Q")
+                bins[bin_] = list(zip(chunks[::2], chunks[1::2]))
+                offsets[bin_] = loffset
+            refs.append(bins)
+            loffsets.append(offsets)
+        return VcfIndex(min_shift, depth, refs, loffsets=loffsets)
+
+    raise ValueError("Index is neither a tabix nor a CSI index")
@@ -0,0 +1,242 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from tbgen.bcf import BcfReader
+from tbgen.panel import DATA_DIR
+from tbgen.vcf import open_vcf, read_vcf_samples
+
+VCF_DIR = os.path.join(DATA_DIR, "VCF")
+VCF_EXTENSION = ".vcf.gz"
+
+# The variants of the reference VCF files are stored as one Parquet file per sample, in
+# sample=<name> directories, so that the variants of a sample are read without opening
+# the files of the other samples
+VARIANT_STORE_DIR = os.environ.get(
+    "TBGEN_VARIANT_STORE", os.path.join(DATA_DIR, "variant_store")
+)
+VARIANTS_FILE = "variants.parquet"
+
+# Rows of each row group, whose POS and TYPE statistics let position windows and type
+# filters skip the other row groups of a file
+ROW_GROUP_SIZE = 256
+
+VARIANT_TYPES = ("SNP", "MNP", "INS", "DEL", "MIXED")
+
+VARIANT_SCHEMA = pa.schema(
+    [
+        ("CHROM", pa.dictionary(pa.int8(), pa.string())),
+        ("POS", pa.int64()),
+        ("ID", pa.string()),
+        ("REF", pa.string()),
+        ("ALT", pa.string()),
+        ("TYPE", pa.dictionary(pa.int8(), pa.string())),
+        ("QUAL", pa.float64()),
+        ("FILTER", pa.string()),
+        ("GT", pa.string()),
+        ("DP", pa.int32()),
+        ("INFO", pa.string()),
+    ]
+)
+VARIANT_COLUMNS = VARIANT_SCHEMA.names
+
+VCF_COLUMNS = ["CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"]
+
+
+# This function returns the type of a variant from its alleles: SNP, MNP, insertion or
+# deletion, or MIXED for multiallelic sites whose ALT alleles are of different types.
+def get_variant_type(ref, alt):
+    types = set()
+    for allele in alt.split(","):
+        if len(allele) == len(ref):
+            types.add("SNP" if len(ref) == 1 else "MNP")
+        else:
+            types.add("INS" if len(allele) > len(ref) else "DEL")
+    return types.pop() if len(types) == 1 else "MIXED"
+
+
+# This function reads the records of a VCF file into a table of VARIANT_SCHEMA, with
+# the GT and DP values of its first sample.
+def read_variants(vcf_path):
+    with open_vcf(vcf_path) as vcf:
+        if isinstance(vcf, BcfReader):
+            raise ValueError(f"{vcf_path}: BCF files are not supported in the store")
+        samples = read_vcf_samples(vcf)
+        df = pd.read_csv(
+            vcf,
+            sep="\t",
+            header=None,
+            names=VCF_COLUMNS + samples[:1],
+            usecols=range(len(VCF_COLUMNS) + min(len(samples), 1)),
+            dtype=str,
+            keep_default_na=False,
+        )
+
+    # FORMAT keys may differ between records, e.g. GT:AD:DP:GQ:PL and GT:AD:DP:GQ
+    values = [
+        dict(zip(keys.split(":"), genotype.split(":")))
+        for keys, genotype in zip(
+            df["FORMAT"], df[samples[0]] if samples else [""] * len(df)
+        )
+    ]
+    gt = [value.get("GT") for value in values]
+    dp = pd.to_numeric(
+        pd.Series([value.get("DP") for value in values], dtype=object),
+        errors="coerce",
+    )
+
+    return pa.Table.from_pandas(
+        pd.DataFrame(
+            {
+                "CHROM": df["CHROM"],
+                "POS": df["POS"].astype(np.int64),
+                "ID": df["ID"],
+                "REF": df["REF"],
+                "ALT": df["ALT"],
+                "TYPE": [
+                    get_variant_type(ref, alt) for ref, alt in zip(df["REF"], df["ALT"])
+                ],
+                "QUAL": pd.to_numeric(df["QUAL"], errors="coerce"),
+                "FILTER": df["FILTER"],
+                "GT": gt,
+                "DP": dp.astype("Int32"),
+                "INFO": df["INFO"],
+            }
+        ),
+        schema=VARIANT_SCHEMA,
+        preserve_index=False,
+    )
+
+
+def get_sample_path(sample, root=VARIANT_STORE_DIR):
+    return os.path.join(root, f"sample={sample}", VARIANTS_FILE)
+
+
+def get_vcf_path(sample, vcf_dir=VCF_DIR):
+    return os.path.join(vcf_dir, f"{sample}{VCF_EXTENSION}")
+
+
+# This function returns whether a sample is missing from the store or was stored before
+# its VCF file last changed.
+def is_outdated(sample, vcf_dir=VCF_DIR, root=VARIANT_STORE_DIR):
+    path = get_sample_path(sample, root)
+    return not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(
+        get_vcf_path(sample, vcf_dir)
+    )
+
+
+# This function converts a VCF file into the Parquet file of its sample in the store,
+# sorted by position. The file is written atomically, so that readers never see a
+# partial file, even when two processes convert the same sample.
+def convert_vcf(vcf_path, sample, root=VARIANT_STORE_DIR):
+    table = read_variants(vcf_path).sort_by("POS")
+    path = get_sample_path(sample, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pq.write_table(
+                table,
+                f,
+                row_group_size=ROW_GROUP_SIZE,
+                compression="zstd",
+                write_statistics=True,
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+
+# This function returns the Parquet file of a sample in the store, converting its VCF
+# file first if it is outdated, so that the store is filled as samples are viewed.
+def get_sample_variants(sample, vcf_dir=VCF_DIR, root=VARIANT_STORE_DIR):
+    vcf_path = get_vcf_path(sample, vcf_dir)
+    if not os.path.exists(vcf_path):
+        raise FileNotFoundError(f"VCF file not found: {vcf_path}")
+    if is_outdated(sample, vcf_dir, root):
+        convert_vcf(vcf_path, sample, root)
+    return get_sample_path(sample, root)
+
+
+# This function returns the reference samples, named after their VCF files, in order.
+def list_samples(vcf_dir=VCF_DIR):
+    return sorted(
+        name[: -len(VCF_EXTENSION)]
+        for name in os.listdir(vcf_dir)
+        if name.endswith(VCF_EXTENSION)
+    )
+
+
+# This function converts the VCF files of the samples that are missing from the store
+# or out of date, on a pool of worker processes, and returns the number of samples
+# converted. Workers are spawned instead of forked, as the store may be built from the
+# multi-threaded Streamlit server.
+def build_store(vcf_dir=VCF_DIR, root=VARIANT_STORE_DIR, jobs=None):
+    samples = list_samples(vcf_dir)
+    outdated = [sample for sample in samples if is_outdated(sample, vcf_dir, root)]
+    if not outdated:
+        return 0
+
+    with ProcessPoolExecutor(
+        max_workers=jobs, mp_context=get_context("spawn")
+    ) as executor:
+        list(
+            executor.map(
+                convert_vcf,
+                [get_vcf_path(sample, vcf_dir) for sample in outdated],
+                outdated,
+                [root] * len(outdated),
+                chunksize=16,
+            )
+        )
+    return len(outdated)
+
+
+# This function returns a page of the variants of a sample, with the given columns
+# only, and the number of variants matching the filters: a window of positions, both
+# ends included, and a list of variant types. Filters are applied while the file is
+# scanned, skipping the row groups whose statistics rule them out, only the requested
+# columns are decoded, and the scan stops at the end of the page.
+def query_variants(
+    sample,
+    start=None,
+    end=None,
+    types=None,
+    columns=None,
+    offset=0,
+    limit=None,
+    vcf_dir=VCF_DIR,
+    root=VARIANT_STORE_DIR,
+):
+    dataset = ds.dataset(get_sample_variants(sample, vcf_dir, root), format="parquet")
+
+    condition = None
+    for expression in (
+        ds.field("POS") >= start if start is not None else None,
+        ds.field("POS") <= end if end is not None else None,
+        ds.field("TYPE").isin(list(types)) if types else None,
+    ):
+        if expression is not None:
+            condition = expression if condition is None else condition & expression
+
+    scanner = dataset.scanner(columns=columns or VARIANT_COLUMNS, filter=condition)
+    total = scanner.count_rows()
+
+    batches = []
+    n_rows = 0
+    stop = total if limit is None else min(offset + limit, total)
+    for batch in scanner.to_batches():
+        if n_rows >= stop:
+            break
+        batches.append(batch)
+        n_rows += batch.num_rows
+    page = pa.Table.from_batches(batches, scanner.projected_schema)
+    return page.slice(offset, stop - offset).to_pandas(), total
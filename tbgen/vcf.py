@@ -0,0 +1,376 @@
+import io
+import os
+import gzip
+import codecs
+import numpy as np
+import pandas as pd
+
+from typing import TextIO
+from functools import lru_cache
+from tbgen.bcf import BCF_MAGIC, BcfReader
+from tbgen.bgzf import BGZF_HEADER_SIZE, BgzfReader, is_bgzf, read_block, read_range
+from tbgen.panel import get_barcode_positions, get_merged_positions
+from tbgen.profiling import span
+from tbgen.tabix import read_index
+
+
+# This function reads the VCF header lines and returns the sample names. The file is
+# left positioned at the first data record, so the records can be streamed afterwards.
+def read_vcf_samples(file: TextIO):
+    header = next(line for line in file if not line.startswith("##"))
+    return header.strip().split("\t")[9:]
+
+
+# This function takes a VCF file positioned after the header and a set of positions as
+# input and yields the position, reference allele, alternate alleles and genotype
+# fields of every record located at one of these positions. The position is checked
+# before the sample columns are split, and the reading stops as soon as a sorted file
+# has passed the last position of interest. The number of records read is stored in
+# the optional stats dictionary.
+def iter_vcf_records(file: TextIO, positions, stats=None):
+    last_pos = max(positions, default=0)
+    prev_pos = 0
+    is_sorted = True
+    n_records = 0
+
+    for n_records, line in enumerate(file, 1):
+        pos = int(line.split("\t", 2)[1])
+
+        if pos < prev_pos:
+            is_sorted = False
+        elif pos > last_pos and is_sorted:
+            break
+        prev_pos = pos
+
+        if pos not in positions:
+            continue
+
+        fields = line.strip().split("\t")
+        yield pos, fields[3], fields[4], fields[9:]
+
+    if stats is not None:
+        stats["records"] = n_records
+
+
+# Allele index of missing genotypes in a genotype matrix
+MISSING_ALLELE = -1
+
+
+# This function takes the GT value of a genotype as input and returns the index of the
+# called allele, i.e. the last non-missing allele of the genotype, or MISSING_ALLELE if
+# the genotype is missing. GT values are few, so the results are cached.
+@lru_cache(maxsize=1024)
+def gt_allele_index(gt):
+    called = [int(x) for x in gt.replace("|", "/").split("/") if x != "."]
+    return called[-1] if called else MISSING_ALLELE
+
+
+# This class holds the genotypes of the records read from a VCF file as a matrix of
+# called allele indexes (variants x samples, int8), together with the sample names and
+# the position and alleles (REF first, then ALT) of each record. Memory scales with one
+# byte per genotype rather than one Python object per genotype.
+class GenotypeMatrix:
+    def __init__(self, samples, pos, alleles, gt):
+        self.samples = samples
+        self.pos = pos
+        self.alleles = alleles
+        self.gt = gt
+
+    # This function returns the genotypes of the records located at the given
+    # positions, e.g. those of a single barcode panel.
+    def select(self, positions):
+        keep = np.isin(self.pos, np.fromiter(positions, dtype=np.int64))
+        if keep.all():
+            return self
+        return GenotypeMatrix(
+            self.samples,
+            self.pos[keep],
+            [alleles for alleles, k in zip(self.alleles, keep) if k],
+            self.gt[keep],
+        )
+
+    # This function returns the genotypes in long format, with one row per sample and
+    # record holding the called allele (NaN if missing) in the ALT column.
+    def to_dataframe(self):
+        n_variants, n_samples = self.gt.shape
+        flat_alleles = np.array(
+            [allele for alleles in self.alleles for allele in alleles] + [np.nan],
+            dtype=object,
+        )
+        offsets = np.cumsum([0] + [len(alleles) for alleles in self.alleles])[:-1]
+        flat_index = np.where(
+            self.gt >= 0, offsets[:, None] + self.gt, len(flat_alleles) - 1
+        )
+
+        df = pd.DataFrame(
+            {
+                "Sample": np.tile(np.array(self.samples, dtype=object), n_variants),
+                "POS": np.repeat(self.pos, n_samples),
+                "REF": np.repeat(
+                    np.array([alleles[0] for alleles in self.alleles], dtype=object),
+                    n_samples,
+                ),
+                "ALT": flat_alleles[flat_index.ravel()],
+            }
+        )
+        return df.astype(
+            {"Sample": "object", "REF": "object", "ALT": "object", "POS": "int64"}
+        )
+
+
+# This function takes a VCF file positioned after the header, its number of samples and
+# a set of positions as input and yields the position, the alleles (REF first, then
+# ALT) and the called allele index of every sample of the records located at these
+# positions.
+def iter_vcf_genotypes(file: TextIO, n_samples, positions, stats=None):
+    for pos, ref, alt, genotypes in iter_vcf_records(file, positions, stats):
+        if len(genotypes) > n_samples:
+            raise IndexError(f"Record at position {pos} has more samples than header")
+
+        row = np.full(n_samples, MISSING_ALLELE, dtype=np.int8)
+        row[: len(genotypes)] = [
+            gt_allele_index(genotype.partition(":")[0]) for genotype in genotypes
+        ]
+        yield pos, (ref, *alt.split(",")), row
+
+
+# This function reads the records of a VCF or BCF file located at the given positions
+# into a GenotypeMatrix. The records of BCF files are decoded from their binary form.
+# The time spent parsing and the number of samples and of records at these positions
+# are stored in the optional stats dictionary.
+def read_genotype_matrix(file, positions, stats=None):
+    with span(stats, "parse"):
+        if isinstance(file, BcfReader):
+            samples = file.read_samples()
+            records = file.iter_genotypes(positions, stats)
+        else:
+            samples = read_vcf_samples(file)
+            records = iter_vcf_genotypes(file, len(samples), positions, stats)
+        n_samples = len(samples)
+
+        # The rows are written into the matrix rather than stacked once all are read,
+        # which would hold the genotypes twice. Files hold a record per position at
+        # most, unless they have duplicate records, for which the matrix is grown.
+        # Its pages are only allocated once written to.
+        gt = np.empty((max(len(positions), 1), n_samples), dtype=np.int8)
+        pos_list, alleles_list = [], []
+        for pos, alleles, row in records:
+            if row.max(initial=MISSING_ALLELE) >= len(alleles):
+                raise IndexError(
+                    f"Genotype allele index out of range at position {pos}"
+                )
+
+            if len(pos_list) == len(gt):
+                gt.resize((2 * len(gt), n_samples), refcheck=False)
+            gt[len(pos_list)] = row
+            pos_list.append(pos)
+            alleles_list.append(alleles)
+
+        gt.resize((len(pos_list), n_samples), refcheck=False)
+
+    if stats is not None:
+        stats["samples"] = n_samples
+        stats["barcode_records"] = len(pos_list)
+    return GenotypeMatrix(samples, np.array(pos_list, dtype=np.int64), alleles_list, gt)
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+# This class reads an in-memory buffer (bytes, bytearray or memoryview) as a binary
+# stream without copying it, so uploads can be decoded straight from memory.
+class BufferReader(io.RawIOBase):
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(min(len(b), len(self._view) - self._pos), 0)
+        b[:n] = self._view[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+# This class wraps a binary stream and adds the time spent reading it, i.e. reading
+# and inflating a gzipped file, to a stage of the stats dictionary.
+class TimedReader(io.RawIOBase):
+    def __init__(self, stream, stats, name):
+        self.stream = stream
+        self.stats = stats
+        self.name = name
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        with span(self.stats, self.name):
+            return self.stream.readinto(b)
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+# This function opens a binary stream of the uncompressed content of a VCF or BCF file
+# for reading: BCF files, told by their magic bytes, are read with a BcfReader and VCF
+# files as text. With a stats dictionary, the time spent reading the stream is stored
+# as the given stage.
+def open_content(stream, stats=None, name="read"):
+    if stats is not None:
+        stream = TimedReader(stream, stats, name)
+    stream = io.BufferedReader(stream)
+    if stream.peek(len(BCF_MAGIC))[: len(BCF_MAGIC)] == BCF_MAGIC:
+        return BcfReader(stream)
+    return io.TextIOWrapper(stream)
+
+
+# This class iterates over the lines of a BGZF-compressed VCF file like a text file,
+# but only yields the header lines and the records located at the given positions. The
+# tabix or CSI index of the file is used to inflate only the blocks holding the records
+# at these positions instead of the whole file.
+class IndexedVcfReader:
+    def __init__(self, raw, index, positions, stats=None):
+        self.raw = raw
+        self.index = read_index(index)
+        self.positions = positions
+        self.stats = stats
+        self._lines = self.iter_lines()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._lines)
+
+    def iter_lines(self):
+        yield from self.iter_header()
+
+        cache = {}
+        for start, end in self.index.query(self.positions):
+            with span(self.stats, "inflate"):
+                data = read_range(self.raw, start, end, cache)
+            lines = data.decode().split("\n")
+            yield from (line for line in lines if line)
+
+    # This function yields the header lines, stopping after the #CHROM line.
+    def iter_header(self):
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        offset = 0
+        pending = ""
+        while True:
+            with span(self.stats, "inflate"):
+                block_size, block = read_block(self.raw, offset)
+            if block_size == 0:
+                return
+            offset += block_size
+
+            lines = (pending + decoder.decode(block)).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line
+                if not line.startswith("##"):
+                    return
+
+    def close(self):
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# This function opens a BGZF-compressed VCF or BCF file, given as a seekable binary
+# stream, with the content of its index, for reading only the records located at the
+# given positions.
+def open_indexed(raw, index, positions, stats=None):
+    with span(stats, "inflate"):
+        _, block = read_block(raw, 0)
+    if block[: len(BCF_MAGIC)] == BCF_MAGIC:
+        raw.seek(0)
+        return BcfReader(gzip.GzipFile(fileobj=raw), raw, read_index(index))
+    return IndexedVcfReader(raw, index, positions, stats)
+
+
+# This function opens a VCF, gzipped VCF or BCF file, with its optional tabix or CSI
+# index, for reading. Compressed files and BCF files are detected by their magic bytes
+# rather than by their extension. If an index is given and the file is BGZF-compressed,
+# only the records located at the given positions, the barcode positions of the active
+# panels by default, are read. Otherwise, the blocks of BGZF-compressed files are
+# inflated in parallel, see BgzfReader. The time spent reading and inflating the file
+# is stored in the optional stats dictionary.
+def open_vcf(path, index=None, stats=None, positions=None):
+    with open(path, "rb") as f:
+        magic = f.read(BGZF_HEADER_SIZE)
+    if index is not None and is_bgzf(magic):
+        positions = positions or get_merged_positions()
+        return open_indexed(open(path, "rb"), index, positions, stats)
+    if is_bgzf(magic):
+        return open_content(BgzfReader(open(path, "rb")), stats, "inflate")
+    if magic[: len(GZIP_MAGIC)] == GZIP_MAGIC:
+        return open_content(gzip.open(path, "rb"), stats, "inflate")
+    return open_content(open(path, "rb"), stats, "read")
+
+
+# This function opens an in-memory VCF, gzipped VCF or BCF file, with the optional
+# content of its index file, for reading. The buffer is decompressed and decoded while
+# it is read, without intermediate copies.
+def open_vcf_buffer(buffer, index=None, stats=None, positions=None):
+    raw = BufferReader(buffer)
+    if index is not None and is_bgzf(buffer[:BGZF_HEADER_SIZE]):
+        positions = positions or get_merged_positions()
+        return open_indexed(raw, index, positions, stats)
+    if is_bgzf(buffer[:BGZF_HEADER_SIZE]):
+        return open_content(BgzfReader(raw), stats, "inflate")
+    if buffer[: len(GZIP_MAGIC)] == GZIP_MAGIC:
+        return open_content(gzip.GzipFile(fileobj=raw), stats, "inflate")
+    return open_content(raw, stats, "read")
+
+
+# This function opens a binary stream of a VCF, gzipped VCF or BCF file, e.g. the body
+# of an HTTP request, for reading while it is received, without reading it whole first.
+def open_vcf_stream(stream, stats=None):
+    stream = io.BufferedReader(stream)
+    magic = stream.peek(BGZF_HEADER_SIZE)[:BGZF_HEADER_SIZE]
+    if is_bgzf(magic):
+        return open_content(BgzfReader(stream), stats, "inflate")
+    if magic[: len(GZIP_MAGIC)] == GZIP_MAGIC:
+        return open_content(gzip.GzipFile(fileobj=stream), stats, "inflate")
+    return open_content(stream, stats, "read")
+
+
+# This function returns the path of the tabix or CSI index next to a VCF file, or None
+# if the file is not indexed.
+def find_vcf_index(path):
+    for extension in (".tbi", ".csi"):
+        if os.path.exists(path + extension):
+            return path + extension
+    return None
+
+
+# This function returns the genotypes of the records located at barcode positions in
+# long format, with one row per sample and record.
+def vcf_to_dataframe(file: TextIO, stats=None):
+    return read_genotype_matrix(file, get_barcode_positions(), stats).to_dataframe()
@@ -0,0 +1,51 @@
+import io
+import numpy as np
+
+from tbgen.artifact import PANEL_MAGIC, PANEL_FORMAT_VERSION
+from tbgen.artifact import CompiledPanel, compile_panel, pack_artifact, unpack_artifact
+from tbgen.barcoding import barcoding
+from tbgen.panel import DEFAULT_PANEL, PanelDefinition
+
+# A level 1 only panel with an odd number of SNPs, whose uint32 row array ends on a
+# 4-byte boundary, followed by the empty arrays of its missing barcode table
+ODD_PANEL = """\
+lineage\tPOS\tREF\tALT\tlevel
+A\t1849\tC\tA\t1
+B\t1977\tA\tG\t1
+C\t4013\tT\tC\t1
+"""
+
+VCF = """\
+##fileformat=VCFv4.2
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1
+NC_000962.3\t1849\t.\tC\tA\t.\tPASS\t.\tGT\t1
+NC_000962.3\t1977\t.\tA\tG\t.\tPASS\t.\tGT\t1
+"""
+
+
+def write_panel(tmp_path):
+    path = tmp_path / "odd.tsv"
+    path.write_text(ODD_PANEL)
+    return str(path)
+
+
+def test_pack_artifact_pads_trailing_empty_arrays():
+    arrays = {"row": np.arange(3, dtype=np.uint32), "empty": np.empty(0, np.int64)}
+    data = pack_artifact(PANEL_MAGIC, PANEL_FORMAT_VERSION, {}, arrays)
+    assert len(data) % 8 == 0
+
+    _, unpacked = unpack_artifact(data, PANEL_MAGIC, PANEL_FORMAT_VERSION, "artifact")
+    np.testing.assert_array_equal(unpacked["row"], arrays["row"])
+    assert unpacked["empty"].shape == (0,)
+
+
+def test_odd_panel_without_barcode_table(tmp_path):
+    panel = CompiledPanel(compile_panel(write_panel(tmp_path)))
+    assert panel.levels_table()["lineage"].tolist() == ["A", "B", "C"]
+    assert panel.barcode_table().empty
+
+
+def test_genotype_with_odd_panel(tmp_path):
+    odd = PanelDefinition("odd", write_panel(tmp_path))
+    df = barcoding(io.StringIO(VCF), panels=(DEFAULT_PANEL, odd))
+    assert df["odd level_1"].tolist() == ["A,B"]
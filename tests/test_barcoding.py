@@ -0,0 +1,117 @@
+import io
+import numpy as np
+
+from tbgen.barcoding import SINGLE_SNP_WARNING, barcoding, count_hits, resolve_lineages
+
+# Barcoding SNPs of levels 1 and 2 of the bundled panel: L8, L1, L2, L4 and their
+# sublineages L2.2 (modern), L2.2 (ancient) and L4.9
+RECORDS = [
+    (221190, "G", "T"),  # L8
+    (272678, "C", "T"),  # L1
+    (282892, "C", "T"),  # L2
+    (420008, "A", "G"),  # L4.9
+    (615938, "G", "A"),  # L1
+    (811753, "C", "T"),  # L2
+    (903913, "T", "C"),  # L4.9
+    (1288698, "G", "A"),  # L2.2 (ancient)
+    (1477596, "C", "T"),  # L2.2 (modern)
+    (2505085, "G", "A"),  # L2.2 (ancient)
+    (2825466, "G", "A"),  # L4
+    (2847281, "A", "G"),  # L4
+]
+
+# Genotypes of each sample at each record, in the order of RECORDS. The SNPs of L4 and
+# L4.9 are carried by every lineage but L4 and L4.9, which are called when none of
+# them is present
+SAMPLES = {
+    "L1_het": ["0", "0/1", "0", "1", "1", "0", "1", "0", "0", "0", "1", "1"],
+    "L2_both": ["0", "0", "1", "1", "0", "1", "1", "1", "1", "1", "1", "1"],
+    "L2_ancient": ["0", "0", "1", "1", "0", "1", "1", "1", "0", "1", "1", "1"],
+    "L8_single": ["1", "0", "0", "1", "0", "0", "1", "0", "0", "0", "1", "1"],
+    "L1_single": ["0", "0", "0", "1", "1", "0", "1", "0", "0", "0", "1", "./."],
+    "no_hits": ["0"] * len(RECORDS),
+    "missing": ["."] * len(RECORDS),
+}
+
+# Calls of the original, loop-based implementation on the same file
+EXPECTED = {
+    "L1_het": ("L1", ""),
+    "L2_both": ("L2", "L2.2 (modern)"),
+    "L2_ancient": ("L2", "L2.2 (ancient)"),
+    "L8_single": ("L8", ""),
+    "L1_single": ("L1" + SINGLE_SNP_WARNING, ""),
+    "no_hits": ("L4", "L4.9"),
+    "missing": ("L4", "L4.9"),
+}
+
+
+def make_vcf(records=RECORDS, samples=SAMPLES):
+    lines = [
+        "##fileformat=VCFv4.2",
+        "\t".join(
+            ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"]
+            + list(samples)
+        ),
+    ]
+    for i, (pos, ref, alt) in enumerate(records):
+        genotypes = [sample[i] for sample in samples.values()]
+        lines.append(
+            "\t".join(
+                ["NC_000962.3", str(pos), ".", ref, alt, ".", "PASS", ".", "GT"]
+                + genotypes
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+def test_barcoding_calls_levels_1_and_2():
+    df = barcoding(io.StringIO(make_vcf()))
+    calls = {
+        row.Sample: (row.level_1, row.level_2) for row in df.itertuples(index=False)
+    }
+    assert calls == EXPECTED
+    assert (df[["level_3", "level_4", "level_5"]] == "").all().all()
+
+
+def test_barcoding_does_not_depend_on_sample_batches():
+    df = barcoding(io.StringIO(make_vcf()))
+    batched = barcoding(io.StringIO(make_vcf()), memory_budget=1)
+    assert df.equals(batched)
+
+
+def test_count_hits():
+    calls = np.array([["A", None], ["B", "A"], ["A", None]], dtype=object)
+    lineages, counts, first = count_hits(calls)
+    assert lineages == ["A", "B"]
+    np.testing.assert_array_equal(counts, [[2, 1], [1, 0]])
+    # Lineages that are not carried get the number of records
+    np.testing.assert_array_equal(first, [[0, 1], [1, 3]])
+
+
+def test_resolve_lineages_orders_by_first_hit_and_adds_absence_marker_last():
+    calls = np.array([["B", None], ["A", "A"], ["B", "A"], ["A", None]], dtype=object)
+    assert resolve_lineages(calls, absent="X") == ["B, A, X", "A, X"]
+    # The absence marker is not called when one of its SNPs is present
+    assert resolve_lineages(calls, absent="A") == ["B", ""]
+
+
+def test_resolve_lineages_warns_on_single_snps():
+    calls = np.array([["A", "S1"], ["B", None], ["B", None]], dtype=object)
+    assert resolve_lineages(calls, single_snp=("S",)) == [
+        "A" + SINGLE_SNP_WARNING + ", B",
+        "S1",
+    ]
+
+
+def test_resolve_lineages_keeps_modern_of_modern_ancient_pair():
+    calls = np.array(
+        [["M", "M"], ["M", None], ["A", "A"], ["A", "A"], ["C", None], ["C", None]],
+        dtype=object,
+    )
+    # The modern lineage is called after all the others, the ancient one not at all
+    assert resolve_lineages(calls, modern_ancient=("M", "A")) == [
+        "C, M",
+        "M" + SINGLE_SNP_WARNING,
+    ]
+    # Either lineage alone is called as usual
+    assert resolve_lineages(calls[2:], modern_ancient=("M", "A")) == ["A, C", "A"]
@@ -0,0 +1,145 @@
+import io
+import gzip
+import os
+import numpy as np
+import pytest
+
+from test_barcoding import EXPECTED
+from tbgen.barcoding import barcoding
+from tbgen.bcf import BCF_PREFIX, RECORD_POS, RECORD_SIZES, BcfHeader, called_alleles
+from tbgen.bcf import iter_record_offsets, read_descriptor, read_string
+from tbgen.panel import get_barcode_positions
+from tbgen.sniff import VcfFormatError, check_vcf
+from tbgen.vcf import open_vcf, open_vcf_buffer, read_genotype_matrix
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+BCF = os.path.join(DATA, "barcoding.bcf")
+VCF = os.path.join(DATA, "barcoding.vcf")
+
+
+def read_bcf():
+    with open(BCF, "rb") as f:
+        return gzip.decompress(f.read())
+
+
+def records_start(data):
+    return BCF_PREFIX.size + BCF_PREFIX.unpack_from(data)[1]
+
+
+# This function changes the type of the GT values of the record at the given position
+# of an uncompressed BCF file to an unknown one.
+def corrupt_gt(data, pos):
+    data = bytearray(data)
+    start = records_start(data)
+    for buffer, offset in iter_record_offsets(io.BytesIO(data[start:])):
+        if RECORD_POS.unpack_from(buffer, offset)[0] + 1 == pos:
+            l_shared, _ = RECORD_SIZES.unpack_from(buffer, offset)
+            # The GT key and its typed value descriptor follow the shared part
+            data[start + offset + RECORD_SIZES.size + l_shared + 2] = 0x16
+            return bytes(data)
+    raise ValueError(f"No record at position {pos}")
+
+
+def read_calls(file):
+    with file:
+        df = barcoding(file)
+    return {row.Sample: (row.level_1, row.level_2) for row in df.itertuples()}
+
+
+@pytest.mark.parametrize(
+    "open_bcf",
+    [
+        lambda: open_vcf(BCF),
+        lambda: open_vcf(BCF, BCF + ".csi"),
+        lambda: open_vcf_buffer(read_bcf()),
+    ],
+)
+def test_bcf_calls_equal_vcf_calls(open_bcf):
+    assert read_calls(open_vcf(VCF)) == EXPECTED
+    assert read_calls(open_bcf()) == EXPECTED
+
+
+def test_bcf_genotypes_equal_vcf_genotypes():
+    positions = get_barcode_positions()
+    with open_vcf(VCF) as file:
+        expected = read_genotype_matrix(file, positions)
+    with open_vcf(BCF) as file:
+        genotypes = read_genotype_matrix(file, positions)
+    assert genotypes.samples == expected.samples
+    assert genotypes.alleles == expected.alleles
+    np.testing.assert_array_equal(genotypes.pos, expected.pos)
+    np.testing.assert_array_equal(genotypes.gt, expected.gt)
+
+
+def test_header_dictionaries_follow_idx_fields():
+    header = BcfHeader(
+        "##fileformat=VCFv4.2\n"
+        '##FILTER=<ID=PASS,Description="All filters passed",IDX=0>\n'
+        '##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth",IDX=3>\n'
+        '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype",IDX=5>\n'
+        '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Depth",IDX=3>\n'
+        "##contig=<ID=plasmid,IDX=1>\n"
+        "##contig=<ID=NC_000962.3,length=4411532,IDX=0>\n"
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2\n"
+    )
+    assert header.strings == {"PASS": 0, "DP": 3, "GT": 5}
+    assert header.gt_key == 5
+    assert header.contig_names == {0: "NC_000962.3", 1: "plasmid"}
+    assert header.samples == ["S1", "S2"]
+
+
+def test_header_dictionaries_without_idx_fields():
+    header = BcfHeader(
+        '##FILTER=<ID=q10,Description="Quality">\n'
+        '##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">\n'
+        '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n'
+        '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Depth">\n'
+        "##contig=<ID=NC_000962.3>\n"
+    )
+    # PASS is always first, IDs shared by several dictionaries are counted once
+    assert header.strings == {"PASS": 0, "q10": 1, "DP": 2, "GT": 3}
+    assert header.contigs == {"NC_000962.3": 0}
+
+
+def test_typed_values_are_decoded():
+    # Three int16 values
+    assert read_descriptor(b"\x32", 0) == (2, 3, 1)
+    # A count of 15 or more follows the descriptor as a typed integer
+    assert read_descriptor(b"\x00\xf7\x11\x14", 1) == (7, 20, 4)
+    assert read_descriptor(b"\xf3\x12\x2c\x01", 0) == (3, 300, 4)
+    # Strings are padded with NUL bytes
+    assert read_string(b"\x47ACG\0next", 0) == ("ACG", 5)
+
+
+def test_called_alleles():
+    values = np.array(
+        [
+            [2, 4],  # 0/1
+            [3, 5],  # 0|1
+            [4, 2],  # 1/0
+            [6, -127],  # 2, haploid with padding
+            [0, 0],  # ./.
+            [0, 4],  # ./1
+            [2, 0],  # 0/.
+        ],
+        dtype=np.int8,
+    )
+    np.testing.assert_array_equal(called_alleles(values), [1, 1, 0, 2, -1, 1, 0])
+    assert called_alleles(values).dtype == np.int8
+
+
+def test_truncated_bcf_is_an_error():
+    data = read_bcf()
+    truncated = data[: records_start(data) + 100]
+    with pytest.raises(VcfFormatError, match="truncated"):
+        check_vcf(truncated)
+    with pytest.raises(EOFError, match="BCF record is truncated"):
+        barcoding(open_vcf_buffer(truncated))
+
+
+def test_malformed_bcf_record_is_an_error():
+    data = read_bcf()
+    with pytest.raises(ValueError, match="at position 272678 is malformed"):
+        barcoding(open_vcf_buffer(corrupt_gt(data, 272678)))
+    with pytest.raises(VcfFormatError, match="Record 1 is malformed"):
+        check_vcf(corrupt_gt(data, 1000))
@@ -0,0 +1,83 @@
+import io
+import os
+import struct
+import zlib
+import pytest
+
+from tbgen.bgzf import BgzfReader, read_block, read_range
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+
+def make_block(data, crc=None, size=None):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = b"\x1f\x8b\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0"
+    trailer = struct.pack(
+        "<II",
+        zlib.crc32(data) if crc is None else crc,
+        len(data) if size is None else size,
+    )
+    return header + struct.pack("<H", len(cdata) + 25) + cdata + trailer
+
+
+def make_bgzf(chunks):
+    return b"".join(make_block(chunk) for chunk in chunks) + make_block(b"")
+
+
+def read_all(data, threads):
+    with BgzfReader(io.BytesIO(data), threads) as reader:
+        return reader.read()
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_blocks_are_read_in_order(threads):
+    chunks = [f"block {i}\n".encode() * (i + 1) for i in range(50)]
+    assert read_all(make_bgzf(chunks), threads) == b"".join(chunks)
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_fixture_inflates_to_plain_file(threads):
+    with open(os.path.join(DATA, "barcoding.vcf.gz"), "rb") as f:
+        data = f.read()
+    with open(os.path.join(DATA, "barcoding.vcf"), "rb") as f:
+        assert read_all(data, threads) == f.read()
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+@pytest.mark.parametrize("trailer", [{"crc": 0}, {"size": 1}])
+def test_crc_and_size_mismatches_are_errors(threads, trailer):
+    data = make_block(b"first\n") + make_block(b"second\n", **trailer)
+    with pytest.raises(ValueError, match="CRC check failed"):
+        read_all(data, threads)
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_truncated_final_block_is_an_error(threads):
+    data = make_bgzf([b"first\n", b"second\n"])[:-30]
+    with pytest.raises(EOFError):
+        read_all(data, threads)
+
+
+def test_invalid_block_is_an_error():
+    with pytest.raises(ValueError, match="Invalid BGZF block at offset 0"):
+        read_all(b"\x1f\x8b\x08\x00" + b"\0" * 30, 1)
+
+
+def test_read_range_across_block_boundaries():
+    chunks = [b"abcdef", b"ghij", b"", b"klmnop"]
+    raw = io.BytesIO(make_bgzf(chunks))
+    offsets = [0]
+    for _ in chunks:
+        offsets.append(offsets[-1] + read_block(raw, offsets[-1])[0])
+
+    # From the middle of the first block to the middle of the last one
+    start, end = offsets[0] << 16 | 3, offsets[3] << 16 | 2
+    assert read_range(raw, start, end) == b"defghijkl"
+    # Up to the start of a block, which is not read
+    assert read_range(raw, start, offsets[1] << 16) == b"def"
+    # Within a block, with the cache shared by consecutive ranges
+    cache = {}
+    assert read_range(raw, offsets[3] << 16, offsets[3] << 16 | 2, cache) == b"kl"
+    assert read_range(raw, offsets[3] << 16 | 2, offsets[3] << 16 | 4, cache) == b"mn"
+    assert list(cache) == [offsets[3]]
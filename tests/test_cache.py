@@ -0,0 +1,50 @@
+import os
+
+from tbgen.__main__ import main
+from tbgen.batch import get_cached
+from tbgen.cache import CACHE_VERSION, ResultCache
+
+
+def test_only_older_versions_are_removed(tmp_path):
+    older = tmp_path / f"v{CACHE_VERSION - 1}-{'0' * 16}"
+    other_panels = tmp_path / f"v{CACHE_VERSION}-{'f' * 16}"
+    older.mkdir()
+    other_panels.mkdir()
+
+    cache = ResultCache(str(tmp_path))
+    assert not older.exists()
+    assert other_panels.exists()
+    assert os.path.isdir(cache.directory)
+
+
+def test_calls_cached_without_evidence_count_as_one_miss(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("key", "calls")
+
+    stats = {}
+    assert get_cached(cache, "key", stats, evidence=True) is None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    cache.put("key-evidence", "matrix")
+    assert get_cached(cache, "key", stats, evidence=True) == "calls"
+    assert stats["evidence"] == "matrix"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_command_line_counts_hits_of_worker_processes(tmp_path, capsys):
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"{i}.vcf"
+        path.write_text(
+            "##fileformat=VCFv4.2\n"
+            f"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS{i}\n"
+            "NC_000962.3\t615938\t.\tG\tA\t.\tPASS\t.\tGT\t1\n"
+        )
+        paths.append(str(path))
+    argv = ["genotype", *paths, "-o", str(tmp_path / "out.tsv"), "-j", "2"]
+    argv += ["--cache-dir", str(tmp_path / "cache")]
+
+    assert main(argv) == 0
+    assert "cache: 0 hit(s), 2 miss(es)" in capsys.readouterr().err
+    assert main(argv) == 0
+    assert "cache: 2 hit(s), 0 miss(es)" in capsys.readouterr().err
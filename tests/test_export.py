@@ -0,0 +1,40 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from tbgen.__main__ import main
+
+# A VCF file without records at barcoding positions, which has no calls, followed by
+# one with calls
+NO_CALLS = """\
+##fileformat=VCFv4.2
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1
+NC_000962.3\t100\t.\tA\tG\t.\tPASS\t.\tGT\t1
+"""
+
+CALLS = """\
+##fileformat=VCFv4.2
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS2
+NC_000962.3\t615938\t.\tG\tA\t.\tPASS\t.\tGT\t1
+"""
+
+
+def read_output(path):
+    if path.suffix == ".parquet":
+        return pq.read_table(path)
+    with pa.ipc.open_file(path) as reader:
+        return reader.read_all()
+
+
+@pytest.mark.parametrize("extension", ["parquet", "arrow"])
+def test_columnar_output_starting_with_a_file_without_calls(tmp_path, extension):
+    (tmp_path / "a.vcf").write_text(NO_CALLS)
+    (tmp_path / "b.vcf").write_text(CALLS)
+    output = tmp_path / f"lineages.{extension}"
+
+    argv = ["genotype", str(tmp_path / "a.vcf"), str(tmp_path / "b.vcf")]
+    assert main(argv + ["-o", str(output), "-j", "1", "--no-cache"]) == 0
+
+    table = read_output(output)
+    assert table.column("Sample").to_pylist() == ["S2"]
+    assert all(field.type == pa.string() for field in table.schema)
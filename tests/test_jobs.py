@@ -0,0 +1,123 @@
+import gzip
+import os
+import time
+import pytest
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from test_barcoding import EXPECTED, make_vcf
+from tbgen import sniff
+from tbgen.cache import ResultCache
+from tbgen.jobs import Job, JobManager
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+
+def read_vcf():
+    with open(os.path.join(DATA, "barcoding.vcf"), "rb") as f:
+        return f.read()
+
+
+def run(manager, files, evidence=False):
+    job = manager.submit(files, evidence)
+    assert job.wait(60)
+    return job
+
+
+def test_claim_returns_the_future_of_the_first_file_with_the_same_content():
+    job = Job("id", "key", ["a.vcf", "a.vcf.gz", "b.vcf", "b.vcf.gz"])
+    assert job.claim(0, "a") is None
+    original = job.claim(1, "a")
+    assert job.claim(2, "b") is None
+    failed = job.claim(3, "b")
+
+    job.add(0, pd.DataFrame({"Sample": ["S1"]}), {})
+    assert original.result() == "a.vcf"
+    error = ValueError("Invalid file")
+    job.add(2, error=error)
+    assert failed.exception() is error
+
+
+def test_identical_files_are_genotyped_once():
+    vcf = read_vcf()
+    other = make_vcf().encode()
+    manager = JobManager(max_workers=1)
+    job = run(
+        manager,
+        [
+            ("a.vcf", vcf, None),
+            ("a.vcf.gz", gzip.compress(vcf), None),
+            ("b.vcf", other, None),
+        ],
+    )
+    assert job.duplicates == {"a.vcf.gz": "a.vcf"}
+    assert job.stats["a.vcf.gz"]["duplicate_of"] == "a.vcf"
+    assert [len(result) for result in job.get_results()] == [len(EXPECTED)] * 2
+    assert not job.errors
+
+
+def test_files_are_parsed_on_the_process_pool():
+    # Records on a contig other than NC_000962.3 raise a warning when checked
+    vcf = read_vcf().replace(b"\nNC_000962.3\t", b"\nchr1\t")
+    with ProcessPoolExecutor(1) as pool:
+        manager = JobManager(pool, max_workers=2)
+        job = run(manager, [("a.vcf", vcf, None), ("b.vcf", make_vcf().encode(), None)])
+    assert not job.errors
+    assert [len(result) for result in job.get_results()] == [len(EXPECTED)] * 2
+    assert job.stats["a.vcf"]["warnings"]
+    assert job.stats["a.vcf"]["records"] > 0
+    assert "dispatch" in job.stats["a.vcf"]["spans"]
+
+
+def test_files_are_checked_once(monkeypatch):
+    checked = []
+    read_head = sniff.read_head
+    monkeypatch.setattr(
+        sniff, "read_head", lambda data: checked.append(data) or read_head(data)
+    )
+    run(JobManager(max_workers=1), [("a.vcf", read_vcf(), None)])
+    assert len(checked) == 1
+
+
+def test_identical_job_is_returned_and_reconnected_to():
+    files = [("a.vcf", read_vcf(), None)]
+    manager = JobManager(max_workers=1)
+    job = run(manager, files)
+    assert manager.submit(files) is job
+    assert manager.submit(files, evidence=True) is not job
+    # A page reloaded with the id of the job in its URL gets it back
+    assert manager.get(job.id) is job
+    assert manager.get("unknown") is None
+
+
+def test_finished_jobs_expire(tmp_path):
+    files = [("a.vcf", read_vcf(), None)]
+    cache = ResultCache(str(tmp_path))
+    manager = JobManager(cache=cache, max_workers=1, ttl=0.1)
+    job = run(manager, files)
+    assert manager.get(job.id) is job
+
+    time.sleep(0.2)
+    # Expired jobs are removed when the next one is submitted, the same files then
+    # give a new job whose results are taken from the cache
+    resubmitted = run(manager, files)
+    assert resubmitted is not job
+    assert manager.get(job.id) is None
+    assert resubmitted.stats["a.vcf"]["cached"]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_running_jobs_do_not_expire():
+    manager = JobManager(max_workers=1, ttl=0)
+    job = Job("id", "key", ["a.vcf"])
+    manager.jobs[job.id] = job
+    manager.keys[job.key] = job.id
+    run(manager, [("b.vcf", read_vcf(), None)])
+    assert manager.get(job.id) is job
+
+
+@pytest.mark.parametrize("data", [b"", b"not a VCF\n"])
+def test_files_that_cannot_be_genotyped_are_errors(data):
+    job = run(JobManager(max_workers=1), [("a.vcf", data, None)])
+    assert list(job.errors) == ["a.vcf"]
+    assert job.get_results() == []
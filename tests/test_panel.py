@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+from tbgen.panel import DEFAULT_PANEL, PanelDefinition, get_barcode_index
+
+PANEL = """\
+lineage\tPOS\tREF\tALT\tlevel
+A\t100\tC\tT\t1
+B\t100\tC\tG\t1
+A.1\t200\tG\tA\t2
+A.1.1\t200\tG\tA\t3
+C\t300\tT\tC\t1
+D\t300\tT\tC\t1
+"""
+
+
+def test_barcode_index_of_bundled_panel_holds_every_snp():
+    levels = pd.read_csv(DEFAULT_PANEL.levels_path, sep="\t")
+    barcode_index = get_barcode_index()
+    assert list(barcode_index.columns) == [f"level_{i}" for i in range(1, 6)]
+    assert barcode_index.index.is_unique
+
+    for row in levels.itertuples(index=False):
+        lineages = barcode_index.loc[(row.POS, row.REF, row.ALT), f"level_{row.level}"]
+        assert row.lineage in lineages
+
+
+def test_barcode_index_pivots_snps_by_position_and_alleles(tmp_path):
+    path = tmp_path / "panel.tsv"
+    path.write_text(PANEL)
+    barcode_index = get_barcode_index(PanelDefinition("test", str(path)))
+
+    assert list(barcode_index.index) == [
+        (100, "C", "G"),
+        (100, "C", "T"),
+        (200, "G", "A"),
+        (300, "T", "C"),
+    ]
+    # ALT alleles of the same position are told apart
+    assert barcode_index.loc[(100, "C", "T"), "level_1"] == "A"
+    assert barcode_index.loc[(100, "C", "G"), "level_1"] == "B"
+    # A SNP defining lineages at several levels gets one column per level
+    assert barcode_index.loc[(200, "G", "A"), "level_2"] == "A.1"
+    assert barcode_index.loc[(200, "G", "A"), "level_3"] == "A.1.1"
+    assert pd.isna(barcode_index.loc[(200, "G", "A"), "level_1"])
+    # SNPs defining several lineages within the same level are concatenated
+    assert barcode_index.loc[(300, "T", "C"), "level_1"] == "CD"
+    assert barcode_index[["level_4", "level_5"]].isna().all().all()
+    assert np.issubdtype(barcode_index.index.get_level_values("POS").dtype, np.integer)
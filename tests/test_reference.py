@@ -0,0 +1,51 @@
+import gzip
+import numpy as np
+
+from tbgen.reference import ReferenceMatrix, compile_matrix
+
+HEADER = """\
+##fileformat=VCFv4.2
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE
+"""
+
+# The variants of each sample, as (POS, REF, ALT, GT). S1 has a duplicate record of
+# 100 C>T, and the second ALT allele of its record at 300.
+SAMPLES = {
+    "S1": [(100, "C", "T", "1"), (100, "C", "T", "1"), (300, "G", "A,C", "2")],
+    "S2": [(100, "C", "T", "1"), (200, "A", "G", "0"), (300, "G", "A", "1")],
+    "S3": [(200, "A", "G", "1/1"), (300, "G", "C", "./.")],
+}
+
+
+def write_vcf(path, records):
+    lines = [
+        f"NC_000962.3\t{pos}\t.\t{ref}\t{alt}\t.\tPASS\t.\tGT\t{gt}\n"
+        for pos, ref, alt, gt in records
+    ]
+    with gzip.open(path, "wt") as f:
+        f.write(HEADER + "".join(lines))
+
+
+def test_compile_matrix(tmp_path):
+    vcf_dir = tmp_path / "VCF"
+    vcf_dir.mkdir()
+    for sample, records in SAMPLES.items():
+        write_vcf(vcf_dir / f"{sample}.vcf.gz", records)
+
+    matrix = ReferenceMatrix(compile_matrix(str(vcf_dir), str(tmp_path / "store")))
+    assert matrix.samples == ["S1", "S2", "S3"]
+
+    table = matrix.variants_table(np.arange(len(matrix)))
+    assert table[["POS", "REF", "ALT", "Carriers"]].values.tolist() == [
+        [100, "C", "T", 2],
+        [200, "A", "G", 1],
+        [300, "G", "A", 1],
+        [300, "G", "C", 1],
+    ]
+    assert [matrix.variant_samples(row) for row in range(len(matrix))] == [
+        ["S1", "S2"],
+        ["S3"],
+        ["S2"],
+        ["S1"],
+    ]
+    assert list(matrix.sample_variants("S1")) == [0, 3]
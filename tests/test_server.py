@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+import pytest
+
+from http.client import HTTPConnection
+from test_barcoding import EXPECTED
+from tbgen.server import GenotypingServer
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+
+@pytest.fixture
+def server():
+    server = GenotypingServer(("127.0.0.1", 0), jobs=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def read_vcf():
+    with open(os.path.join(DATA, "barcoding.vcf"), "rb") as f:
+        vcf = f.read()
+    # Records past the last barcode position, which are not read, several times larger
+    # than the reads of the body
+    record = (
+        b"NC_000962.3\t%d\t.\tA\tC\t.\tPASS\t.\tGT" + b"\t1" * len(EXPECTED) + b"\n"
+    )
+    return vcf + b"".join(
+        record % pos for pos in range(4406750, 4411500) for _ in range(4)
+    )
+
+
+def post(connection, path, body, chunked=False):
+    connection.request("POST", path, body, encode_chunked=chunked)
+    response = connection.getresponse()
+    return response, json.loads(response.read())
+
+
+def read_calls(data):
+    (file,) = data["files"]
+    assert file["error"] is None
+    return {row["Sample"]: (row["level_1"], row["level_2"]) for row in file["lineages"]}
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_plain_bodies_posted_on_one_connection(server, chunked):
+    vcf = read_vcf()
+    chunks = [vcf[i : i + 100_000] for i in range(0, len(vcf), 100_000)]
+    connection = HTTPConnection(*server.server_address, timeout=30)
+    for _ in range(2):
+        response, data = post(
+            connection,
+            "/genotype?name=barcoding.vcf",
+            iter(chunks) if chunked else vcf,
+            chunked,
+        )
+        assert response.status == 200
+        assert response.getheader("Connection") != "close"
+        assert read_calls(data) == EXPECTED
+    connection.close()
+
+
+def test_connection_is_reused_after_a_file_that_cannot_be_genotyped(server):
+    connection = HTTPConnection(*server.server_address, timeout=30)
+    response, data = post(connection, "/genotype?name=bad.vcf", b"not a VCF\n" * 50_000)
+    assert response.status == 400
+    assert data["files"][0]["error"].startswith("VcfFormatError")
+
+    response, data = post(connection, "/genotype?name=barcoding.vcf", read_vcf())
+    assert response.status == 200
+    assert read_calls(data) == EXPECTED
+    connection.close()
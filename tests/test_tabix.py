@@ -0,0 +1,73 @@
+import gzip
+import os
+import pytest
+
+from test_barcoding import EXPECTED, RECORDS
+from tbgen.barcoding import barcoding
+from tbgen.panel import get_barcode_positions
+from tbgen.tabix import read_index
+from tbgen.vcf import open_vcf, open_vcf_buffer
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+VCF = os.path.join(DATA, "barcoding.vcf.gz")
+INDEXES = [VCF + ".tbi", VCF + ".csi"]
+
+
+def read_records(file, positions):
+    with file:
+        # Indexed readers yield lines without their line terminator
+        return [
+            line.rstrip("\n")
+            for line in file
+            if not line.startswith("#") and int(line.split("\t")[1]) in positions
+        ]
+
+
+@pytest.mark.parametrize("index", INDEXES)
+def test_indexed_records_equal_full_scan(index):
+    positions = get_barcode_positions()
+    records = read_records(open_vcf(VCF), positions)
+    assert len(records) == len(RECORDS)
+    assert read_records(open_vcf(VCF, index), positions) == records
+
+    with open(VCF, "rb") as f, open(index, "rb") as i:
+        buffer = open_vcf_buffer(f.read(), i.read())
+    assert read_records(buffer, positions) == records
+
+
+@pytest.mark.parametrize("index", INDEXES)
+def test_indexed_calls_equal_full_scan(index):
+    with open_vcf(VCF) as file:
+        df = barcoding(file)
+    with open_vcf(VCF, index) as file:
+        assert barcoding(file).equals(df)
+    calls = {row.Sample: (row.level_1, row.level_2) for row in df.itertuples()}
+    assert calls == EXPECTED
+
+
+@pytest.mark.parametrize("index", INDEXES)
+def test_query_reads_chunks_crossing_block_boundaries(index):
+    chunks = read_index(index).query(get_barcode_positions())
+    # Chunks are sorted and disjoint
+    assert all(a[1] < b[0] for a, b in zip(chunks, chunks[1:]))
+    # The fixture is written in small blocks, some records are split across two
+    assert any(start >> 16 != end >> 16 for start, end in chunks)
+
+
+@pytest.mark.parametrize("index", INDEXES)
+def test_query_of_positions_without_records(index):
+    positions = {1, 2, 4_411_000}
+    assert read_records(open_vcf(VCF, index, positions=positions), positions) == []
+
+
+def test_tbi_and_csi_indexes_find_the_same_records():
+    tbi, csi = (read_index(index) for index in INDEXES)
+    assert (tbi.min_shift, tbi.depth) == (14, 5)
+    assert tbi.linear is not None and csi.loffsets is not None
+    for pos, _, _ in RECORDS:
+        assert tbi.query({pos}) and csi.query({pos})
+
+
+def test_invalid_index_is_an_error():
+    with pytest.raises(ValueError, match="neither a tabix nor a CSI index"):
+        read_index(gzip.compress(b"BAI\x01" + b"\0" * 16))
@@ -0,0 +1,83 @@
+import io
+import numpy as np
+
+from tbgen.vcf import MISSING_ALLELE, gt_allele_index, iter_vcf_records
+from tbgen.vcf import read_genotype_matrix
+
+
+def make_header(samples):
+    columns = "\t".join(f"S{i}" for i in range(samples))
+    return f"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{columns}\n"
+
+
+def make_records(positions, samples=1):
+    return "".join(
+        f"NC_000962.3\t{pos}\t.\tA\tG\t.\tPASS\t.\tGT" + "\t1" * samples + "\n"
+        for pos in positions
+    )
+
+
+def test_iter_vcf_records_yields_records_at_positions_only():
+    records = list(iter_vcf_records(io.StringIO(make_records([1, 5, 7, 9], 2)), {5, 9}))
+    assert records == [(5, "A", "G", ["1", "1"]), (9, "A", "G", ["1", "1"])]
+
+
+def test_iter_vcf_records_stops_after_last_position_of_sorted_file():
+    file = io.StringIO(make_records([1, 5, 7, 9, 11]))
+    stats = {}
+    records = list(iter_vcf_records(file, {5, 7}, stats))
+    assert [pos for pos, *_ in records] == [5, 7]
+    # The first record past the last position is read, the others are not
+    assert stats["records"] == 4
+    assert file.readline().split("\t")[1] == "11"
+
+
+def test_iter_vcf_records_reads_unsorted_file_to_the_end():
+    file = io.StringIO(make_records([1, 3, 2, 9, 5]))
+    stats = {}
+    records = list(iter_vcf_records(file, {2, 5}, stats))
+    assert [pos for pos, *_ in records] == [2, 5]
+    assert stats["records"] == 5
+
+
+def test_gt_allele_index():
+    assert gt_allele_index("0") == 0
+    assert gt_allele_index("0/1") == 1
+    assert gt_allele_index("1|2") == 2
+    assert gt_allele_index("./1") == 1
+    assert gt_allele_index("./.") == MISSING_ALLELE
+    assert gt_allele_index(".") == MISSING_ALLELE
+
+
+def test_read_genotype_matrix():
+    vcf = (
+        "##fileformat=VCFv4.2\n"
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2\n"
+        "NC_000962.3\t5\t.\tA\tG,T\t.\tPASS\t.\tGT:DP\t2:10\t./.:0\n"
+        "NC_000962.3\t6\t.\tC\tT\t.\tPASS\t.\tGT\t0\t1\n"
+        "NC_000962.3\t9\t.\tC\tT\t.\tPASS\t.\tGT\t1\t1\n"
+    )
+    stats = {}
+    genotypes = read_genotype_matrix(io.StringIO(vcf), {5, 9}, stats)
+    assert genotypes.samples == ["S1", "S2"]
+    np.testing.assert_array_equal(genotypes.pos, [5, 9])
+    assert genotypes.alleles == [("A", "G", "T"), ("C", "T")]
+    np.testing.assert_array_equal(genotypes.gt, [[2, MISSING_ALLELE], [1, 1]])
+    assert genotypes.gt.dtype == np.int8
+    assert (stats["samples"], stats["barcode_records"]) == (2, 2)
+
+
+def test_read_genotype_matrix_with_more_records_than_positions():
+    vcf = make_header(2) + "".join(
+        f"NC_000962.3\t5\t.\tA\tG\t.\tPASS\t.\tGT\t{i % 2}\t1\n" for i in range(5)
+    )
+    genotypes = read_genotype_matrix(io.StringIO(vcf), {5})
+    np.testing.assert_array_equal(genotypes.pos, [5] * 5)
+    np.testing.assert_array_equal(genotypes.gt, [[i % 2, 1] for i in range(5)])
+    assert genotypes.gt.flags.owndata
+
+
+def test_read_genotype_matrix_without_records():
+    genotypes = read_genotype_matrix(io.StringIO(make_header(3)), {5, 9})
+    assert genotypes.gt.shape == (0, 3)
+    assert genotypes.gt.dtype == np.int8
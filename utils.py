@@ -9,6 +9,7 @@ from st_aggrid import JsCode
 from st_pages import show_pages_from_config
 from streamlit_extras.switch_page_button import switch_page
 from streamlit_lottie import st_lottie, st_lottie_spinner
+from tbgen.export import EXPORT_FORMATS, export_table
 
 
 def get_random_key(size=6, chars=string.ascii_lowercase + string.digits):
@@ -277,3 +278,34 @@ def get_cell_style():
                 """
     )
     return cellstyle_jscode
+
+
+# This function shows the download of a table, which is only serialized when it is
+# requested: the format is chosen first, then the file is prepared with a button, which
+# shows the button downloading it. The table may be given as a function returning it,
+# so that it is only built as well when requested.
+def download_table(df, file_name, key, label="table", formats=EXPORT_FORMATS):
+    fmt_col, prepare_col, download_col, mock = st.columns([2, 2, 2, 3])
+    with fmt_col:
+        file_format = st.selectbox(
+            f"Format of the {label}",
+            list(formats),
+            format_func=lambda file_format: formats[file_format][0],
+            key=f"{key}-format",
+            label_visibility="collapsed",
+        )
+    with prepare_col:
+        prepare = st.button(f"📦 Prepare {label}", key=f"{key}-prepare")
+    if prepare:
+        with download_col:
+            with st.spinner("Preparing..."):
+                data = export_table(df() if callable(df) else df, file_format)
+            st.download_button(
+                label=f"💾 Download {label}",
+                data=data,
+                file_name=f"{file_name}.{file_format}",
+                mime=formats[file_format][1],
+                key=f"{key}-download",
+            )
+    with mock:
+        pass